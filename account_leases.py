@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+
+class LeaseBackend:
+    """Storage for account leases. Expiry times are wall-clock seconds, so the
+    clocks of all nodes sharing a backend must agree to well within the TTL.
+    """
+
+    async def acquire(self, user_id: int, node_id: str, expires_at: float, now: float) -> bool:
+        raise NotImplementedError
+
+    async def renew(self, node_id: str, expires_at: float, now: float) -> Optional[List[int]]:
+        """Extend the node's unexpired leases; return the accounts it still holds, None on error"""
+        raise NotImplementedError
+
+    async def release(self, user_id: int, node_id: str) -> bool:
+        raise NotImplementedError
+
+    async def expired(self, now: float) -> List[int]:
+        raise NotImplementedError
+
+    async def discard_expired(self, user_ids: List[int], now: float) -> bool:
+        """Delete the leases of these accounts that are still expired"""
+        raise NotImplementedError
+
+
+class InMemoryLeaseBackend(LeaseBackend):
+    """Single-process stand-in: nodes sharing one instance coordinate like separate hosts"""
+
+    def __init__(self):
+        self.leases: Dict[int, Tuple[str, float]] = {}
+
+    async def acquire(self, user_id: int, node_id: str, expires_at: float, now: float) -> bool:
+        lease = self.leases.get(user_id)
+        if lease and lease[0] != node_id and lease[1] >= now:
+            return False
+        self.leases[user_id] = (node_id, expires_at)
+        return True
+
+    async def renew(self, node_id: str, expires_at: float, now: float) -> Optional[List[int]]:
+        held = []
+        for user_id, (owner, lease_expires_at) in self.leases.items():
+            if owner == node_id and lease_expires_at >= now:
+                self.leases[user_id] = (node_id, expires_at)
+                held.append(user_id)
+        return held
+
+    async def release(self, user_id: int, node_id: str) -> bool:
+        if self.leases.get(user_id, (None,))[0] == node_id:
+            del self.leases[user_id]
+        return True
+
+    async def expired(self, now: float) -> List[int]:
+        return [user_id for user_id, (_, expires_at) in self.leases.items() if expires_at < now]
+
+    async def discard_expired(self, user_ids: List[int], now: float) -> bool:
+        for user_id in user_ids:
+            if self.leases.get(user_id, (None, now))[1] < now:
+                del self.leases[user_id]
+        return True
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """Leases in the account_leases table of the bot's database file"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def acquire(self, user_id: int, node_id: str, expires_at: float, now: float) -> bool:
+        return await self.db.acquire_lease(user_id, node_id, expires_at, now)
+
+    async def renew(self, node_id: str, expires_at: float, now: float) -> Optional[List[int]]:
+        return await self.db.renew_leases(node_id, expires_at, now)
+
+    async def release(self, user_id: int, node_id: str) -> bool:
+        return await self.db.release_lease(user_id, node_id)
+
+    async def expired(self, now: float) -> List[int]:
+        return await self.db.get_expired_leases(now)
+
+    async def discard_expired(self, user_ids: List[int], now: float) -> bool:
+        return await self.db.discard_expired_leases(user_ids, now)
+
+
+class LeaseManager:
+    """Keeps this node's claim on the accounts it drives.
+
+    A node must acquire an account's lease before collecting for it and
+    renews all of its leases every ``heartbeat_interval`` seconds. A lease
+    not renewed within ``ttl`` seconds (the node crashed or lost the
+    database) expires: other nodes see it in their next heartbeat and may
+    take the account over via ``on_expired``. A node that finds one of its
+    accounts missing from a renewal has been taken over and must stop
+    driving it; it is told through ``on_lost``. A node that cannot reach the
+    backend gives up all of its accounts the same way at the last heartbeat
+    before its leases could expire, so it has stopped before another node
+    can acquire them. ``heartbeat_interval`` must be at most a third of
+    ``ttl`` to leave room for that.
+    """
+
+    def __init__(self, backend: LeaseBackend, node_id: Optional[str] = None,
+                 ttl: float = 30.0, heartbeat_interval: float = 10.0):
+        if heartbeat_interval * 3 > ttl:
+            raise ValueError(f"Lease heartbeat interval {heartbeat_interval}s must be at most a third of the TTL {ttl}s")
+        self.backend = backend
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.held: set = set()
+        self.renewed_at = time.time()
+        self.on_lost: Optional[Callable[[int], Awaitable[None]]] = None
+        self.on_expired: Optional[Callable[[List[int]], Awaitable[None]]] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    async def acquire(self, user_id: int) -> bool:
+        now = time.time()
+        if not await self.backend.acquire(user_id, self.node_id, now + self.ttl, now):
+            return False
+        self.held.add(user_id)
+        return True
+
+    async def release(self, user_id: int):
+        self.held.discard(user_id)
+        await self.backend.release(user_id, self.node_id)
+
+    async def discard_expired(self, user_ids: List[int]):
+        """Drop expired leases of accounts nobody should take over, so heartbeats stop reporting them"""
+        await self.backend.discard_expired(user_ids, time.time())
+
+    async def heartbeat(self):
+        """Renew this node's leases once, then report lost and expired accounts"""
+        now = time.time()
+        still_held = await self.backend.renew(self.node_id, now + self.ttl, now)
+        if still_held is None:
+            # Backend unavailable. Our leases run out at renewed_at + ttl; if they could
+            # run out before the next beat, stop now, before another node can take them.
+            if time.time() + self.heartbeat_interval < self.renewed_at + self.ttl:
+                return
+            logger.warning(f"Lease backend unreachable since {self.renewed_at:.0f}, giving up {len(self.held)} accounts")
+            still_held = []
+        else:
+            self.renewed_at = now
+
+        lost = self.held - set(still_held)
+        for user_id in lost:
+            self.held.discard(user_id)
+            logger.warning(f"Lost the lease for user {user_id}; another node may take it over")
+            if self.on_lost:
+                await self.on_lost(user_id)
+
+        expired = [user_id for user_id in await self.backend.expired(now) if user_id not in self.held]
+        if expired and self.on_expired:
+            logger.info(f"Found {len(expired)} accounts with expired leases")
+            await self.on_expired(expired)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Error in lease heartbeat of node {self.node_id}: {e}")
+
+    def start(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        """Stop heartbeating and release every lease so other nodes can take over at once"""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        for user_id in list(self.held):
+            await self.release(user_id)
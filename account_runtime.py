@@ -0,0 +1,113 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Optional
+
+from button_index import ButtonIndex
+from collector_state import AccountStateMachine
+
+
+def _expire(getter: asyncio.Future):
+    if not getter.done():
+        getter.set_result(False)
+
+
+class AccountInbox:
+    """Bounded FIFO of bot messages for one account with a single consumer.
+
+    Replaces an asyncio.Queue per account: put() still waits while the inbox
+    is full, but the buffer only exists while messages are pending and
+    get() takes a timeout without wrapping itself in another task, so an
+    idle account's inbox is a few dozen bytes.
+    """
+
+    __slots__ = ('maxsize', '_items', '_getter', '_putters')
+
+    def __init__(self, maxsize: int = 0):
+        self.maxsize = maxsize
+        self._items: Optional[Deque[Any]] = None
+        self._getter: Optional[asyncio.Future] = None
+        self._putters: Optional[Deque[asyncio.Future]] = None
+
+    def qsize(self) -> int:
+        return len(self._items) if self._items else 0
+
+    def empty(self) -> bool:
+        return not self._items
+
+    async def put(self, item: Any):
+        while self.maxsize and self.qsize() >= self.maxsize:
+            if self._putters is None:
+                self._putters = deque()
+            putter = asyncio.get_running_loop().create_future()
+            self._putters.append(putter)
+            try:
+                await putter
+            except asyncio.CancelledError:
+                if putter in self._putters:
+                    self._putters.remove(putter)
+                raise
+
+        if self._items is None:
+            self._items = deque()
+        self._items.append(item)
+        if self._getter is not None and not self._getter.done():
+            self._getter.set_result(True)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """Return the oldest message, or None if none arrived within timeout seconds"""
+        while not self._items:
+            loop = asyncio.get_running_loop()
+            getter = self._getter = loop.create_future()
+            timer = loop.call_later(timeout, _expire, getter) if timeout is not None else None
+            try:
+                if not await getter:
+                    return None
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                self._getter = None
+
+        item = self._items.popleft()
+        if not self._items:
+            # Give the buffer back while the account is idle
+            self._items = None
+        while self._putters:
+            putter = self._putters.popleft()
+            if not putter.done():
+                putter.set_result(None)
+                break
+        if not self._putters:
+            self._putters = None
+        return item
+
+
+class AccountRuntime:
+    """Everything TaskHandler keeps for one collecting account.
+
+    Slots instead of a dict per account, since a node holds tens of
+    thousands of these.
+    """
+
+    __slots__ = ('user_id', 'client', 'active', 'fsm', 'inbox', 'tasks_completed',
+                 'started_at', 'worker', 'confirmation_waiter', 'pending_delay', 'hibernating',
+                 'buttons')
+
+    def __init__(self, user_id: int, client, inbox_size: int):
+        self.user_id = user_id
+        # auth_handler.TelegramUserClient (or the client_factory's equivalent)
+        self.client = client
+        self.active = True
+        self.fsm = AccountStateMachine(user_id)
+        self.inbox = AccountInbox(inbox_size)
+        self.tasks_completed = 0
+        self.started_at = time.time()
+        self.worker: Optional[asyncio.Task] = None
+        # Future resolved with the bot's next message while a confirmation is pending
+        self.confirmation_waiter: Optional[asyncio.Future] = None
+        # Kind of the adaptive delay before the last /start, judged by the reply
+        self.pending_delay: Optional[str] = None
+        # Disconnected for a long wait; client.connect() brings it back
+        self.hibernating = False
+        # Callback buttons of the bot's last messages, so clicks need no get_messages
+        self.buttons = ButtonIndex()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import random
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# kind: (initial, minimum, maximum) delay in seconds
+DELAY_PROFILES: Dict[str, Tuple[float, float, float]] = {
+    'join_register': (1.5, 0.3, 10.0),    # after joining, before the first confirmation click
+    'confirm_retry': (3.0, 0.5, 15.0),    # after the bot says the join is not registered yet
+    'restart': (2.0, 0.3, 10.0),          # after a completed task, before the next /start
+    'skip_restart': (1.0, 0.3, 10.0),     # after skipping a task, before the next /start
+    'rate_limit': (5.0, 2.0, 300.0),      # after 'too many requests'
+    'no_tasks': (120.0, 30.0, 1800.0),    # after 'no tasks available'
+}
+
+# Learned values that are not tied to one account are stored under this id
+GLOBAL_SCOPE = 0
+
+
+class AdaptiveTiming:
+    """Learns how long each wait in the task pipeline really needs to be.
+
+    Every wait has a kind (see DELAY_PROFILES). A wait that turned out to be
+    long enough is reported with success() and shrinks the account's delay by
+    ``tighten``; one that was too short (the bot rate-limited us, the join was
+    not registered yet, still no tasks) is reported with failure() and grows
+    it by ``backoff``, up to the kind's maximum. Accounts without history of
+    their own start from a global estimate that follows all accounts.
+    Returned delays carry +/- ``jitter`` so accounts do not synchronize.
+    """
+
+    def __init__(self, profiles: Optional[Dict[str, Tuple[float, float, float]]] = None,
+                 tighten: float = 0.85, backoff: float = 2.0, jitter: float = 0.2,
+                 global_weight: float = 0.1):
+        self.profiles = dict(DELAY_PROFILES)
+        if profiles:
+            self.profiles.update(profiles)
+        self.tighten = tighten
+        self.backoff = backoff
+        self.jitter = jitter
+        self.global_weight = global_weight
+        self._delays: Dict[Tuple[int, str], float] = {}
+        self._dirty: Set[Tuple[int, str]] = set()
+        self._random = random.Random()
+
+    def base_delay(self, user_id: int, kind: str) -> float:
+        """Learned delay without jitter"""
+        delay = self._delays.get((user_id, kind))
+        if delay is None:
+            delay = self._delays.get((GLOBAL_SCOPE, kind), self.profiles[kind][0])
+        return delay
+
+    def get(self, user_id: int, kind: str) -> float:
+        return self.base_delay(user_id, kind) * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def sleep(self, user_id: int, kind: str) -> float:
+        delay = self.get(user_id, kind)
+        await asyncio.sleep(delay)
+        return delay
+
+    def success(self, user_id: int, kind: str):
+        """The last wait of this kind was long enough; try a shorter one next time"""
+        self._update(user_id, kind, self.base_delay(user_id, kind) * self.tighten)
+
+    def failure(self, user_id: int, kind: str):
+        """The last wait of this kind was too short; back off exponentially"""
+        self._update(user_id, kind, self.base_delay(user_id, kind) * self.backoff)
+
+    def _update(self, user_id: int, kind: str, delay: float):
+        _, minimum, maximum = self.profiles[kind]
+        delay = min(maximum, max(minimum, delay))
+        self._set(user_id, kind, delay)
+
+        global_delay = self._delays.get((GLOBAL_SCOPE, kind), self.profiles[kind][0])
+        self._set(GLOBAL_SCOPE, kind, global_delay + (delay - global_delay) * self.global_weight)
+
+    def _set(self, user_id: int, kind: str, delay: float):
+        self._delays[(user_id, kind)] = delay
+        self._dirty.add((user_id, kind))
+
+    def load(self, rows: List[Tuple[int, str, float]]):
+        """Restore learned delays saved by take_dirty()"""
+        for user_id, kind, delay in rows:
+            if kind in self.profiles:
+                _, minimum, maximum = self.profiles[kind]
+                self._delays[(user_id, kind)] = min(maximum, max(minimum, delay))
+        logger.info(f"Loaded {len(rows)} learned delays")
+
+    def take_dirty(self) -> List[Tuple[int, str, float]]:
+        """Return delays changed since the last call, for persisting"""
+        rows = [(user_id, kind, self._delays[(user_id, kind)]) for user_id, kind in self._dirty]
+        self._dirty.clear()
+        return rows
+
+    def mark_unsaved(self, rows: List[Tuple[int, str, float]]):
+        """Put rows from take_dirty() back after a failed save"""
+        self._dirty.update((user_id, kind) for user_id, kind, _ in rows)
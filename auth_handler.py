@@ -165,19 +165,28 @@ class AuthHandler:
 class TelegramUserClient:
     """Wrapper for user's Telegram client"""
     
-    def __init__(self, api_id: int, api_hash: str, session_string: str):
+    __slots__ = ('api_id', 'api_hash', 'session_string', 'entity_cache_limit', 'client')
+    
+    def __init__(self, api_id: int, api_hash: str, session_string: str, entity_cache_limit: int = 500):
         self.api_id = api_id
         self.api_hash = api_hash
         self.session_string = session_string
+        # A collector only talks to the target bot and the channels of its
+        # current task, so Telethon's default of 5000 cached entities is waste
+        self.entity_cache_limit = entity_cache_limit
         self.client = None
     
     async def connect(self) -> bool:
         """Connect the client"""
         try:
+            # FloodWaitError is handled by TaskHandler's RequestScheduler, which
+            # pauses only the affected account instead of sleeping inside Telethon
             self.client = TelegramClient(
                 StringSession(self.session_string),
                 self.api_id,
-                self.api_hash
+                self.api_hash,
+                flood_sleep_threshold=0,
+                entity_cache_limit=self.entity_cache_limit
             )
             await self.client.start()
             return True
@@ -186,12 +195,17 @@ class TelegramUserClient:
             return False
     
     async def disconnect(self):
-        """Disconnect the client"""
+        """Disconnect and drop the client; connect() builds a fresh one from the saved session"""
         try:
-            if self.client and self.client.is_connected():
-                await self.client.disconnect()
+            if self.client:
+                # Keep auth key and DC changes made while connected
+                self.session_string = self.client.session.save() or self.session_string
+                if self.client.is_connected():
+                    await self.client.disconnect()
         except Exception as e:
             logger.error(f"Error disconnecting client: {e}")
+        finally:
+            self.client = None
     
     async def is_connected(self) -> bool:
         """Check if client is connected"""
@@ -1,14 +1,26 @@
 import asyncio
+import functools
 import logging
+import secrets
+import signal
+import time
+from datetime import datetime, timedelta, timezone
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, ConversationHandler
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from config import *
-from database import DatabaseManager
-from auth_handler import AuthHandler
+from database import AsyncDatabaseManager
+from auth_handler import AuthHandler, TelegramUserClient
 from task_handler import TaskHandler
+from request_scheduler import RequestScheduler
+from shard_supervisor import ShardSupervisor
+from account_leases import LeaseManager, SQLiteLeaseBackend
+from link_cache import LinkCache
+from notification_dispatcher import Lane, NoticeKind, NotificationDispatcher
+from notification_preferences import NotificationPreferences, NotifyMode
+from update_processor import PerUserUpdateProcessor
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -18,35 +30,125 @@ logger = logging.getLogger(__name__)
 
 (WAITING_FOR_PHONE, WAITING_FOR_CODE, WAITING_FOR_2FA) = range(3)
 
+# Only /start and text messages are handled, so Telegram need not send anything else
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# Reply keyboards are immutable, so every reply shares one of these
+REGISTER_KEYBOARD = ReplyKeyboardMarkup([[KeyboardButton(REGISTER_ACCOUNT)]], resize_keyboard=True)
+START_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton(START_COLLECTING)], [KeyboardButton(ACCOUNT_STATUS), KeyboardButton(NOTIFICATION_SETTINGS)]],
+    resize_keyboard=True
+)
+STOP_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton(STOP_COLLECTING)], [KeyboardButton(ACCOUNT_STATUS), KeyboardButton(NOTIFICATION_SETTINGS)]],
+    resize_keyboard=True
+)
+NOTIFY_MODE_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton(NOTIFY_MODE_EVERY), KeyboardButton(NOTIFY_MODE_HOURLY)],
+     [KeyboardButton(NOTIFY_MODE_DAILY), KeyboardButton(NOTIFY_MODE_ERRORS)]],
+    resize_keyboard=True
+)
+
 class StarCollectorBot:
     def __init__(self):
-        self.db = DatabaseManager(DATABASE_FILE)
+        self.db = AsyncDatabaseManager(
+            DATABASE_FILE,
+            task_flush_interval=TASK_FLUSH_INTERVAL,
+            task_flush_size=TASK_FLUSH_SIZE,
+            cache_size=USER_CACHE_SIZE,
+            cache_ttl=USER_CACHE_TTL
+        )
         self.auth_handler = AuthHandler(API_ID, API_HASH)
-        self.task_handler = TaskHandler(API_ID, API_HASH, TARGET_BOT)
+        self.leases = None
+        # Notification modes; shared with the in-process TaskHandler, mirrored to workers
+        self.preferences = NotificationPreferences()
+        self.notify_mode_buttons = {
+            NOTIFY_MODE_EVERY: NotifyMode.EVERY,
+            NOTIFY_MODE_HOURLY: NotifyMode.HOURLY,
+            NOTIFY_MODE_DAILY: NotifyMode.DAILY,
+            NOTIFY_MODE_ERRORS: NotifyMode.ERRORS
+        }
+        self.notify_mode_labels = {mode: label for label, mode in self.notify_mode_buttons.items()}
+        client_factory = functools.partial(TelegramUserClient, entity_cache_limit=CLIENT_ENTITY_CACHE_LIMIT)
+        link_options = {
+            'max_links': LINK_CACHE_SIZE,
+            'outcome_ttl': LINK_OUTCOME_TTL,
+            'max_outcome_ttl': LINK_OUTCOME_MAX_TTL,
+            'failure_half_life': LINK_FAILURE_HALF_LIFE,
+            'min_reporting_accounts': LINK_PRIVATE_MIN_ACCOUNTS
+        }
+        if COLLECTOR_WORKERS > 0:
+            # Collectors run in worker processes; start/stop/status are forwarded to them
+            self.task_handler = ShardSupervisor(
+                API_ID, API_HASH, TARGET_BOT, DATABASE_FILE,
+                worker_count=COLLECTOR_WORKERS,
+                global_rate=GLOBAL_REQUEST_RATE,
+                global_burst=GLOBAL_REQUEST_BURST,
+                db_options={
+                    'task_flush_interval': TASK_FLUSH_INTERVAL,
+                    'task_flush_size': TASK_FLUSH_SIZE,
+                    'cache_size': USER_CACHE_SIZE,
+                    'cache_ttl': USER_CACHE_TTL
+                },
+                delay_save_interval=ADAPTIVE_DELAY_SAVE_INTERVAL,
+                client_factory=client_factory,
+                lease_ttl=LEASE_TTL if ACCOUNT_LEASES else None,
+                lease_heartbeat_interval=LEASE_HEARTBEAT_INTERVAL,
+                hibernate_after=IDLE_HIBERNATE_AFTER,
+                link_options=link_options
+            )
+        else:
+            if ACCOUNT_LEASES:
+                self.leases = LeaseManager(
+                    SQLiteLeaseBackend(self.db), ttl=LEASE_TTL, heartbeat_interval=LEASE_HEARTBEAT_INTERVAL
+                )
+            self.task_handler = TaskHandler(
+                API_ID, API_HASH, TARGET_BOT, self.db,
+                client_factory=client_factory,
+                scheduler=RequestScheduler(GLOBAL_REQUEST_RATE, GLOBAL_REQUEST_BURST),
+                leases=self.leases,
+                hibernate_after=IDLE_HIBERNATE_AFTER,
+                links=LinkCache(**link_options),
+                preferences=self.preferences
+            )
+        # Every message to users goes through here, interactive replies first
+        self.notifications = NotificationDispatcher(
+            self._send_message,
+            global_rate=NOTIFY_GLOBAL_RATE,
+            global_burst=NOTIFY_GLOBAL_BURST,
+            chat_rate=NOTIFY_CHAT_RATE,
+            chat_burst=NOTIFY_CHAT_BURST,
+            coalesce_window=NOTIFY_COALESCE_WINDOW,
+            max_pending=NOTIFY_MAX_PENDING
+        )
         self.user_states: Dict[int, Dict[str, Any]] = {}
+        # user_id -> whether the account is registered; filled on first use, updated on registration
+        self.registered: Dict[int, bool] = {}
+        self.resume_task = None
+        self.summary_task = None
         
-    def get_main_keyboard(self, user_id: int):
-        user = self.db.get_user(user_id)
-        buttons = []
+    async def get_main_keyboard(self, user_id: int):
+        registered = self.registered.get(user_id)
+        if registered is None:
+            # Only the first reply to a user since startup reads the database
+            user = await self.db.get_user(user_id)
+            registered = self.registered[user_id] = bool(user and user.get('session_string'))
         
-        if not user or not user.get('session_string'):
-            buttons.append([KeyboardButton(REGISTER_ACCOUNT)])
-        else:
-            if self.task_handler.is_user_collecting(user_id):
-                buttons.append([KeyboardButton(STOP_COLLECTING)])
-            else:
-                buttons.append([KeyboardButton(START_COLLECTING)])
-            buttons.append([KeyboardButton(ACCOUNT_STATUS)])
-            
-        return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
+        if not registered:
+            return REGISTER_KEYBOARD
+        # The task handler's running set is already in memory and follows
+        # stops the bot does not see (lost leases, lost workers)
+        if self.task_handler.is_user_collecting(user_id):
+            return STOP_KEYBOARD
+        return START_KEYBOARD
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        self.db.add_user(user_id)
+        await self.db.add_user(user_id)
         
-        await update.message.reply_text(
-            WELCOME_MESSAGE,
-            reply_markup=self.get_main_keyboard(user_id)
+        await self.reply(
+            update, WELCOME_MESSAGE,
+            reply_markup=await self.get_main_keyboard(user_id)
         )
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -61,6 +163,10 @@ class StarCollectorBot:
             await self.stop_collection(update, context)
         elif text == ACCOUNT_STATUS:
             await self.show_account_status(update, context)
+        elif text == NOTIFICATION_SETTINGS:
+            await self.show_notification_settings(update, context)
+        elif text in self.notify_mode_buttons:
+            await self.set_notification_mode(update, context, self.notify_mode_buttons[text])
         else:
             user_state = self.user_states.get(user_id, {})
             state = user_state.get('state')
@@ -72,25 +178,26 @@ class StarCollectorBot:
             elif state == WAITING_FOR_2FA:
                 await self.process_2fa(update, context)
             else:
-                await update.message.reply_text(
-                    "يرجى استخدام الأزرار المتاحة للتفاعل مع البوت.",
-                    reply_markup=self.get_main_keyboard(user_id)
+                await self.reply(
+                    update, "يرجى استخدام الأزرار المتاحة للتفاعل مع البوت.",
+                    reply_markup=await self.get_main_keyboard(user_id)
                 )
     
     async def start_registration(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        user = self.db.get_user(user_id)
-        if user and user.get('session_string'):
-            await update.message.reply_text(
-                "✅ أنت مسجل بالفعل! يمكنك بدء التجميع التلقائي.",
-                reply_markup=self.get_main_keyboard(user_id)
+        user = await self.db.get_user(user_id)
+        self.registered[user_id] = bool(user and user.get('session_string'))
+        if self.registered[user_id]:
+            await self.reply(
+                update, "✅ أنت مسجل بالفعل! يمكنك بدء التجميع التلقائي.",
+                reply_markup=await self.get_main_keyboard(user_id)
             )
             return
         
         await self.auth_handler.cancel_auth(user_id)
         self.user_states[user_id] = {'state': WAITING_FOR_PHONE}
-        await update.message.reply_text(PHONE_REQUEST)
+        await self.reply(update, PHONE_REQUEST)
     
     async def process_phone(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -99,13 +206,13 @@ class StarCollectorBot:
         success, message = await self.auth_handler.start_auth(user_id, phone)
         
         if success:
-            self.db.update_user_phone(user_id, phone)
+            await self.db.update_user_phone(user_id, phone)
             self.user_states[user_id] = {'state': WAITING_FOR_CODE}
-            await update.message.reply_text(CODE_REQUEST)
+            await self.reply(update, CODE_REQUEST)
         else:
-            await update.message.reply_text(
-                message + "\n\n" + PHONE_REQUEST,
-                reply_markup=self.get_main_keyboard(user_id)
+            await self.reply(
+                update, message + "\n\n" + PHONE_REQUEST,
+                reply_markup=await self.get_main_keyboard(user_id)
             )
     
     async def process_code(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -116,19 +223,19 @@ class StarCollectorBot:
         
         if success:
             if session_string:
-                self.db.update_user_session(user_id, session_string)
+                self.registered[user_id] = await self.db.update_user_session(user_id, session_string)
                 self.user_states.pop(user_id, None)
                 
-                await update.message.reply_text(
-                    REGISTRATION_SUCCESS,
-                    reply_markup=self.get_main_keyboard(user_id)
+                await self.reply(
+                    update, REGISTRATION_SUCCESS,
+                    reply_markup=await self.get_main_keyboard(user_id)
                 )
             else:
                 self.user_states[user_id] = {'state': WAITING_FOR_2FA}
-                await update.message.reply_text(TWO_FA_REQUEST)
+                await self.reply(update, TWO_FA_REQUEST)
         else:
-            await update.message.reply_text(
-                message + "\n\n" + CODE_REQUEST
+            await self.reply(
+                update, message + "\n\n" + CODE_REQUEST
             )
     
     async def process_2fa(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -138,37 +245,38 @@ class StarCollectorBot:
         success, message, session_string = await self.auth_handler.verify_2fa(user_id, password)
         
         if success and session_string:
-            self.db.update_user_session(user_id, session_string)
+            self.registered[user_id] = await self.db.update_user_session(user_id, session_string)
             self.user_states.pop(user_id, None)
             
-            await update.message.reply_text(
-                REGISTRATION_SUCCESS,
-                reply_markup=self.get_main_keyboard(user_id)
+            await self.reply(
+                update, REGISTRATION_SUCCESS,
+                reply_markup=await self.get_main_keyboard(user_id)
             )
         else:
-            await update.message.reply_text(
-                message + "\n\n" + TWO_FA_REQUEST
+            await self.reply(
+                update, message + "\n\n" + TWO_FA_REQUEST
             )
     
     async def start_collection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        user = self.db.get_user(user_id)
-        if not user or not user.get('session_string'):
-            await update.message.reply_text(
-                "❌ يجب تسجيل حسابك أولاً!",
-                reply_markup=self.get_main_keyboard(user_id)
+        user = await self.db.get_user(user_id)
+        self.registered[user_id] = bool(user and user.get('session_string'))
+        if not self.registered[user_id]:
+            await self.reply(
+                update, "❌ يجب تسجيل حسابك أولاً!",
+                reply_markup=await self.get_main_keyboard(user_id)
             )
             return
         
         success, message = await self.task_handler.start_collection(user_id, user['session_string'])
         
         if success:
-            self.db.set_auto_collect(user_id, True)
+            await self.db.set_auto_collect(user_id, True)
             
-        await update.message.reply_text(
-            message,
-            reply_markup=self.get_main_keyboard(user_id)
+        await self.reply(
+            update, message,
+            reply_markup=await self.get_main_keyboard(user_id)
         )
     
     async def stop_collection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -177,26 +285,27 @@ class StarCollectorBot:
         success, message = await self.task_handler.stop_collection(user_id)
         
         if success:
-            self.db.set_auto_collect(user_id, False)
+            await self.db.set_auto_collect(user_id, False)
         
-        await update.message.reply_text(
-            message,
-            reply_markup=self.get_main_keyboard(user_id)
+        await self.reply(
+            update, message,
+            reply_markup=await self.get_main_keyboard(user_id)
         )
     
     async def show_account_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        user = self.db.get_user(user_id)
+        user = await self.db.get_user(user_id)
         if not user:
-            await update.message.reply_text(
-                "❌ لم يتم العثور على بيانات حسابك.",
-                reply_markup=self.get_main_keyboard(user_id)
+            await self.reply(
+                update, "❌ لم يتم العثور على بيانات حسابك.",
+                reply_markup=await self.get_main_keyboard(user_id)
             )
             return
         
-        stats = self.db.get_user_stats(user_id)
-        settings = self.db.get_user_settings(user_id)
+        stats = await self.db.get_user_stats(user_id)
+        collector = await self.task_handler.get_user_status(user_id)
+        collecting = collector['collecting'] if collector else self.task_handler.is_user_collecting(user_id)
         
         status_text = f"""
 📊 **حالة حسابك**
@@ -209,29 +318,109 @@ class StarCollectorBot:
 📈 **إجمالي المهام:** {stats['total_tasks']}
 📅 **مهام اليوم:** {stats['today_tasks']}
 
-🔄 **الحالة الحالية:** {'نشط' if self.task_handler.is_user_collecting(user_id) else 'متوقف'}
-🔔 **التنبيهات:** {'مفعلة' if settings and settings.get('notifications') else 'معطلة'}
+🔄 **الحالة الحالية:** {'نشط' if collecting else 'متوقف'}
+🔔 **التنبيهات:** {self.notify_mode_labels[self.preferences.mode(user_id)]}
 
 📅 **تاريخ التسجيل:** {user.get('created_at', 'غير محدد')}
 🕒 **آخر نشاط:** {user.get('last_activity', 'غير محدد')}
         """
         
-        await update.message.reply_text(
-            status_text,
-            reply_markup=self.get_main_keyboard(user_id),
+        await self.reply(
+            update, status_text,
+            reply_markup=await self.get_main_keyboard(user_id),
             parse_mode='Markdown'
         )
     
-    async def notify_user(self, user_id: int, message: str):
-        try:
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                reply_markup=self.get_main_keyboard(user_id),
-                parse_mode='Markdown'
+    async def show_notification_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        await self.reply(
+            update,
+            f"🔔 **إعداد التنبيهات الحالي:** {self.notify_mode_labels[self.preferences.mode(user_id)]}\n\n"
+            "اختر متى تريد أن نرسل لك إشعارات المهام المكتملة. تصلك رسائل الأخطاء دائماً.",
+            reply_markup=NOTIFY_MODE_KEYBOARD,
+            parse_mode='Markdown'
+        )
+    
+    async def set_notification_mode(self, update: Update, context: ContextTypes.DEFAULT_TYPE, mode: NotifyMode):
+        user_id = update.effective_user.id
+        
+        if not await self.db.set_notification_mode(user_id, mode.value):
+            await self.reply(
+                update, "❌ تعذر حفظ إعداد التنبيهات. يرجى المحاولة مرة أخرى.",
+                reply_markup=await self.get_main_keyboard(user_id)
             )
-        except Exception as e:
-            logger.error(f"Error sending notification to user {user_id}: {e}")
+            return
+        
+        self.preferences.set(user_id, mode)
+        await self.task_handler.set_notification_mode(user_id, mode)
+        await self.reply(
+            update, f"✅ تم تحديث التنبيهات: {self.notify_mode_labels[mode]}",
+            reply_markup=await self.get_main_keyboard(user_id)
+        )
+    
+    def _create_summary_message(self, title: str, tasks: int, stars: float) -> str:
+        return f"""
+{title}
+
+✅ **المهام المكتملة:** {tasks}
+⭐ **النجوم المكتسبة:** +{stars:.2f}
+        """.strip()
+    
+    async def send_summaries(self, until: datetime):
+        """Summarize the hour (and at midnight UTC, the day) ending at until for users who chose it"""
+        hourly = self.preferences.users(NotifyMode.HOURLY)
+        if hourly:
+            summaries = await self.db.get_task_summaries(
+                hourly,
+                (until - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S'),
+                until.strftime('%Y-%m-%d %H:%M:%S')
+            )
+            for user_id, (tasks, stars) in summaries.items():
+                self.notifications.notify(
+                    user_id, self._create_summary_message("🕐 **ملخص الساعة الماضية**", tasks, stars),
+                    summary=f"🕐 +{stars:.2f}⭐ ({tasks} مهام)", parse_mode='Markdown'
+                )
+            logger.info(f"Sent hourly summaries to {len(summaries)} of {len(hourly)} users")
+        
+        daily = self.preferences.users(NotifyMode.DAILY) if until.hour == 0 else []
+        if daily:
+            day = (until - timedelta(days=1)).strftime('%Y-%m-%d')
+            summaries = await self.db.get_daily_summaries(daily, day)
+            for user_id, (tasks, stars) in summaries.items():
+                self.notifications.notify(
+                    user_id, self._create_summary_message(f"📅 **ملخص يوم {day}**", tasks, stars),
+                    summary=f"📅 +{stars:.2f}⭐ ({tasks} مهام)", parse_mode='Markdown'
+                )
+            logger.info(f"Sent daily summaries to {len(summaries)} of {len(daily)} users")
+    
+    async def _summary_loop(self):
+        while True:
+            now = time.time()
+            boundary = (int(now) // 3600 + 1) * 3600
+            await asyncio.sleep(boundary - now)
+            try:
+                await self.send_summaries(datetime.fromtimestamp(boundary, timezone.utc))
+            except Exception as e:
+                logger.error(f"Error sending notification summaries: {e}")
+    
+    async def _send_message(self, chat_id: int, text: str, reply_markup, parse_mode):
+        return await self.application.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+    
+    async def reply(self, update: Update, text: str, reply_markup=None, parse_mode=None):
+        """Answer the user's message ahead of queued notifications"""
+        return await self.notifications.reply(update.effective_chat.id, text, reply_markup, parse_mode)
+    
+    async def notify_user(self, user_id: int, message: str, kind: NoticeKind = NoticeKind.INFO,
+                          summary: Optional[str] = None):
+        lane = Lane.ALERT if kind == NoticeKind.ERROR else Lane.NOTICE
+        # The keyboard is built when the notice goes out, so it matches the user's state by then
+        self.notifications.notify(user_id, message, lane, summary, parse_mode='Markdown',
+                                  reply_markup=functools.partial(self.get_main_keyboard, user_id))
     
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Update {update} caused error {context.error}")
@@ -242,8 +431,8 @@ class StarCollectorBot:
             
         if update and update.effective_chat and update.message:
             try:
-                await update.message.reply_text(
-                    "❌ حدث خطأ غير متوقع. يرجى المحاولة مرة أخرى."
+                await self.reply(
+                    update, "❌ حدث خطأ غير متوقع. يرجى المحاولة مرة أخرى."
                 )
             except Exception as e:
                 logger.error(f"Could not send error message: {e}")
@@ -255,17 +444,120 @@ class StarCollectorBot:
         
         self.application = application
         
-        async def enhanced_notify_user(user_id: int, message: str):
-            await self.notify_user(user_id, message)
+        async def enhanced_notify_user(user_id: int, message: str, kind: NoticeKind = NoticeKind.INFO,
+                                       summary: Optional[str] = None):
+            await self.notify_user(user_id, message, kind, summary)
         
         self.task_handler._notify_user = enhanced_notify_user
     
-    def run(self):
-        application = ApplicationBuilder().token(BOT_TOKEN).build()
+    async def resume_active_collectors(self):
+        """Restart collection for every account that had it enabled before the restart"""
+        try:
+            users = await self.db.get_active_users()
+            if not users:
+                return
+            
+            logger.info(f"Resuming collection for {len(users)} accounts")
+            progress = await self.task_handler.resume_collections(
+                users,
+                max_concurrent_connects=RESUME_MAX_CONCURRENT_CONNECTS,
+                start_stagger=RESUME_START_STAGGER
+            )
+            logger.info(f"Resume finished: {progress['started']} started, {progress['failed']} failed")
+        except Exception as e:
+            logger.error(f"Error resuming active collectors: {e}")
+    
+    async def post_init(self, application):
+        self.notifications.start()
+        self.preferences.load(await self.db.get_notification_modes())
+        self.summary_task = asyncio.create_task(self._summary_loop())
+        if isinstance(self.task_handler, ShardSupervisor):
+            await self.task_handler.start()
+        else:
+            await self.task_handler.load_adaptive_delays()
+            await self.task_handler.load_channel_outcomes()
+            self.task_handler.start_adaptive_delay_saver(ADAPTIVE_DELAY_SAVE_INTERVAL)
+            if self.leases:
+                self.leases.start()
+        # In the background, so the bot answers users while accounts reconnect
+        self.resume_task = asyncio.create_task(self.resume_active_collectors())
+    
+    async def shutdown(self, application):
+        if self.resume_task and not self.resume_task.done():
+            self.resume_task.cancel()
+        if self.summary_task:
+            self.summary_task.cancel()
+        if isinstance(self.task_handler, ShardSupervisor):
+            await self.task_handler.close()
+        else:
+            await self.task_handler.stop_adaptive_delay_saver()
+            if self.leases:
+                await self.leases.stop()
+        await self.notifications.stop()
+        await self.db.aclose()
+    
+    def build_application(self, token: str = BOT_TOKEN, base_url: Optional[str] = None):
+        builder = (
+            ApplicationBuilder()
+            .token(token)
+            .post_init(self.post_init)
+            .post_shutdown(self.shutdown)
+        )
+        if base_url:
+            builder = builder.base_url(base_url)
+        if UPDATE_CONCURRENCY > 1:
+            # One user's slow Telethon connect no longer holds up everyone else's buttons
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING))
+        application = builder.build()
         self.setup_handlers(application)
+        return application
+    
+    def run(self):
+        application = self.build_application()
         
         logger.info("Starting bot...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            asyncio.run(self.run_webhook(application))
+        else:
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
+    
+    async def run_webhook(self, application, stop: Optional[asyncio.Event] = None):
+        """Receive updates through webhook_server.py until stop is set (default: SIGINT/SIGTERM)"""
+        # Imported here so polling deployments do not need aiohttp
+        from webhook_server import WebhookServer
+        
+        if stop is None:
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop.set)
+                except NotImplementedError:
+                    # Windows: Ctrl+C still interrupts asyncio.run
+                    pass
+        
+        secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        server = WebhookServer(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, secret_token)
+        try:
+            # Same order as run_polling: initialize, post_init, start, ..., stop, shutdown, post_shutdown
+            async with application:
+                await self.post_init(application)
+                await application.start()
+                await server.start()
+                await application.bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                    allowed_updates=ALLOWED_UPDATES,
+                    secret_token=secret_token,
+                    max_connections=WEBHOOK_MAX_CONNECTIONS
+                )
+                logger.info(f"Receiving updates by webhook at {WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH}")
+                try:
+                    await stop.wait()
+                finally:
+                    await server.stop()
+                    await application.stop()
+        finally:
+            await self.shutdown(application)
 
 def main():
     if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
@@ -285,6 +577,8 @@ def main():
         logger.info("Bot stopped by user")
     except Exception as e:
         logger.error(f"Bot error: {e}")
+    finally:
+        bot.db.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,84 @@
+import logging
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, NamedTuple, Optional, Tuple
+
+from telethon.tl.types import KeyboardButtonCallback
+
+logger = logging.getLogger(__name__)
+
+# Lowercase keywords that give a callback button its role
+SKIP_KEYWORDS = ('⏩', 'skip', 'пропустить', 'пропуск', 'далее', 'next')
+CONFIRM_KEYWORDS = ('подтверд', '✅', 'confirm', 'check', 'подтвердить')
+
+
+class ButtonRole(Enum):
+    SKIP = "skip"
+    CONFIRM = "confirm"
+    GENERIC = "generic"  # first callback button of the message, whatever it says
+
+
+class IndexedButton(NamedTuple):
+    msg_id: int
+    text: str
+    data: bytes
+
+
+def index_buttons(message) -> Optional[Dict[ButtonRole, IndexedButton]]:
+    """First callback button of each role in the message, in one pass over its markup"""
+    markup = getattr(message, 'reply_markup', None)
+    rows = getattr(markup, 'rows', None)
+    if not rows:
+        return None
+
+    roles: Dict[ButtonRole, IndexedButton] = {}
+    for row in rows:
+        for button in row.buttons:
+            if not isinstance(button, KeyboardButtonCallback):
+                continue
+            indexed = IndexedButton(message.id, button.text, button.data)
+            roles.setdefault(ButtonRole.GENERIC, indexed)
+            text = button.text.lower()
+            if ButtonRole.SKIP not in roles and any(keyword in text for keyword in SKIP_KEYWORDS):
+                roles[ButtonRole.SKIP] = indexed
+            if ButtonRole.CONFIRM not in roles and any(keyword in text for keyword in CONFIRM_KEYWORDS):
+                roles[ButtonRole.CONFIRM] = indexed
+    return roles or None
+
+
+class ButtonIndex:
+    """Callback buttons of an account's last few bot messages, indexed as they arrive.
+
+    Stands in for fetching recent messages before every click: the message
+    handler adds each new or edited message, and find() returns the newest
+    button with the wanted role.
+    """
+
+    __slots__ = ('size', '_messages')
+
+    def __init__(self, size: int = 5):
+        self.size = size
+        # (message id, roles or None), oldest first; None while the account has seen no message
+        self._messages: Optional[Deque[Tuple[int, Optional[Dict[ButtonRole, IndexedButton]]]]] = None
+
+    def add(self, message):
+        roles = index_buttons(message)
+        if self._messages is None:
+            self._messages = deque(maxlen=self.size)
+        for position, (msg_id, _) in enumerate(self._messages):
+            if msg_id == message.id:
+                # An edit replaces the message's buttons, e.g. removes them once the task is done
+                self._messages[position] = (msg_id, roles)
+                return
+        self._messages.append((message.id, roles))
+
+    def find(self, role: ButtonRole, within: Optional[int] = None) -> Optional[IndexedButton]:
+        """Newest button with the role among the last ``within`` messages (default: all kept)"""
+        if not self._messages:
+            return None
+        for checked, (_, roles) in enumerate(reversed(self._messages)):
+            if within is not None and checked >= within:
+                break
+            if roles and role in roles:
+                return roles[role]
+        return None
@@ -0,0 +1,167 @@
+"""Speed of message_classifier.classify_message against the old substring chain.
+
+The old chain is the sequence of checks _handle_new_message ran before the
+classifier, with TaskHandler's _is_completion_message, _is_task_message,
+_extract_channel_link and _extract_reward inlined below (their logging
+calls left out). Both are run over the same corpus of target bot texts and
+every result is compared before timing.
+
+    python classifier_bench.py --rounds 200
+"""
+import argparse
+import random
+import re
+import time
+from typing import Callable, List, Optional, Tuple
+
+from message_classifier import classify_message
+
+CORPUS = [
+    "🔴 Подпишитесь на канал https://t.me/somechannel\n\nНажмите «Подтвердить» после подписки.\nВознаграждение: 0.25⭐",
+    "🔴 Подпишитесь на канал t.me/+AbCdEf123\nВознаграждение: 0.5 ⭐",
+    "🔴 Subscribe to @coolchan\nВознаграждение: 0.1⭐",
+    "🔴 Подпишитесь на канал https://t.me/addlist/XyZ\nВознаграждение: 1⭐",
+    "🔴 Подпишитесь на канал https://t.me/StarsovGamesBot?start=123\nВознаграждение: 0.25⭐",
+    "✅ Задание выполнено! Получено: +0.25⭐",
+    "Task completed +0.3 stars",
+    "❗ Вы делаете слишком много запросов, подождите",
+    "😔 Задания закончились, загляните позже",
+    "💡 Получайте Звёзды за простые задания! 👇\n1. Нажмите «Подписаться», дождитесь прогрузки ссылки и подпишитесь",
+    "Нажмите ⏩ чтобы пропустить",
+    "Нажмите кнопку Подтвердить",
+    "❌ Вы не подписались на канал! Подпишитесь и подтвердите снова",
+    "👥 Приглашено вами: 3\nВаша реферальная ссылка: https://t.me/StarsovGamesBot?start=42\nПодпишитесь на канал",
+    "Главное меню. Баланс: 12.5⭐",
+    "Hello there " * 20,
+]
+
+
+def build_corpus(seed: int = 1) -> List[str]:
+    """CORPUS plus upper-case, lower-case and padded copies of every text"""
+    rnd = random.Random(seed)
+    corpus = list(CORPUS)
+    for text in CORPUS:
+        corpus.append(text.upper())
+        corpus.append(text.lower())
+        corpus.append('x' * rnd.randrange(50) + text + ' tail')
+    return corpus
+
+
+def _old_is_completion_message(text: str) -> bool:
+    return ("✅ Задание выполнено!" in text or
+            "Получено" in text or
+            "задание выполнено" in text.lower() or
+            "Task completed" in text or
+            "Completed" in text)
+
+
+def _old_extract_channel_link(text: str) -> Optional[str]:
+    patterns = [
+        r'https://t\.me/\+[A-Za-z0-9\-_]+',
+        r't\.me/\+[A-Za-z0-9\-_]+',
+        r'https://t\.me/addlist/[A-Za-z0-9\-_]+',
+        r't\.me/addlist/[A-Za-z0-9\-_]+',
+        r'https://t\.me/[A-Za-z0-9\-_]+',
+        r't\.me/[A-Za-z0-9\-_]+',
+        r'@[A-Za-z0-9\-_]+'
+    ]
+    for pattern in patterns:
+        matches = re.findall(pattern, text)
+        if matches:
+            link = matches[0]
+            if not link.startswith('http'):
+                if link.startswith('@'):
+                    link = 'https://t.me/' + link[1:]
+                else:
+                    link = 'https://' + link
+            excluded_patterns = ['StarsovGamesBot', '?start=', '/start', 'bot?start']
+            if not any(pattern in link for pattern in excluded_patterns):
+                return link
+    return None
+
+
+def _old_extract_reward(text: str) -> float:
+    patterns = [
+        r'\+([0-9]+\.?[0-9]*)\s*⭐',
+        r'Получено:\s*\+([0-9]+\.?[0-9]*)⭐',
+        r'([0-9]+\.?[0-9]*)\s*⭐',
+        r'reward:\s*([0-9]+\.?[0-9]*)',
+        r'([0-9]+\.?[0-9]*)\s*stars?'
+    ]
+    for pattern in patterns:
+        matches = re.findall(pattern, text, re.IGNORECASE)
+        if matches:
+            return float(matches[0])
+    return 0.25
+
+
+def _old_is_task_message(text: str) -> bool:
+    text_lower = text.lower()
+    referral_indicators = ["приглашенного друга", "реферальная ссылка", "starsovgamesbot?start=",
+                           "приглашайте по этой ссылке", "приглашено вами:"]
+    if any(indicator in text_lower for indicator in referral_indicators):
+        return False
+    channel_task_indicators = ["подпишитесь на канал", "🔴 подпишитесь на канал", "🔴 subscribe to",
+                               "нажмите «подтвердить»"]
+    has_channel_task = any(indicator in text_lower for indicator in channel_task_indicators)
+    has_valid_channel_link = bool(_old_extract_channel_link(text))
+    has_reward = "вознаграждение:" in text_lower
+    return has_channel_task and has_valid_channel_link and has_reward
+
+
+def old_classify(text: str) -> Tuple[str, Optional[str], Optional[float]]:
+    """The checks _handle_new_message made, in its order"""
+    if "Вы делаете слишком много запросов" in text or "too many requests" in text.lower():
+        return 'rate_limited', None, None
+    if _old_is_completion_message(text):
+        return 'completed', None, _old_extract_reward(text)
+    if _old_is_task_message(text):
+        return 'task', _old_extract_channel_link(text), _old_extract_reward(text)
+    if "задания закончились" in text.lower() or "no tasks available" in text.lower():
+        return 'no_tasks', None, None
+    if ("💡 Получайте** Звёзды** за **простые задания!** 👇" in text or
+            "💡 Получайте Звёзды за простые задания!" in text or
+            "1.** **Нажмите «Подписаться»**, дождитесь прогру" in text or
+            "1. Нажмите «Подписаться», дождитесь прогрузки ссылки и подпишитесь" in text or
+            "⏩" in text or "Skip" in text.lower() or "Пропустить" in text.lower() or
+            "Нажмите «Подписаться», дождитесь прогрузки ссылки" in text):
+        return 'skip', None, None
+    if "Подтвердить" in text or "Confirm" in text or any(btn for btn in ["✅", "подтверд"] if btn in text.lower()):
+        return 'confirm', None, None
+    return 'other', None, None
+
+
+def new_classify(text: str) -> Tuple[str, Optional[str], Optional[float]]:
+    result = classify_message(text)
+    return result.kind.value, result.channel_link, result.reward
+
+
+def _rate(classify: Callable[[str], object], corpus: List[str], rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            classify(text)
+    return rounds * len(corpus) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="classify_message against the old substring chain")
+    parser.add_argument('--rounds', type=int, default=200, help="passes over the corpus per implementation")
+    args = parser.parse_args()
+
+    corpus = build_corpus()
+    mismatches = 0
+    for text in corpus:
+        old, new = old_classify(text), new_classify(text)
+        if old != new:
+            mismatches += 1
+            print(f"MISMATCH {text[:60]!r}: old={old} new={new}")
+
+    print(f"{'corpus':24s} {len(corpus)}")
+    print(f"{'mismatches':24s} {mismatches}")
+    for name, classify in (('old_chain', old_classify), ('classifier', new_classify)):
+        print(f"{name + '_msgs_per_s':24s} {_rate(classify, corpus, args.rounds):10.0f}")
+
+
+if __name__ == '__main__':
+    main()
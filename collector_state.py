@@ -0,0 +1,80 @@
+import logging
+import time
+from enum import Enum
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CollectorState(Enum):
+    STARTING = "starting"
+    IDLE = "idle"
+    PROCESSING = "processing"
+    CONFIRMING = "confirming"
+    WAITING = "waiting"
+    STOPPED = "stopped"
+
+
+# Position of each state in AccountStateMachine.time_in_state
+_STATE_INDEX = {state: index for index, state in enumerate(CollectorState)}
+
+# Allowed transitions of the per-account collection loop
+TRANSITIONS = {
+    CollectorState.STARTING: {CollectorState.IDLE, CollectorState.STOPPED},
+    CollectorState.IDLE: {CollectorState.PROCESSING, CollectorState.STOPPED},
+    CollectorState.PROCESSING: {CollectorState.IDLE, CollectorState.CONFIRMING,
+                                CollectorState.WAITING, CollectorState.STOPPED},
+    CollectorState.CONFIRMING: {CollectorState.PROCESSING, CollectorState.STOPPED},
+    CollectorState.WAITING: {CollectorState.PROCESSING, CollectorState.STOPPED},
+    CollectorState.STOPPED: set(),
+}
+
+
+class AccountStateMachine:
+    """Explicit state of one account's collection loop with transition timings"""
+
+    __slots__ = ('user_id', 'state', 'entered_at', 'time_in_state', 'transition_count',
+                 'history', 'history_size')
+
+    def __init__(self, user_id: int, history_size: int = 50):
+        self.user_id = user_id
+        self.state = CollectorState.STARTING
+        self.entered_at = time.monotonic()
+        # Seconds per state, in CollectorState order
+        self.time_in_state: List[float] = [0.0] * len(_STATE_INDEX)
+        self.transition_count = 0
+        # Most recent transitions, oldest first; a list stays small for quiet accounts
+        self.history: List[Tuple[CollectorState, CollectorState, float]] = []
+        self.history_size = history_size
+
+    def transition(self, new_state: CollectorState) -> bool:
+        """Move to new_state, recording how long the previous state lasted"""
+        if new_state == self.state:
+            return True
+        if self.state == CollectorState.STOPPED:
+            # Cleanup racing with stop_collection; the loop is already over
+            return False
+        if new_state not in TRANSITIONS[self.state]:
+            logger.warning(f"Invalid state transition for user {self.user_id}: "
+                           f"{self.state.value} -> {new_state.value}")
+            return False
+
+        now = time.monotonic()
+        elapsed = now - self.entered_at
+        self.time_in_state[_STATE_INDEX[self.state]] += elapsed
+        self.history.append((self.state, new_state, elapsed))
+        if len(self.history) > self.history_size:
+            del self.history[0]
+        self.transition_count += 1
+        self.state = new_state
+        self.entered_at = now
+        return True
+
+    def is_stopped(self) -> bool:
+        return self.state == CollectorState.STOPPED
+
+    def get_timings(self) -> Dict[str, float]:
+        """Total seconds spent in each state, including the current one"""
+        timings = {state.value: seconds for state, seconds in zip(CollectorState, self.time_in_state)}
+        timings[self.state.value] += time.monotonic() - self.entered_at
+        return timings
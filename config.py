@@ -7,6 +7,10 @@ API_HASH = ""  # Replace with your API hash
 
 # Database configuration
 DATABASE_FILE = "users.db"
+TASK_FLUSH_INTERVAL = 2.0  # seconds between batched writes of completed tasks
+TASK_FLUSH_SIZE = 200  # flush early once this many completions are buffered
+USER_CACHE_SIZE = 10000  # user rows/settings kept in memory
+USER_CACHE_TTL = 300  # seconds before a cached row is re-read
 
 # Target bot information
 TARGET_BOT = "@StarsovGamesBot"
@@ -17,6 +21,61 @@ MAX_RETRIES = 5
 RETRY_DELAY = 300  # 5 minutes in seconds
 TASK_CHECK_DELAY = 60  # 1 minute between task checks
 
+# Outgoing Telegram request budget shared by all collecting accounts
+GLOBAL_REQUEST_RATE = 100  # requests per second
+GLOBAL_REQUEST_BURST = 100
+
+# Learned waits between bot interactions (see adaptive_timing.py)
+ADAPTIVE_DELAY_SAVE_INTERVAL = 60  # seconds between saves of learned delays
+
+# Resuming collectors with auto collection enabled after a restart
+RESUME_MAX_CONCURRENT_CONNECTS = 50  # client connections opened at the same time
+RESUME_START_STAGGER = 0.01  # seconds between consecutive accounts' first /start
+
+# Collector processes; 0 runs every account inside the bot process
+COLLECTOR_WORKERS = 0
+
+# Account leases let several hosts share one database without two of them
+# driving the same account (see account_leases.py)
+ACCOUNT_LEASES = False
+LEASE_TTL = 30  # seconds without a heartbeat before another node may take over
+LEASE_HEARTBEAT_INTERVAL = 10  # seconds between lease renewals, at most LEASE_TTL / 3
+
+# Idle accounts disconnect during long waits (no tasks, rate limits) and
+# reconnect from their session shortly before the next /start
+IDLE_HIBERNATE_AFTER = 60  # seconds; waits at least this long are spent disconnected, None disables
+CLIENT_ENTITY_CACHE_LIMIT = 500  # users/chats each collecting client keeps in memory
+
+# Task links are parsed once and channels that cannot be joined (expired,
+# private, nonexistent, needs approval) are skipped by every account
+LINK_CACHE_SIZE = 10000  # links and channel outcomes kept in memory
+LINK_OUTCOME_TTL = 3600  # seconds a channel is skipped after its first failure, doubling per repeat
+LINK_OUTCOME_MAX_TTL = 7 * 86400  # longest a channel is skipped; older records are dropped
+LINK_FAILURE_HALF_LIFE = 86400  # seconds for a channel's failure count to halve
+LINK_PRIVATE_MIN_ACCOUNTS = 3  # accounts that must find a channel private before every account skips it
+
+# Messages from the control bot (see notification_dispatcher.py)
+NOTIFY_GLOBAL_RATE = 25  # messages per second across all chats (Bot API limit is ~30)
+NOTIFY_GLOBAL_BURST = 25  # messages that may go out at once across all chats before pacing starts
+NOTIFY_CHAT_RATE = 1.0  # messages per second to one chat
+NOTIFY_CHAT_BURST = 3
+NOTIFY_COALESCE_WINDOW = 2.0  # seconds a notice waits for more to group into one digest
+NOTIFY_MAX_PENDING = 10000  # queued notices before the oldest are dropped
+
+# Control bot updates: different users are handled concurrently, each user's in order
+UPDATE_CONCURRENCY = 256  # updates running at once; 1 handles them one by one
+UPDATE_MAX_PENDING = 4096  # updates admitted at once, running or waiting for their user
+
+# Receiving updates: polling by default. Set WEBHOOK_URL to the public HTTPS
+# address (e.g. a reverse proxy) that forwards to WEBHOOK_LISTEN:WEBHOOK_PORT,
+# and Telegram pushes updates to webhook_server.py instead (needs aiohttp)
+WEBHOOK_URL = None  # e.g. "https://bot.example.com"; None uses polling
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = None  # checked on every webhook request; None picks a random one at startup
+WEBHOOK_MAX_CONNECTIONS = 40  # concurrent webhook requests Telegram may open
+
 # Messages
 WELCOME_MESSAGE = """
 🎯 مرحباً بك في بوت تجميع النجوم التلقائي!
@@ -51,4 +110,10 @@ START_COLLECTING = "🚀 بدء التجميع التلقائي"
 STOP_COLLECTING = "⏹️ إيقاف التجميع"
 ACCOUNT_STATUS = "📊 حالة الحساب"
 REGISTER_ACCOUNT = "📝 تسجيل حساب جديد"
+NOTIFICATION_SETTINGS = "🔔 التنبيهات"
+
+NOTIFY_MODE_EVERY = "🔔 عند كل مهمة"
+NOTIFY_MODE_HOURLY = "🕐 ملخص كل ساعة"
+NOTIFY_MODE_DAILY = "📅 ملخص يومي"
+NOTIFY_MODE_ERRORS = "⚠️ الأخطاء فقط"
 
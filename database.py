@@ -1,65 +1,159 @@
 import sqlite3
+import asyncio
+import functools
 import logging
-from typing import Optional, List, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Tuple, Set
 import json
 
+from migrations import run_migrations
+
 logger = logging.getLogger(__name__)
 
+def _utc_timestamp() -> str:
+    """Current time formatted like SQLite's CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+class TTLCache:
+    """Thread-safe bounded LRU cache whose entries expire after ``ttl`` seconds.
+    
+    Writers call invalidate() after committing. Readers take a token() before
+    querying the database and pass it to put(), so a row read before a
+    concurrent invalidation of the same key is never cached over the newer
+    data. Invalidating one key does not turn away puts for other keys. The
+    last ``maxsize`` invalidated keys are tracked individually; older ones
+    fall back to a shared floor, which can only reject more puts, never fewer.
+    """
+    
+    _MISSING = object()
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._clock = 0
+        # key -> clock of its latest invalidation
+        self._invalidated: "OrderedDict[Any, int]" = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return the cached value, or TTLCache._MISSING"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return self._MISSING
+    
+    def token(self) -> int:
+        with self._lock:
+            return self._clock
+    
+    def put(self, key, value, token: int):
+        with self._lock:
+            if token < self._invalidated.get(key, self._floor) or self.maxsize <= 0:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def invalidate(self, *keys):
+        with self._lock:
+            self._clock += 1
+            for key in keys:
+                self._data.pop(key, None)
+                self._invalidated[key] = self._clock
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, self._floor = self._invalidated.popitem(last=False)
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
 class DatabaseManager:
-    def __init__(self, db_file: str):
+    def __init__(self, db_file: str, synchronous: str = "NORMAL",
+                 cached_statements: int = 128, busy_timeout: float = 30.0,
+                 cache_size: int = 10000, cache_ttl: float = 300.0):
         self.db_file = db_file
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self._user_cache = TTLCache(cache_size, cache_ttl)
+        self._settings_cache = TTLCache(cache_size, cache_ttl)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._closed = False
         self.init_database()
     
-    def init_database(self):
-        """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                phone_number TEXT UNIQUE,
-                session_string TEXT,
-                is_active INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP,
-                total_stars REAL DEFAULT 0,
-                registration_state TEXT DEFAULT 'none'
-            )
-        """)
-        
-        # Tasks table to track completed tasks
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                task_type TEXT,
-                channel_link TEXT,
-                reward REAL,
-                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
+    def _get_connection(self) -> sqlite3.Connection:
+        """Return the long-lived connection owned by the calling thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        if self._closed:
+            raise sqlite3.ProgrammingError("DatabaseManager is closed")
         
-        # Settings table for user-specific settings
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_settings (
-                user_id INTEGER PRIMARY KEY,
-                auto_collect INTEGER DEFAULT 0,
-                notifications INTEGER DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute("PRAGMA temp_store=MEMORY")
         
-        conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully")
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
+    def close(self):
+        """Close every pooled connection; safe to call more than once"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+            self._closed = True
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.error(f"Error closing database connection: {e}")
+        self._local = threading.local()
+        logger.info("Database connections closed")
+    
+    def _rollback(self):
+        """Discard a half-finished transaction on the calling thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and conn.in_transaction:
+            try:
+                conn.rollback()
+            except Exception as e:
+                logger.error(f"Error rolling back transaction: {e}")
+    
+    def init_database(self):
+        """Initialize the database and apply any pending schema migrations"""
+        conn = self._get_connection()
+        version = run_migrations(conn)
+        logger.info(f"Database initialized successfully (schema version {version})")
     
     def add_user(self, user_id: int, phone_number: str = None) -> bool:
         """Add a new user to the database"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -73,16 +167,18 @@ class DatabaseManager:
             """, (user_id,))
             
             conn.commit()
-            conn.close()
+            self._user_cache.invalidate(user_id)
+            self._settings_cache.invalidate(user_id)
             return True
         except Exception as e:
+            self._rollback()
             logger.error(f"Error adding user {user_id}: {e}")
             return False
     
     def update_user_session(self, user_id: int, session_string: str) -> bool:
         """Update user's session string"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -92,16 +188,17 @@ class DatabaseManager:
             """, (session_string, user_id))
             
             conn.commit()
-            conn.close()
+            self._user_cache.invalidate(user_id)
             return True
         except Exception as e:
+            self._rollback()
             logger.error(f"Error updating session for user {user_id}: {e}")
             return False
     
     def update_user_phone(self, user_id: int, phone_number: str) -> bool:
         """Update user's phone number"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -111,16 +208,17 @@ class DatabaseManager:
             """, (phone_number, user_id))
             
             conn.commit()
-            conn.close()
+            self._user_cache.invalidate(user_id)
             return True
         except Exception as e:
+            self._rollback()
             logger.error(f"Error updating phone for user {user_id}: {e}")
             return False
     
     def update_registration_state(self, user_id: int, state: str) -> bool:
         """Update user's registration state"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -130,16 +228,25 @@ class DatabaseManager:
             """, (state, user_id))
             
             conn.commit()
-            conn.close()
+            self._user_cache.invalidate(user_id)
             return True
         except Exception as e:
+            self._rollback()
             logger.error(f"Error updating registration state for user {user_id}: {e}")
             return False
     
     def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user information"""
+        hit, user = self.get_cached_user(user_id)
+        if hit:
+            return user
+        return self.fetch_user(user_id)
+    
+    def fetch_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Read user information from SQLite and refresh the cache"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            token = self._user_cache.token()
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -147,20 +254,26 @@ class DatabaseManager:
             """, (user_id,))
             
             row = cursor.fetchone()
-            conn.close()
             
+            result = None
             if row:
                 columns = [description[0] for description in cursor.description]
-                return dict(zip(columns, row))
-            return None
+                result = dict(zip(columns, row))
+            self._user_cache.put(user_id, result, token)
+            return dict(result) if result is not None else None
         except Exception as e:
             logger.error(f"Error getting user {user_id}: {e}")
             return None
     
     def get_user_settings(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user settings"""
+        cached = self._settings_cache.get(user_id)
+        if cached is not TTLCache._MISSING:
+            return dict(cached) if cached is not None else None
+        
         try:
-            conn = sqlite3.connect(self.db_file)
+            token = self._settings_cache.token()
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -168,12 +281,13 @@ class DatabaseManager:
             """, (user_id,))
             
             row = cursor.fetchone()
-            conn.close()
             
+            result = None
             if row:
                 columns = [description[0] for description in cursor.description]
-                return dict(zip(columns, row))
-            return None
+                result = dict(zip(columns, row))
+            self._settings_cache.put(user_id, result, token)
+            return dict(result) if result is not None else None
         except Exception as e:
             logger.error(f"Error getting settings for user {user_id}: {e}")
             return None
@@ -181,7 +295,7 @@ class DatabaseManager:
     def set_auto_collect(self, user_id: int, enabled: bool) -> bool:
         """Enable/disable auto collection for user"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -197,40 +311,325 @@ class DatabaseManager:
             """, (1 if enabled else 0, user_id))
             
             conn.commit()
-            conn.close()
+            self._user_cache.invalidate(user_id)
+            self._settings_cache.invalidate(user_id)
             return True
         except Exception as e:
+            self._rollback()
             logger.error(f"Error setting auto collect for user {user_id}: {e}")
             return False
     
+    def set_notification_mode(self, user_id: int, mode: str) -> bool:
+        """Store how the user wants to be told about completed tasks"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE user_settings 
+                SET notification_mode = ?
+                WHERE user_id = ?
+            """, (mode, user_id))
+            
+            conn.commit()
+            self._settings_cache.invalidate(user_id)
+            return cursor.rowcount > 0
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error setting notification mode for user {user_id}: {e}")
+            return False
+    
+    def get_notification_modes(self) -> List[Tuple[int, str]]:
+        """(user_id, mode) for every user who left the default mode"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id, notification_mode FROM user_settings
+                WHERE notification_mode != 'every'
+            """)
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading notification modes: {e}")
+            return []
+    
+    def get_task_summaries(self, user_ids: List[int], since: str, until: str,
+                           chunk_size: int = 500) -> Dict[int, Tuple[int, float]]:
+        """Tasks and stars per user completed in [since, until) (CURRENT_TIMESTAMP format)"""
+        summaries: Dict[int, Tuple[int, float]] = {}
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            for start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[start:start + chunk_size]
+                cursor.execute(f"""
+                    SELECT user_id, COUNT(*), COALESCE(SUM(reward), 0)
+                    FROM tasks
+                    WHERE user_id IN ({','.join('?' * len(chunk))})
+                      AND completed_at >= ? AND completed_at < ?
+                    GROUP BY user_id
+                """, (*chunk, since, until))
+                for user_id, tasks, stars in cursor.fetchall():
+                    summaries[user_id] = (tasks, stars)
+            return summaries
+        except Exception as e:
+            logger.error(f"Error getting task summaries for {len(user_ids)} users: {e}")
+            return summaries
+    
+    def get_daily_summaries(self, user_ids: List[int], day: str,
+                            chunk_size: int = 500) -> Dict[int, Tuple[int, float]]:
+        """Tasks and stars per user on one UTC day (YYYY-MM-DD), from daily_user_stats"""
+        summaries: Dict[int, Tuple[int, float]] = {}
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            for start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[start:start + chunk_size]
+                cursor.execute(f"""
+                    SELECT user_id, tasks_completed, stars
+                    FROM daily_user_stats
+                    WHERE day = ? AND user_id IN ({','.join('?' * len(chunk))})
+                """, (day, *chunk))
+                for user_id, tasks, stars in cursor.fetchall():
+                    summaries[user_id] = (tasks, stars)
+            return summaries
+        except Exception as e:
+            logger.error(f"Error getting daily summaries for {len(user_ids)} users: {e}")
+            return summaries
+    
     def add_task(self, user_id: int, task_type: str, channel_link: str, reward: float) -> bool:
         """Add a completed task to the database"""
+        return self.add_tasks([(user_id, task_type, channel_link, reward, _utc_timestamp())])
+    
+    def add_tasks(self, tasks: List[Tuple[int, str, str, float, str]]) -> bool:
+        """Add a batch of completed tasks in a single transaction.
+        
+        Each record is (user_id, task_type, channel_link, reward, completed_at),
+        with completed_at in SQLite's CURRENT_TIMESTAMP format (UTC).
+        """
+        if not tasks:
+            return True
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("""
-                INSERT INTO tasks (user_id, task_type, channel_link, reward)
+            cursor.executemany("""
+                INSERT INTO tasks (user_id, task_type, channel_link, reward, completed_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, tasks)
+            
+            totals: Dict[int, float] = {}
+            daily: Dict[Tuple[int, str], List[float]] = {}
+            for user_id, _, _, reward, completed_at in tasks:
+                totals[user_id] = totals.get(user_id, 0) + reward
+                counters = daily.setdefault((user_id, completed_at[:10]), [0, 0.0])
+                counters[0] += 1
+                counters[1] += reward
+            
+            cursor.executemany("""
+                INSERT INTO daily_user_stats (user_id, day, tasks_completed, stars)
                 VALUES (?, ?, ?, ?)
-            """, (user_id, task_type, channel_link, reward))
+                ON CONFLICT (user_id, day) DO UPDATE SET
+                    tasks_completed = tasks_completed + excluded.tasks_completed,
+                    stars = stars + excluded.stars
+            """, [(user_id, day, count, stars) for (user_id, day), (count, stars) in daily.items()])
             
-            cursor.execute("""
+            cursor.executemany("""
                 UPDATE users 
                 SET total_stars = total_stars + ?, last_activity = CURRENT_TIMESTAMP
                 WHERE user_id = ?
-            """, (reward, user_id))
+            """, [(reward, user_id) for user_id, reward in totals.items()])
             
             conn.commit()
-            conn.close()
+            self._user_cache.invalidate(*totals.keys())
             return True
         except Exception as e:
-            logger.error(f"Error adding task for user {user_id}: {e}")
+            self._rollback()
+            logger.error(f"Error adding batch of {len(tasks)} tasks: {e}")
             return False
     
+    def get_adaptive_delays(self) -> List[Tuple[int, str, float]]:
+        """Load every learned delay as (user_id, kind, delay)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id, kind, delay FROM adaptive_delays")
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading adaptive delays: {e}")
+            return []
+    
+    def save_adaptive_delays(self, delays: List[Tuple[int, str, float]]) -> bool:
+        """Upsert learned delays given as (user_id, kind, delay)"""
+        if not delays:
+            return True
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO adaptive_delays (user_id, kind, delay, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (user_id, kind) DO UPDATE SET
+                    delay = excluded.delay,
+                    updated_at = excluded.updated_at
+            """, delays)
+            conn.commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error saving {len(delays)} adaptive delays: {e}")
+            return False
+    
+    def get_channel_outcomes(self, since: float) -> List[Tuple[str, str, int, float, int]]:
+        """Channel records that failed at or after since, as (channel, outcome, failures, failed_at, skips)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT channel, outcome, failures, failed_at, skips
+                FROM channel_outcomes WHERE failed_at >= ?
+            """, (since,))
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading channel outcomes: {e}")
+            return []
+    
+    def save_channel_outcomes(self, outcomes: List[Tuple[str, str, int, float, int]],
+                              prune_before: Optional[float] = None) -> bool:
+        """Upsert channel records and drop those that last failed before prune_before"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO channel_outcomes (channel, outcome, failures, failed_at, skips)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (channel) DO UPDATE SET
+                    outcome = excluded.outcome,
+                    failures = excluded.failures,
+                    failed_at = excluded.failed_at,
+                    skips = excluded.skips
+            """, outcomes)
+            if prune_before is not None:
+                cursor.execute("DELETE FROM channel_outcomes WHERE failed_at < ?", (prune_before,))
+            conn.commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error saving {len(outcomes)} channel outcomes: {e}")
+            return False
+    
+    def get_channel_outcome_stats(self) -> Dict[str, int]:
+        """Known channels per outcome and the join requests saved by skipping them"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT outcome, COUNT(*), COALESCE(SUM(skips), 0)
+                FROM channel_outcomes GROUP BY outcome
+            """)
+            stats = {'joins_saved': 0}
+            for outcome, channels, skips in cursor.fetchall():
+                stats[outcome] = channels
+                stats['joins_saved'] += skips
+            return stats
+        except Exception as e:
+            logger.error(f"Error getting channel outcome stats: {e}")
+            return {}
+    
+    def acquire_lease(self, user_id: int, node_id: str, expires_at: float, now: float) -> bool:
+        """Take or extend the account's lease unless another node holds an unexpired one"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO account_leases (user_id, node_id, expires_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    node_id = excluded.node_id,
+                    expires_at = excluded.expires_at
+                WHERE account_leases.node_id = excluded.node_id
+                   OR account_leases.expires_at < ?
+            """, (user_id, node_id, expires_at, now))
+            conn.commit()
+            return cursor.rowcount > 0
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error acquiring lease for user {user_id}: {e}")
+            return False
+    
+    def renew_leases(self, node_id: str, expires_at: float, now: float) -> Optional[List[int]]:
+        """Extend every unexpired lease of the node; return the accounts it still holds"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE account_leases SET expires_at = ?
+                WHERE node_id = ? AND expires_at >= ?
+            """, (expires_at, node_id, now))
+            cursor.execute("""
+                SELECT user_id FROM account_leases WHERE node_id = ? AND expires_at = ?
+            """, (node_id, expires_at))
+            held = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            return held
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error renewing leases of node {node_id}: {e}")
+            return None
+    
+    def release_lease(self, user_id: int, node_id: str) -> bool:
+        try:
+            conn = self._get_connection()
+            conn.execute("""
+                DELETE FROM account_leases WHERE user_id = ? AND node_id = ?
+            """, (user_id, node_id))
+            conn.commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error releasing lease for user {user_id}: {e}")
+            return False
+    
+    def get_expired_leases(self, now: float) -> List[int]:
+        """Accounts whose owning node stopped renewing its lease"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id FROM account_leases WHERE expires_at < ?", (now,))
+            return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting expired leases: {e}")
+            return []
+    
+    def discard_expired_leases(self, user_ids: List[int], now: float) -> bool:
+        """Delete these accounts' leases if they are still expired"""
+        try:
+            conn = self._get_connection()
+            conn.executemany("""
+                DELETE FROM account_leases WHERE user_id = ? AND expires_at < ?
+            """, [(user_id, now) for user_id in user_ids])
+            conn.commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error discarding {len(user_ids)} expired leases: {e}")
+            return False
+    
+    def get_cached_user(self, user_id: int) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Return (hit, user) from the cache only, without touching SQLite"""
+        cached = self._user_cache.get(user_id)
+        if cached is TTLCache._MISSING:
+            return False, None
+        return True, dict(cached) if cached is not None else None
+    
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss counters and sizes of the user and settings caches"""
+        return {'users': self._user_cache.stats(), 'settings': self._settings_cache.stats()}
+    
     def get_active_users(self) -> List[Dict[str, Any]]:
         """Get all users with auto collection enabled"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -241,7 +640,6 @@ class DatabaseManager:
             """)
             
             rows = cursor.fetchall()
-            conn.close()
             
             columns = [description[0] for description in cursor.description]
             return [dict(zip(columns, row)) for row in rows]
@@ -252,20 +650,19 @@ class DatabaseManager:
     def get_user_stats(self, user_id: int) -> Dict[str, Any]:
         """Get user statistics"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
                 SELECT 
                     total_stars,
-                    (SELECT COUNT(*) FROM tasks WHERE user_id = ?) as total_tasks,
-                    (SELECT COUNT(*) FROM tasks WHERE user_id = ? AND DATE(completed_at) = DATE('now')) as today_tasks
+                    (SELECT SUM(tasks_completed) FROM daily_user_stats WHERE user_id = ?) as total_tasks,
+                    (SELECT tasks_completed FROM daily_user_stats WHERE user_id = ? AND day = DATE('now')) as today_tasks
                 FROM users 
                 WHERE user_id = ?
             """, (user_id, user_id, user_id))
             
             row = cursor.fetchone()
-            conn.close()
             
             if row:
                 return {
@@ -276,4 +673,195 @@ class DatabaseManager:
             return {'total_stars': 0, 'total_tasks': 0, 'today_tasks': 0}
         except Exception as e:
             logger.error(f"Error getting stats for user {user_id}: {e}")
-            return {'total_stars': 0, 'total_tasks': 0, 'today_tasks': 0}
\ No newline at end of file
+            return {'total_stars': 0, 'total_tasks': 0, 'today_tasks': 0}
+
+
+class AsyncDatabaseManager:
+    """Awaitable facade over DatabaseManager for use from coroutines.
+    
+    Writes are serialized on a single dedicated writer thread and reads run on
+    a small reader pool, so a slow commit or fsync never blocks the event loop
+    that drives the bot and every user's Telethon client.
+    
+    Task completions are write-behind: add_task() only buffers the record, and
+    buffered records from all users are written together in one transaction
+    every ``task_flush_interval`` seconds, or as soon as ``task_flush_size``
+    records are waiting. Durability guarantees:
+    
+    * aclose() and close() write every buffered record before returning.
+      A flush already under way is waited for, even if its caller is cancelled.
+    * A failed flush (e.g. the database is locked) keeps the batch buffered
+      and retries it on the next cycle, so records are never dropped on error.
+    * A hard crash (SIGKILL, power loss) can lose at most the records buffered
+      since the last flush, i.e. roughly ``task_flush_interval`` seconds.
+    * Records keep the time they were completed, not the time of the flush.
+    """
+    
+    def __init__(self, db_file: str, read_workers: int = 4,
+                 task_flush_interval: float = 2.0, task_flush_size: int = 200, **kwargs):
+        self.sync = DatabaseManager(db_file, **kwargs)
+        self.task_flush_interval = task_flush_interval
+        self.task_flush_size = task_flush_size
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-reader")
+        self._pending_tasks: List[Tuple[int, str, str, float, str]] = []
+        self._flush_wakeup: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        # Batch writes in progress; they outlive a cancelled caller
+        self._flushes: Set[asyncio.Task] = set()
+        self._closing = False
+    
+    async def _write(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(func, *args))
+    
+    async def _read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(func, *args))
+    
+    async def add_user(self, user_id: int, phone_number: str = None) -> bool:
+        return await self._write(self.sync.add_user, user_id, phone_number)
+    
+    async def update_user_session(self, user_id: int, session_string: str) -> bool:
+        return await self._write(self.sync.update_user_session, user_id, session_string)
+    
+    async def update_user_phone(self, user_id: int, phone_number: str) -> bool:
+        return await self._write(self.sync.update_user_phone, user_id, phone_number)
+    
+    async def update_registration_state(self, user_id: int, state: str) -> bool:
+        return await self._write(self.sync.update_registration_state, user_id, state)
+    
+    async def set_auto_collect(self, user_id: int, enabled: bool) -> bool:
+        return await self._write(self.sync.set_auto_collect, user_id, enabled)
+    
+    async def set_notification_mode(self, user_id: int, mode: str) -> bool:
+        return await self._write(self.sync.set_notification_mode, user_id, mode)
+    
+    async def add_task(self, user_id: int, task_type: str, channel_link: str, reward: float) -> bool:
+        """Buffer a completed task; it is written by the next batched flush"""
+        self._pending_tasks.append((user_id, task_type, channel_link, reward, _utc_timestamp()))
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_wakeup = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if len(self._pending_tasks) >= self.task_flush_size:
+            self._flush_wakeup.set()
+        return True
+    
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.task_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            await self.flush_tasks()
+    
+    async def flush_tasks(self) -> bool:
+        """Write every buffered task completion in a single transaction"""
+        if not self._pending_tasks:
+            return True
+        
+        batch, self._pending_tasks = self._pending_tasks, []
+        flush = asyncio.create_task(self._write_batch(batch))
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+        # The batch is out of the buffer now, so cancelling the caller must not cancel its write
+        return await asyncio.shield(flush)
+    
+    async def _write_batch(self, batch: List[Tuple[int, str, str, float, str]]) -> bool:
+        success = await self._write(self.sync.add_tasks, batch)
+        if not success:
+            # Keep the batch (in order) for the next flush attempt
+            self._pending_tasks = batch + self._pending_tasks
+            logger.warning(f"Task flush failed, {len(self._pending_tasks)} records kept for retry")
+        return success
+    
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        # Cache hits are answered inline, without a hop to the reader pool
+        hit, user = self.sync.get_cached_user(user_id)
+        if hit:
+            return user
+        return await self._read(self.sync.fetch_user, user_id)
+    
+    async def get_user_settings(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await self._read(self.sync.get_user_settings, user_id)
+    
+    async def get_active_users(self) -> List[Dict[str, Any]]:
+        return await self._read(self.sync.get_active_users)
+    
+    async def get_user_stats(self, user_id: int) -> Dict[str, Any]:
+        # Read-your-writes: make this user's buffered completions visible first
+        if any(task[0] == user_id for task in self._pending_tasks):
+            await self.flush_tasks()
+        return await self._read(self.sync.get_user_stats, user_id)
+    
+    async def get_notification_modes(self) -> List[Tuple[int, str]]:
+        return await self._read(self.sync.get_notification_modes)
+    
+    async def get_task_summaries(self, user_ids: List[int], since: str, until: str) -> Dict[int, Tuple[int, float]]:
+        # Summaries count buffered completions too
+        await self.flush_tasks()
+        return await self._read(self.sync.get_task_summaries, user_ids, since, until)
+    
+    async def get_daily_summaries(self, user_ids: List[int], day: str) -> Dict[int, Tuple[int, float]]:
+        await self.flush_tasks()
+        return await self._read(self.sync.get_daily_summaries, user_ids, day)
+    
+    async def get_adaptive_delays(self) -> List[Tuple[int, str, float]]:
+        return await self._read(self.sync.get_adaptive_delays)
+    
+    async def save_adaptive_delays(self, delays: List[Tuple[int, str, float]]) -> bool:
+        return await self._write(self.sync.save_adaptive_delays, delays)
+    
+    async def get_channel_outcomes(self, since: float) -> List[Tuple[str, str, int, float, int]]:
+        return await self._read(self.sync.get_channel_outcomes, since)
+    
+    async def save_channel_outcomes(self, outcomes: List[Tuple[str, str, int, float, int]],
+                                    prune_before: Optional[float] = None) -> bool:
+        return await self._write(self.sync.save_channel_outcomes, outcomes, prune_before)
+    
+    async def get_channel_outcome_stats(self) -> Dict[str, int]:
+        return await self._read(self.sync.get_channel_outcome_stats)
+    
+    async def acquire_lease(self, user_id: int, node_id: str, expires_at: float, now: float) -> bool:
+        return await self._write(self.sync.acquire_lease, user_id, node_id, expires_at, now)
+    
+    async def renew_leases(self, node_id: str, expires_at: float, now: float) -> Optional[List[int]]:
+        return await self._write(self.sync.renew_leases, node_id, expires_at, now)
+    
+    async def release_lease(self, user_id: int, node_id: str) -> bool:
+        return await self._write(self.sync.release_lease, user_id, node_id)
+    
+    async def get_expired_leases(self, now: float) -> List[int]:
+        return await self._read(self.sync.get_expired_leases, now)
+    
+    async def discard_expired_leases(self, user_ids: List[int], now: float) -> bool:
+        return await self._write(self.sync.discard_expired_leases, user_ids, now)
+    
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        return self.sync.cache_stats()
+    
+    async def aclose(self):
+        """Stop the background flusher and write any buffered completions"""
+        self._closing = True
+        if self._flush_task is not None:
+            # Let the loop finish the flush it may be in the middle of instead of cancelling it
+            self._flush_wakeup.set()
+            await self._flush_task
+            self._flush_task = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes)
+        await self.flush_tasks()
+    
+    def close(self):
+        """Wait for queued operations to finish, then close the connections"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        if self._pending_tasks:
+            # Last chance for records buffered after the event loop stopped
+            if self.sync.add_tasks(self._pending_tasks):
+                self._pending_tasks = []
+            else:
+                logger.error(f"Lost {len(self._pending_tasks)} buffered task records on close")
+        self.sync.close()
@@ -0,0 +1,77 @@
+"""Throughput of the DatabaseManager calls the bot makes most.
+
+Seeds a temporary database with --users registered users, then times
+get_user, add_task and get_user_stats called one after another from a
+single thread and prints operations per second for each.
+
+    python db_bench.py --users 200 --ops 5000
+
+--per-call closes the calling thread's connection after every operation,
+so each call pays for sqlite3.connect and the PRAGMAs the way the manager
+did before it kept one connection per thread. --no-cache turns the user
+and settings caches off so get_user always reads SQLite.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from typing import Callable, Dict
+
+from database import DatabaseManager
+
+
+def _drop_connection(db: DatabaseManager):
+    """Close the calling thread's pooled connection so the next call opens a new one"""
+    conn = db._local.__dict__.pop('conn', None)
+    if conn is None:
+        return
+    with db._connections_lock:
+        db._connections.remove(conn)
+    conn.close()
+
+
+def _time(operation: Callable[[int], object], ops: int, after: Callable[[], None]) -> float:
+    started = time.perf_counter()
+    for i in range(ops):
+        operation(i)
+        after()
+    return ops / (time.perf_counter() - started)
+
+
+def run_bench(db_file: str, users: int, ops: int, per_call: bool = False,
+              no_cache: bool = False) -> Dict[str, float]:
+    db = DatabaseManager(db_file, cache_size=0 if no_cache else 10000)
+    for user_id in range(1, users + 1):
+        db.add_user(user_id)
+        db.update_user_session(user_id, f"account-{user_id}")
+
+    after = (lambda: _drop_connection(db)) if per_call else (lambda: None)
+    report = {
+        'get_user_ops': _time(lambda i: db.get_user(i % users + 1), ops, after),
+        'add_task_ops': _time(lambda i: db.add_task(i % users + 1, 'channel_join', '', 0.25), ops, after),
+        'get_user_stats_ops': _time(lambda i: db.get_user_stats(i % users + 1), ops, after),
+    }
+    db.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the most used DatabaseManager calls")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--ops', type=int, default=5000, help="calls timed per operation")
+    parser.add_argument('--per-call', action='store_true',
+                        help="open a new connection for every call, as before pooling")
+    parser.add_argument('--no-cache', action='store_true', help="disable the user and settings caches")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run_bench(os.path.join(tmp, "bench.db"), args.users, args.ops, args.per_call, args.no_cache)
+    for key, value in report.items():
+        print(f"{key:24s} {value:10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import logging
+import time
+from collections import Counter, OrderedDict
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LinkKind(Enum):
+    ADDLIST = "addlist"
+    BOT = "bot"
+    INVITE = "invite"
+    PUBLIC = "public"
+
+
+class JoinOutcome(Enum):
+    """Join results that hold for every account, not just the one that saw them"""
+    EXPIRED = "expired"
+    PRIVATE = "private"
+    NEEDS_APPROVAL = "needs_approval"
+    NONEXISTENT = "nonexistent"
+
+
+# Outcomes an account can also get for itself, e.g. PRIVATE when that account is banned from the channel
+ACCOUNT_SPECIFIC_OUTCOMES = frozenset({JoinOutcome.PRIVATE})
+
+
+class LinkTarget(NamedTuple):
+    kind: LinkKind
+    # Username (without @) for public channels and bots, hash for invites and addlists
+    value: str
+    # Human-readable channel name for logs and notifications
+    name: str
+
+    @property
+    def key(self) -> str:
+        """Identity of the channel behind the link, shared by its different spellings"""
+        if self.kind in (LinkKind.PUBLIC, LinkKind.BOT):
+            return f"@{self.value.lower()}"
+        return f"{self.kind.value}:{self.value}"
+
+
+def parse_link(link: str) -> LinkTarget:
+    """Work out what a task link points to, the way the join code has always read it"""
+    if 't.me/' in link:
+        channel_part = link.split('t.me/')[-1]
+        if channel_part.startswith('+'):
+            name = f"Private Channel ({channel_part[:15]}...)"
+        else:
+            name = f"@{channel_part}"
+    else:
+        channel_part = None
+        name = "Unknown Channel"
+
+    if '/addlist/' in link:
+        return LinkTarget(LinkKind.ADDLIST, link.split('/addlist/')[-1], name)
+    if channel_part is not None and channel_part.split('?')[0].lower().endswith('bot'):
+        return LinkTarget(LinkKind.BOT, link.split('/')[-1].split('?')[0], name)
+    if link.startswith('https://t.me/+') or link.startswith('t.me/+'):
+        return LinkTarget(LinkKind.INVITE, link.split('+')[-1], name)
+
+    username = link.split('/')[-1]
+    if username.startswith('@'):
+        username = username[1:]
+    return LinkTarget(LinkKind.PUBLIC, username, name)
+
+
+class ChannelRecord:
+    """What is known about joining one channel"""
+
+    __slots__ = ('outcome', 'failures', 'failed_at', 'skips')
+
+    def __init__(self, outcome: JoinOutcome, failures: int, failed_at: float, skips: int = 0):
+        self.outcome = outcome
+        # Failures since the last successful join, before decay; 0 once someone got in
+        self.failures = failures
+        self.failed_at = failed_at
+        # Join requests saved by skipping this channel, over its whole history
+        self.skips = skips
+
+
+class LinkCache:
+    """Parsed task links and known join outcomes, shared by all accounts of a process.
+
+    The same task channel is handed to many accounts, so each link is parsed
+    once, and a channel found expired, private, nonexistent or behind join
+    approval is skipped by every account without spending a join request.
+    A channel is trusted to stay bad for ``outcome_ttl`` seconds after its
+    first failure, doubling with every repeated failure up to
+    ``max_outcome_ttl``. The failure count halves every
+    ``failure_half_life`` seconds without a new failure, and a successful
+    join clears it. Records are persisted through take_dirty()/load() like
+    AdaptiveTiming's delays, so the blacklist survives restarts.
+
+    An outcome in ACCOUNT_SPECIFIC_OUTCOMES may only concern the account
+    that saw it. Only that account skips the channel, for ``outcome_ttl``
+    seconds. The channel is skipped for everyone once
+    ``min_reporting_accounts`` distinct accounts have reported it within
+    that time.
+    """
+
+    def __init__(self, max_links: int = 10000, outcome_ttl: float = 3600.0,
+                 max_outcome_ttl: float = 7 * 86400.0, failure_half_life: float = 86400.0,
+                 min_reporting_accounts: int = 3):
+        self.max_links = max_links
+        self.outcome_ttl = outcome_ttl
+        self.max_outcome_ttl = max_outcome_ttl
+        self.failure_half_life = failure_half_life
+        self.min_reporting_accounts = min_reporting_accounts
+        self._targets: "OrderedDict[str, LinkTarget]" = OrderedDict()
+        # channel key -> record; times are wall-clock so they can be persisted
+        self._outcomes: Dict[str, ChannelRecord] = {}
+        # channel key -> {user_id: failed_at} for account-specific outcomes not yet fleet-wide
+        self._reports: "OrderedDict[str, Dict[int, float]]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        self.stats = Counter()
+
+    def target(self, link: str) -> LinkTarget:
+        target = self._targets.get(link)
+        if target is not None:
+            self._targets.move_to_end(link)
+            return target
+
+        target = self._targets[link] = parse_link(link)
+        if len(self._targets) > self.max_links:
+            self._targets.popitem(last=False)
+        return target
+
+    def _failures(self, record: ChannelRecord, now: float) -> int:
+        """Failure count after decay"""
+        if not record.failures:
+            return 0
+        return record.failures >> min(62, int((now - record.failed_at) / self.failure_half_life))
+
+    def _trusted_until(self, record: ChannelRecord) -> float:
+        if not record.failures:
+            return 0.0
+        ttl = self.outcome_ttl * 2 ** min(62, record.failures - 1)
+        return record.failed_at + min(self.max_outcome_ttl, ttl)
+
+    def outcome(self, target: LinkTarget, user_id: Optional[int] = None) -> Optional[JoinOutcome]:
+        """The channel's remembered outcome for this account, counting the join it saves; None if unknown"""
+        now = time.time()
+        record = self._outcomes.get(target.key)
+        if record is None or now >= self._trusted_until(record):
+            failed_at = self._reports.get(target.key, {}).get(user_id)
+            if failed_at is not None and now < failed_at + self.outcome_ttl:
+                self.stats['skipped_by_account'] += 1
+                return JoinOutcome.PRIVATE
+            return None
+        record.skips += 1
+        self._dirty.add(target.key)
+        self.stats[f'skipped.{record.outcome.value}'] += 1
+        return record.outcome
+
+    def remember(self, target: LinkTarget, outcome: JoinOutcome, user_id: Optional[int] = None):
+        """Record a failed join; account-specific outcomes need several accounts to apply to all"""
+        now = time.time()
+        if outcome in ACCOUNT_SPECIFIC_OUTCOMES and user_id is not None:
+            if not self._report(target.key, user_id, now):
+                return
+        record = self._outcomes.get(target.key)
+        if record is None:
+            if len(self._outcomes) >= self.max_links:
+                self._evict(now)
+            record = self._outcomes[target.key] = ChannelRecord(outcome, 0, now)
+        record.failures = self._failures(record, now) + 1
+        record.outcome = outcome
+        record.failed_at = now
+        self._dirty.add(target.key)
+        self.stats[f'recorded.{outcome.value}'] += 1
+
+    def _report(self, key: str, user_id: int, now: float) -> bool:
+        """Count an account's report; True once enough accounts agree to skip the channel for everyone"""
+        reports = self._reports.get(key)
+        if reports is None:
+            reports = self._reports[key] = {}
+            if len(self._reports) > self.max_links:
+                self._reports.popitem(last=False)
+        else:
+            self._reports.move_to_end(key)
+        reports[user_id] = now
+        for reporter in [reporter for reporter, failed_at in reports.items() if now >= failed_at + self.outcome_ttl]:
+            del reports[reporter]
+        self.stats['account_reports'] += 1
+        if len(reports) < self.min_reporting_accounts:
+            return False
+        del self._reports[key]
+        return True
+
+    def joined(self, target: LinkTarget):
+        """An account got into the channel; stop skipping it"""
+        # Whatever kept the reporting accounts out does not apply to everyone
+        self._reports.pop(target.key, None)
+        record = self._outcomes.get(target.key)
+        if record is not None and record.failures:
+            record.failures = 0
+            self._dirty.add(target.key)
+            self.stats['cleared'] += 1
+
+    def _evict(self, now: float):
+        for key in [key for key, record in self._outcomes.items() if now >= self._trusted_until(record)]:
+            del self._outcomes[key]
+        if len(self._outcomes) >= self.max_links:
+            # Still full of live entries: drop the ones that failed longest ago
+            oldest = sorted(self._outcomes, key=lambda key: self._outcomes[key].failed_at)
+            for key in oldest[:len(self._outcomes) - self.max_links + 1]:
+                del self._outcomes[key]
+
+    def load(self, rows: List[Tuple[str, str, int, float, int]]):
+        """Restore records saved by take_dirty()"""
+        outcomes = {outcome.value: outcome for outcome in JoinOutcome}
+        for channel, outcome, failures, failed_at, skips in rows:
+            if outcome in outcomes:
+                self._outcomes[channel] = ChannelRecord(outcomes[outcome], failures, failed_at, skips)
+        logger.info(f"Loaded {len(rows)} channel outcomes")
+
+    def take_dirty(self) -> List[Tuple[str, str, int, float, int]]:
+        """Return records changed since the last call as (channel, outcome, failures, failed_at, skips)"""
+        rows = []
+        for key in self._dirty:
+            record = self._outcomes.get(key)
+            if record is not None:
+                rows.append((key, record.outcome.value, record.failures, record.failed_at, record.skips))
+        self._dirty.clear()
+        return rows
+
+    def mark_unsaved(self, rows: List[Tuple[str, str, int, float, int]]):
+        """Put rows from take_dirty() back after a failed save"""
+        self._dirty.update(row[0] for row in rows)
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        now = time.time()
+        stats['links'] = len(self._targets)
+        stats['known_channels'] = len(self._outcomes)
+        stats['reported_channels'] = len(self._reports)
+        stats['blacklisted'] = sum(1 for record in self._outcomes.values() if now < self._trusted_until(record))
+        # Join requests saved this run; the persisted skips column covers all runs
+        stats['joins_saved'] = sum(value for key, value in self.stats.items() if key.startswith('skipped.'))
+        return stats
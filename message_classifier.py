@@ -0,0 +1,161 @@
+import logging
+import re
+from enum import Enum
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REWARD = 0.25
+
+
+class MessageKind(Enum):
+    RATE_LIMITED = "rate_limited"
+    COMPLETED = "completed"
+    TASK = "task"
+    NO_TASKS = "no_tasks"
+    SKIP = "skip"
+    CONFIRM = "confirm"
+    OTHER = "other"
+
+
+class MessageClassification(NamedTuple):
+    kind: MessageKind
+    channel_link: Optional[str] = None
+    reward: Optional[float] = None
+
+
+# Marker phrases per category: (case-sensitive, case-insensitive). The
+# case-insensitive ones are stored lowercase and checked against text.lower().
+_MARKERS = {
+    'rate_limited': (["Вы делаете слишком много запросов"], ["too many requests"]),
+    'completed': (["✅ Задание выполнено!", "Получено", "Task completed", "Completed"],
+                  ["задание выполнено"]),
+    'referral': ([], ["приглашенного друга", "реферальная ссылка", "starsovgamesbot?start=",
+                      "приглашайте по этой ссылке", "приглашено вами:"]),
+    'channel_task': ([], ["подпишитесь на канал", "🔴 подпишитесь на канал", "🔴 subscribe to",
+                          "нажмите «подтвердить»"]),
+    'reward_label': ([], ["вознаграждение:"]),
+    'no_tasks': ([], ["задания закончились", "no tasks available"]),
+    'skip': (["💡 Получайте** Звёзды** за **простые задания!** 👇",
+              "💡 Получайте Звёзды за простые задания!",
+              "1.** **Нажмите «Подписаться»**, дождитесь прогру",
+              "1. Нажмите «Подписаться», дождитесь прогрузки ссылки и подпишитесь",
+              "Нажмите «Подписаться», дождитесь прогрузки ссылки",
+              "⏩"], []),
+    'confirm': (["Подтвердить", "Confirm"], ["✅", "подтверд"]),
+    # Answer to a confirmation click before the bot has registered the join
+    'not_subscribed': ([], ["не подписались", "not subscribed"]),
+}
+
+
+def _compile_alternation(markers) -> Optional["re.Pattern"]:
+    if not markers:
+        return None
+    # Longest first so overlapping markers resolve the same way every time
+    return re.compile("|".join(re.escape(marker) for marker in sorted(markers, key=len, reverse=True)))
+
+
+# One precompiled alternation per category and case mode, so each category
+# costs a single C-level search instead of a Python loop over substrings
+_MATCHERS = {
+    category: (_compile_alternation(sensitive), _compile_alternation(insensitive))
+    for category, (sensitive, insensitive) in _MARKERS.items()
+}
+
+
+def _contains_any(text: str, text_lower: str, category: str) -> bool:
+    sensitive, insensitive = _MATCHERS[category]
+    return bool((sensitive and sensitive.search(text)) or
+                (insensitive and insensitive.search(text_lower)))
+
+
+# Tried in order; the first pattern with a non-excluded match wins
+_LINK_PATTERNS = [re.compile(pattern) for pattern in [
+    r'https://t\.me/\+[A-Za-z0-9\-_]+',  # Private channels
+    r't\.me/\+[A-Za-z0-9\-_]+',
+    r'https://t\.me/addlist/[A-Za-z0-9\-_]+',  # Addlist links
+    r't\.me/addlist/[A-Za-z0-9\-_]+',
+    r'https://t\.me/[A-Za-z0-9\-_]+',  # Regular channels
+    r't\.me/[A-Za-z0-9\-_]+',
+    r'@[A-Za-z0-9\-_]+'
+]]
+
+_EXCLUDED_LINK_PARTS = ('StarsovGamesBot', '?start=', '/start', 'bot?start')
+
+_REWARD_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    r'\+([0-9]+\.?[0-9]*)\s*⭐',  # +0.25⭐
+    r'Получено:\s*\+([0-9]+\.?[0-9]*)⭐',  # Получено: +0.25⭐
+    r'([0-9]+\.?[0-9]*)\s*⭐',  # 0.25⭐
+    r'reward:\s*([0-9]+\.?[0-9]*)',  # reward: 0.25
+    r'([0-9]+\.?[0-9]*)\s*stars?'  # 0.25 star(s)
+]]
+
+
+def extract_channel_link(text: str) -> Optional[str]:
+    """Return the first task channel link in text, normalized to https://t.me/..."""
+    for pattern in _LINK_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+
+        link = match.group(0)
+        if not link.startswith('http'):
+            if link.startswith('@'):
+                link = 'https://t.me/' + link[1:]
+            else:
+                link = 'https://' + link
+
+        if not any(part in link for part in _EXCLUDED_LINK_PARTS):
+            return link
+        logger.debug(f"Excluded bot/referral link: {link}")
+    return None
+
+
+def extract_reward(text: str) -> float:
+    """Return the star reward mentioned in text, or DEFAULT_REWARD"""
+    for pattern in _REWARD_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return float(match.group(1))
+
+    logger.warning(f"No reward found in text, using default: {text[:50]}...")
+    return DEFAULT_REWARD
+
+
+def is_not_subscribed(text: str) -> bool:
+    """Whether the bot refused a confirmation because the join is not registered yet"""
+    return _contains_any(text, text.lower(), 'not_subscribed')
+
+
+def classify_message(text: str) -> MessageClassification:
+    """Classify a message from the target bot and extract its link and reward.
+
+    The text is lowercased once and categories are checked, with precompiled
+    matchers, in the precedence the collector has always used: rate limit,
+    completion, channel task, no tasks, skip, confirm.
+    """
+    text_lower = text.lower()
+
+    if _contains_any(text, text_lower, 'rate_limited'):
+        return MessageClassification(MessageKind.RATE_LIMITED)
+
+    if _contains_any(text, text_lower, 'completed'):
+        return MessageClassification(MessageKind.COMPLETED, reward=extract_reward(text))
+
+    if (_contains_any(text, text_lower, 'channel_task')
+            and _contains_any(text, text_lower, 'reward_label')
+            and not _contains_any(text, text_lower, 'referral')):
+        channel_link = extract_channel_link(text)
+        if channel_link:
+            return MessageClassification(MessageKind.TASK, channel_link, extract_reward(text))
+
+    if _contains_any(text, text_lower, 'no_tasks'):
+        return MessageClassification(MessageKind.NO_TASKS)
+
+    if _contains_any(text, text_lower, 'skip'):
+        return MessageClassification(MessageKind.SKIP)
+
+    if _contains_any(text, text_lower, 'confirm'):
+        return MessageClassification(MessageKind.CONFIRM)
+
+    return MessageClassification(MessageKind.OTHER)
@@ -0,0 +1,239 @@
+import sqlite3
+import logging
+import time
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rows of `tasks` processed per committed transaction by backfill steps
+BACKFILL_CHUNK_SIZE = 50000
+
+
+def _create_base_tables(conn: sqlite3.Connection):
+    """Version 1: the original users/tasks/user_settings schema"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            phone_number TEXT UNIQUE,
+            session_string TEXT,
+            is_active INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP,
+            total_stars REAL DEFAULT 0,
+            registration_state TEXT DEFAULT 'none'
+        )
+    """)
+
+    # Tasks table to track completed tasks
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            task_type TEXT,
+            channel_link TEXT,
+            reward REAL,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # Settings table for user-specific settings
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            auto_collect INTEGER DEFAULT 0,
+            notifications INTEGER DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+
+def _add_task_indexes(conn: sqlite3.Connection):
+    """Version 2: index tasks by user and completion time"""
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tasks_user_completed
+        ON tasks (user_id, completed_at)
+    """)
+
+
+def _create_daily_user_stats(conn: sqlite3.Connection):
+    """Version 3: per-user daily rollup used by get_user_stats"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_user_stats (
+            user_id INTEGER,
+            day TEXT,
+            tasks_completed INTEGER DEFAULT 0,
+            stars REAL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    """)
+
+
+def _backfill_daily_user_stats(conn: sqlite3.Connection, chunk_size: int):
+    """Version 3 backfill: aggregate existing task rows into daily_user_stats.
+
+    Runs in chunks of task ids, each committed on its own, so the write lock is
+    only held for one chunk at a time. Progress is stored in
+    migration_progress in the same transaction as each chunk, so an
+    interrupted backfill resumes where it stopped without counting rows twice.
+    Rows inserted after the backfill started are already maintained by
+    DatabaseManager.add_tasks and are left alone.
+    """
+    row = conn.execute("""
+        SELECT last_id, max_id FROM migration_progress WHERE version = 3
+    """).fetchone()
+
+    if row is None:
+        conn.execute("BEGIN IMMEDIATE")
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM tasks").fetchone()[0]
+        # Start from a clean rollup in case an older build populated it
+        conn.execute("DELETE FROM daily_user_stats")
+        conn.execute("""
+            INSERT INTO migration_progress (version, last_id, max_id) VALUES (3, 0, ?)
+        """, (max_id,))
+        conn.commit()
+        last_id = 0
+    else:
+        last_id, max_id = row
+
+    while last_id < max_id:
+        upper = min(last_id + chunk_size, max_id)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            INSERT INTO daily_user_stats (user_id, day, tasks_completed, stars)
+            SELECT user_id, DATE(completed_at), COUNT(*), COALESCE(SUM(reward), 0)
+            FROM tasks
+            WHERE id > ? AND id <= ?
+            GROUP BY user_id, DATE(completed_at)
+            ON CONFLICT (user_id, day) DO UPDATE SET
+                tasks_completed = tasks_completed + excluded.tasks_completed,
+                stars = stars + excluded.stars
+        """, (last_id, upper))
+        conn.execute("""
+            UPDATE migration_progress SET last_id = ? WHERE version = 3
+        """, (upper,))
+        conn.commit()
+        last_id = upper
+        logger.info(f"Backfilled daily_user_stats up to task id {last_id}/{max_id}")
+        # Give other connections a chance to take the write lock between chunks
+        time.sleep(0)
+
+
+def _create_adaptive_delays(conn: sqlite3.Connection):
+    """Version 4: learned per-account delays kept across restarts (user_id 0 is global)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS adaptive_delays (
+            user_id INTEGER,
+            kind TEXT,
+            delay REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, kind)
+        ) WITHOUT ROWID
+    """)
+
+
+def _create_account_leases(conn: sqlite3.Connection):
+    """Version 5: which node currently drives each account, see account_leases.py"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS account_leases (
+            user_id INTEGER PRIMARY KEY,
+            node_id TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_account_leases_node
+        ON account_leases (node_id)
+    """)
+
+
+def _create_channel_outcomes(conn: sqlite3.Connection):
+    """Version 6: channels that could not be joined, shared by all accounts (see link_cache.py)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS channel_outcomes (
+            channel TEXT PRIMARY KEY,
+            outcome TEXT NOT NULL,
+            failures INTEGER NOT NULL DEFAULT 0,
+            failed_at REAL NOT NULL,
+            skips INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+
+def _add_notification_mode(conn: sqlite3.Connection):
+    """Version 7: per-user notification mode (see notification_preferences.py)"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(user_settings)")]
+    if 'notification_mode' in columns:
+        return
+    conn.execute("""
+        ALTER TABLE user_settings
+        ADD COLUMN notification_mode TEXT NOT NULL DEFAULT 'every'
+    """)
+    # The old on/off flag never silenced errors, so off maps to errors only
+    conn.execute("""
+        UPDATE user_settings SET notification_mode = 'errors' WHERE notifications = 0
+    """)
+
+
+# Ordered upgrade steps: (version, schema step, optional chunked backfill).
+# Schema steps must be idempotent: a step is committed before its backfill
+# runs, and user_version is only bumped once both have finished.
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None], Callable[[sqlite3.Connection, int], None]]] = [
+    (1, _create_base_tables, None),
+    (2, _add_task_indexes, None),
+    (3, _create_daily_user_stats, _backfill_daily_user_stats),
+    (4, _create_adaptive_delays, None),
+    (5, _create_account_leases, None),
+    (6, _create_channel_outcomes, None),
+    (7, _add_notification_mode, None),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(conn: sqlite3.Connection, chunk_size: int = BACKFILL_CHUNK_SIZE) -> int:
+    """Bring the database up to SCHEMA_VERSION and return the resulting version"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS migration_progress (
+            version INTEGER PRIMARY KEY,
+            last_id INTEGER,
+            max_id INTEGER
+        )
+    """)
+
+    current = get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {current} is newer than this build supports ({SCHEMA_VERSION})"
+        )
+
+    for version, step, backfill in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info(f"Applying database migration {version}")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            step(conn)
+            conn.commit()
+
+            if backfill:
+                backfill(conn, chunk_size)
+
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("DELETE FROM migration_progress WHERE version = ?", (version,))
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            logger.error(f"Database migration {version} failed")
+            raise
+
+        current = version
+
+    return current
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict, deque
+from enum import Enum, IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from request_scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Lane(IntEnum):
+    """Priority of an outgoing message; lower lanes are always served first"""
+    INTERACTIVE = 0  # replies to something the user just did
+    ALERT = 1        # errors from the collectors
+    NOTICE = 2       # task completions and other informational notices
+
+
+class NoticeKind(Enum):
+    """What a collector notification is about, as passed to TaskHandler._notify_user"""
+    COMPLETION = "completion"
+    ERROR = "error"
+    INFO = "info"
+
+
+class _Outgoing:
+    __slots__ = ('text', 'summary', 'reply_markup', 'parse_mode', 'future', 'queued_at')
+
+    def __init__(self, text: str, summary: Optional[str], reply_markup, parse_mode: Optional[str],
+                 future: Optional[asyncio.Future]):
+        self.text = text
+        # One-line form used when the message is folded into a digest
+        self.summary = summary
+        self.reply_markup = reply_markup
+        self.parse_mode = parse_mode
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class NotificationDispatcher:
+    """Single outlet for everything the control bot sends.
+
+    Messages are paced by a global token bucket (the Bot API allows about
+    30 messages per second) and one bucket per chat (about one per second),
+    and go out in lane order: a user's interactive reply never waits
+    behind other users' completion notices. Notices are held for
+    ``coalesce_window`` seconds, and everything queued for the same chat by
+    the time it may send again is folded into one digest message, so a
+    burst of completions costs one message instead of many 429s. A 429
+    pauses all sending for the time the Bot API asks for. Up to
+    ``max_in_flight`` sends overlap, at most one per chat so a chat's
+    messages keep their order.
+
+    ``sender`` is awaited as sender(chat_id, text, reply_markup, parse_mode).
+    A notice's ``reply_markup`` may be a coroutine function instead of a
+    keyboard; it is awaited when the notice is sent, so the keyboard shows
+    the user's state at that moment rather than when the notice was queued.
+    """
+
+    def __init__(self, sender: Callable[[int, str, Any, Optional[str]], Awaitable[Any]],
+                 global_rate: float = 25.0, global_burst: int = 25, chat_rate: float = 1.0,
+                 chat_burst: int = 3, coalesce_window: float = 2.0, max_pending: int = 10000,
+                 max_message_length: int = 4096, stats_interval: float = 60.0, max_in_flight: int = 8):
+        self.sender = sender
+        self._global = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.coalesce_window = coalesce_window
+        self.max_pending = max_pending
+        self.max_message_length = max_message_length
+        self.stats_interval = stats_interval
+        self.max_in_flight = max_in_flight
+        self._in_flight: Dict[int, asyncio.Task] = {}
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # Per lane: chat_id -> queued messages, chats in the order they were served
+        self._lanes: List["OrderedDict[int, Deque[_Outgoing]]"] = [OrderedDict() for _ in Lane]
+        self._pending = 0
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = Counter()
+
+    # Queueing -------------------------------------------------------------
+
+    def notify(self, chat_id: int, text: str, lane: Lane = Lane.NOTICE, summary: Optional[str] = None,
+               parse_mode: Optional[str] = None, reply_markup=None):
+        """Queue a notification without waiting for it to be sent"""
+        if self._pending >= self.max_pending:
+            self._drop_oldest_notice()
+        self._enqueue(lane, chat_id, _Outgoing(text, summary, reply_markup, parse_mode, None))
+
+    async def reply(self, chat_id: int, text: str, reply_markup=None, parse_mode: Optional[str] = None):
+        """Send an interactive reply ahead of all notifications and wait until it is sent"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(Lane.INTERACTIVE, chat_id, _Outgoing(text, None, reply_markup, parse_mode, future))
+        return await future
+
+    def _enqueue(self, lane: Lane, chat_id: int, outgoing: _Outgoing):
+        queue = self._lanes[lane].get(chat_id)
+        if queue is None:
+            queue = self._lanes[lane][chat_id] = deque()
+        queue.append(outgoing)
+        self._pending += 1
+        self.stats[f'enqueued.{lane.name.lower()}'] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _drop_oldest_notice(self):
+        for lane in (Lane.NOTICE, Lane.ALERT):
+            chats = self._lanes[lane]
+            if chats:
+                chat_id, queue = next(iter(chats.items()))
+                queue.popleft()
+                if not queue:
+                    del chats[chat_id]
+                self._pending -= 1
+                self.stats['dropped'] += 1
+                return
+
+    # Sending --------------------------------------------------------------
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.max_pending:
+                self._prune_buckets()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune_buckets(self):
+        """Forget chats whose bucket has refilled; a new bucket starts full anyway"""
+        now = time.monotonic()
+        refill = self.chat_burst / self.chat_rate
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if now - bucket.updated > refill]:
+            del self._chat_buckets[chat_id]
+
+    def _pick(self) -> Tuple[Optional[Tuple[Lane, int]], Optional[float]]:
+        """Next (lane, chat) allowed to send now, else how long until one may"""
+        now = time.monotonic()
+        wait = None
+        for lane in Lane:
+            for chat_id, queue in self._lanes[lane].items():
+                if chat_id in self._in_flight:
+                    continue
+                ready_in = self._chat_bucket(chat_id).wait_time()
+                if lane == Lane.NOTICE:
+                    ready_in = max(ready_in, queue[0].queued_at + self.coalesce_window - now)
+                if ready_in <= 0:
+                    return (lane, chat_id), None
+                wait = ready_in if wait is None else min(wait, ready_in)
+        return None, wait
+
+    def _take(self, lane: Lane, chat_id: int) -> List[_Outgoing]:
+        """Remove the messages that go out together: one reply, or as many notices as fit"""
+        chats = self._lanes[lane]
+        queue = chats[chat_id]
+        taken = [queue.popleft()]
+        if lane != Lane.INTERACTIVE:
+            length = len(self._digest_header(2)) + len(taken[0].summary or taken[0].text)
+            while queue and queue[0].parse_mode == taken[0].parse_mode:
+                length += 2 + len(queue[0].summary or queue[0].text)
+                if length > self.max_message_length:
+                    break
+                taken.append(queue.popleft())
+        if queue:
+            # Serve other chats of this lane before coming back to this one
+            chats.move_to_end(chat_id)
+        else:
+            del chats[chat_id]
+        self._pending -= len(taken)
+        return taken
+
+    def _requeue(self, lane: Lane, chat_id: int, items: List[_Outgoing]):
+        chats = self._lanes[lane]
+        queue = chats.get(chat_id)
+        if queue is None:
+            queue = chats[chat_id] = deque()
+            chats.move_to_end(chat_id, last=False)
+        queue.extendleft(reversed(items))
+        self._pending += len(items)
+
+    @staticmethod
+    def _digest_header(count: int) -> str:
+        return f"📬 **{count} إشعارات جديدة**\n\n"
+
+    def _compose(self, items: List[_Outgoing]) -> str:
+        if len(items) == 1:
+            return items[0].text
+        return self._digest_header(len(items)) + "\n\n".join(item.summary or item.text for item in items)
+
+    async def _deliver(self, lane: Lane, chat_id: int, items: List[_Outgoing]):
+        first = items[0]
+        # A digest carries the keyboard of its latest notice
+        reply_markup = items[-1].reply_markup
+        try:
+            if callable(reply_markup):
+                reply_markup = await reply_markup()
+            result = await self.sender(chat_id, self._compose(items), reply_markup, first.parse_mode)
+        except asyncio.CancelledError:
+            if first.future is not None:
+                first.future.cancel()
+            raise
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None:
+                # Bot API flood control: stop everything for as long as it asks
+                seconds = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else retry_after
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+                self.stats['retry_after'] += 1
+                logger.warning(f"Bot API asked to retry after {seconds}s; pausing notifications")
+                self._requeue(lane, chat_id, items)
+                return
+            self.stats['failed'] += len(items)
+            if first.future is not None:
+                if not first.future.done():
+                    first.future.set_exception(e)
+            else:
+                logger.error(f"Error sending notification to user {chat_id}: {e}")
+            return
+
+        self.stats['sent'] += 1
+        self.stats['coalesced'] += len(items) - 1
+        if first.future is not None and not first.future.done():
+            first.future.set_result(result)
+
+    async def _run(self):
+        next_stats = time.monotonic() + self.stats_interval
+        while True:
+            picked, wait = (None, None) if len(self._in_flight) >= self.max_in_flight else self._pick()
+            if picked is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            lane, chat_id = picked
+            items = self._take(lane, chat_id)
+            self._chat_bucket(chat_id).reserve()
+            delay = max(self._global.reserve(), self._paused_until - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = self._in_flight[chat_id] = asyncio.create_task(self._deliver(lane, chat_id, items))
+            task.add_done_callback(lambda _, chat_id=chat_id: self._sent(chat_id))
+
+            if time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + self.stats_interval
+                if self._pending:
+                    logger.info(f"Notification queues: {self.get_stats()}")
+
+    def _sent(self, chat_id: int):
+        self._in_flight.pop(chat_id, None)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop sending; replies still waiting are cancelled and queued notices dropped"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for task in list(self._in_flight.values()):
+            task.cancel()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight.values(), return_exceptions=True)
+        self._in_flight.clear()
+        for chats in self._lanes:
+            for queue in chats.values():
+                for item in queue:
+                    if item.future is not None and not item.future.done():
+                        item.future.cancel()
+            chats.clear()
+        if self._pending:
+            logger.info(f"Dropped {self._pending} unsent notifications at shutdown")
+        self._pending = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        """Counters plus current queue depth and oldest wait per lane"""
+        stats = dict(self.stats)
+        stats['in_flight'] = len(self._in_flight)
+        now = time.monotonic()
+        for lane in Lane:
+            chats = self._lanes[lane]
+            name = lane.name.lower()
+            stats[f'depth.{name}'] = sum(len(queue) for queue in chats.values())
+            stats[f'chats.{name}'] = len(chats)
+            stats[f'oldest.{name}'] = max((now - queue[0].queued_at for queue in chats.values()), default=0.0)
+        return stats
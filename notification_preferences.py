@@ -0,0 +1,66 @@
+import logging
+from collections import Counter
+from enum import Enum
+from typing import Dict, List, Tuple
+
+from notification_dispatcher import NoticeKind
+
+logger = logging.getLogger(__name__)
+
+
+class NotifyMode(Enum):
+    """How a user wants to hear about completed tasks (user_settings.notification_mode)"""
+    EVERY = "every"    # one message per completed task
+    HOURLY = "hourly"  # one summary per hour with tasks in it
+    DAILY = "daily"    # one summary per UTC day with tasks in it
+    ERRORS = "errors"  # only collector errors
+
+
+class NotificationPreferences:
+    """Every user's notification mode, held in memory for the task pipeline.
+
+    Only users who changed the default are stored, so checking a
+    notification costs one dict lookup and no database read. The database
+    row stays the source of truth: load() fills this at startup and set()
+    mirrors each change the user makes.
+    """
+
+    def __init__(self):
+        self._modes: Dict[int, NotifyMode] = {}
+        self.stats = Counter()
+
+    def mode(self, user_id: int) -> NotifyMode:
+        return self._modes.get(user_id, NotifyMode.EVERY)
+
+    def set(self, user_id: int, mode: NotifyMode):
+        if mode == NotifyMode.EVERY:
+            self._modes.pop(user_id, None)
+        else:
+            self._modes[user_id] = mode
+
+    def wants(self, user_id: int, kind: NoticeKind) -> bool:
+        """Whether a notification of this kind should be built and sent at all"""
+        if kind is not NoticeKind.COMPLETION or user_id not in self._modes:
+            return True
+        self.stats[f'suppressed.{self._modes[user_id].value}'] += 1
+        return False
+
+    def users(self, mode: NotifyMode) -> List[int]:
+        """Users in a summary mode; EVERY is not tracked and returns nothing"""
+        return [user_id for user_id, user_mode in self._modes.items() if user_mode == mode]
+
+    def load(self, rows: List[Tuple[int, str]]):
+        """Restore modes from (user_id, mode) rows; unknown modes fall back to EVERY"""
+        modes = {mode.value: mode for mode in NotifyMode}
+        self._modes.clear()
+        for user_id, mode in rows:
+            if modes.get(mode, NotifyMode.EVERY) != NotifyMode.EVERY:
+                self._modes[user_id] = modes[mode]
+        logger.info(f"Loaded notification modes for {len(self._modes)} users")
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        for mode in NotifyMode:
+            if mode != NotifyMode.EVERY:
+                stats[f'users.{mode.value}'] = len(self.users(mode))
+        return stats
@@ -0,0 +1,511 @@
+"""Offline replay harness for benchmarking TaskHandler end to end.
+
+Runs N simulated accounts through the real TaskHandler against a scripted
+stand-in for the target bot, using fake Telethon clients instead of a live
+Telegram connection. Reports tasks per minute, task latency percentiles and
+API calls per task.
+
+    python replay_harness.py --accounts 50 --duration 60
+
+With --idle-memory it instead reports TaskHandler's memory per collecting
+account that is waiting for work.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+from telethon import events
+from telethon.errors import ChannelPrivateError
+from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.tl.functions.messages import GetBotCallbackAnswerRequest, ImportChatInviteRequest
+from telethon.tl.types import KeyboardButtonCallback, KeyboardButtonRow, KeyboardButtonUrl, ReplyInlineMarkup
+
+from adaptive_timing import GLOBAL_SCOPE
+from database import AsyncDatabaseManager
+from notification_dispatcher import NoticeKind
+from notification_preferences import NotifyMode
+from request_scheduler import RequestScheduler
+from task_handler import TaskHandler
+
+logger = logging.getLogger(__name__)
+
+TARGET_BOT = "@StarsovGamesBot"
+
+TASK_TEXT = (
+    "🔴 Подпишитесь на канал {link}\n\n"
+    "После подписки нажмите «Подтвердить».\n\n"
+    "Вознаграждение: {reward}⭐"
+)
+COMPLETED_TEXT = "✅ Задание выполнено!\nПолучено: +{reward}⭐"
+NOT_SUBSCRIBED_TEXT = "❌ Вы не подписались на канал!"
+RATE_LIMIT_TEXT = "⏳ Вы делаете слишком много запросов. Подождите немного."
+NO_TASKS_TEXT = "😔 Задания закончились, возвращайтесь позже."
+SKIPPED_TEXT = "Задание пропущено."
+
+
+class FakeMessage:
+    """Minimal stand-in for telethon's Message"""
+
+    def __init__(self, msg_id: int, text: str, reply_markup=None):
+        self.id = msg_id
+        self.text = text
+        self.reply_markup = reply_markup
+
+
+class FakeEvent:
+    def __init__(self, message: FakeMessage):
+        self.message = message
+
+
+class FakeTask:
+    def __init__(self, task_id: int, channel: str, reward: float, dead: bool):
+        self.task_id = task_id
+        self.channel = channel
+        self.reward = reward
+        self.dead = dead
+        self.message: Optional[FakeMessage] = None
+        self.sent_at = 0.0
+
+
+class FakeAccount:
+    """Target bot's view of one simulated account"""
+
+    def __init__(self, name: str, tasks_left: int):
+        self.name = name
+        self.tasks_left = tasks_left
+        self.client: Optional["FakeTelegramClient"] = None
+        self.current: Optional[FakeTask] = None
+        self.joined: Dict[str, float] = {}
+        self.messages: List[FakeMessage] = []
+        self.last_request = 0.0
+
+
+class FakeTargetBot:
+    """Scripted replacement for the target bot's task flow"""
+
+    def __init__(self, response_delay: float = 0.2, join_register_delay: float = 0.0,
+                 rate_limit_interval: float = 0.0, dead_channel_prob: float = 0.05,
+                 edit_completion_prob: float = 0.3, tasks_per_account: int = 1000,
+                 channel_pool: int = 0, seed: int = 1):
+        self.response_delay = response_delay
+        self.join_register_delay = join_register_delay
+        self.rate_limit_interval = rate_limit_interval
+        self.dead_channel_prob = dead_channel_prob
+        self.edit_completion_prob = edit_completion_prob
+        self.tasks_per_account = tasks_per_account
+        self.random = random.Random(seed)
+        # With a pool, tasks reuse channels across accounts and a dead channel stays dead
+        self.channel_pool = channel_pool
+        self.dead_channels = {index for index in range(channel_pool)
+                              if self.random.random() < dead_channel_prob}
+        self.accounts: Dict[str, FakeAccount] = {}
+        self.message_ids = itertools.count(1)
+        self.task_ids = itertools.count(1)
+        self.latencies: List[float] = []
+        self.first_completion: Dict[str, float] = {}
+        self.completed = 0
+        self.skipped = 0
+
+    def account(self, name: str) -> FakeAccount:
+        if name not in self.accounts:
+            self.accounts[name] = FakeAccount(name, self.tasks_per_account)
+        return self.accounts[name]
+
+    # Delivery -----------------------------------------------------------
+
+    def _reply(self, account: FakeAccount, text: str, reply_markup=None) -> FakeMessage:
+        message = FakeMessage(next(self.message_ids), text, reply_markup)
+        account.messages.append(message)
+        del account.messages[:-20]
+        self._later(account, message, edited=False)
+        return message
+
+    def _later(self, account: FakeAccount, message: FakeMessage, edited: bool):
+        async def deliver():
+            await asyncio.sleep(self.response_delay)
+            if account.client:
+                account.client.deliver(message, edited)
+        asyncio.create_task(deliver())
+
+    def _task_markup(self, task: FakeTask) -> ReplyInlineMarkup:
+        return ReplyInlineMarkup(rows=[
+            KeyboardButtonRow(buttons=[KeyboardButtonUrl(text="📢 Подписаться", url=task.channel)]),
+            KeyboardButtonRow(buttons=[KeyboardButtonCallback(text="✅ Подтвердить",
+                                                              data=f"confirm:{task.task_id}".encode())]),
+            KeyboardButtonRow(buttons=[KeyboardButtonCallback(text="⏩ Пропустить",
+                                                              data=f"skip:{task.task_id}".encode())]),
+        ])
+
+    # Incoming traffic from accounts --------------------------------------
+
+    def on_text(self, account: FakeAccount, text: str):
+        now = time.monotonic()
+        if self.rate_limit_interval and now - account.last_request < self.rate_limit_interval:
+            account.last_request = now
+            self._reply(account, RATE_LIMIT_TEXT)
+            return
+        account.last_request = now
+
+        if text == "/start":
+            self._send_task(account)
+        elif text in ("Подтвердить", "✅"):
+            self._confirm(account)
+        elif text in ("⏩", "Skip", "Пропустить"):
+            self._skip(account)
+
+    def on_callback(self, account: FakeAccount, data: bytes):
+        action, _, task_id = data.decode().partition(':')
+        task = account.current
+        if not task or str(task.task_id) != task_id:
+            return
+        if action == "confirm":
+            self._confirm(account)
+        elif action == "skip":
+            self._skip(account)
+
+    def on_join(self, account: FakeAccount, channel: str):
+        task = account.current
+        if task and task.dead and channel in task.channel:
+            raise ChannelPrivateError(request=None)
+        account.joined[channel] = time.monotonic()
+
+    def _send_task(self, account: FakeAccount):
+        if account.current is None:
+            if account.tasks_left <= 0:
+                self._reply(account, NO_TASKS_TEXT)
+                return
+            account.tasks_left -= 1
+            task_id = next(self.task_ids)
+            if self.channel_pool:
+                channel = self.random.randrange(self.channel_pool)
+                dead = channel in self.dead_channels
+            else:
+                channel = task_id
+                dead = self.random.random() < self.dead_channel_prob
+            account.current = FakeTask(task_id, f"https://t.me/replay_chan_{channel}", 0.25, dead)
+
+        task = account.current
+        task.message = self._reply(
+            account,
+            TASK_TEXT.format(link=task.channel, reward=task.reward),
+            self._task_markup(task)
+        )
+        if not task.sent_at:
+            task.sent_at = time.monotonic()
+
+    def _confirm(self, account: FakeAccount):
+        task = account.current
+        if not task:
+            return
+        channel = task.channel.rsplit('/', 1)[-1]
+        joined_at = account.joined.get(channel)
+        if joined_at is None or time.monotonic() - joined_at < self.join_register_delay:
+            self._reply(account, NOT_SUBSCRIBED_TEXT)
+            return
+
+        text = COMPLETED_TEXT.format(reward=task.reward)
+        if task.message and self.random.random() < self.edit_completion_prob:
+            task.message.text = text
+            task.message.reply_markup = None
+            self._later(account, task.message, edited=True)
+        else:
+            self._reply(account, text)
+
+        self.latencies.append(time.monotonic() - task.sent_at)
+        self.first_completion.setdefault(account.name, time.monotonic())
+        self.completed += 1
+        account.current = None
+
+    def _skip(self, account: FakeAccount):
+        if account.current:
+            account.current = None
+            self.skipped += 1
+        self._reply(account, SKIPPED_TEXT)
+
+
+class FakeTelegramClient:
+    """The subset of TelegramClient that TaskHandler uses, backed by FakeTargetBot"""
+
+    def __init__(self, bot: FakeTargetBot, account: FakeAccount, api_calls: Counter):
+        self.bot = bot
+        self.account = account
+        self.api_calls = api_calls
+        self.handlers = []
+        self.connected = True
+        account.client = self
+
+    def on(self, builder):
+        def decorator(handler):
+            self.handlers.append((builder, handler))
+            return handler
+        return decorator
+
+    def deliver(self, message: FakeMessage, edited: bool):
+        if not self.connected:
+            return
+        for builder, handler in self.handlers:
+            # MessageEdited subclasses NewMessage, so compare exact types
+            wanted = events.MessageEdited if edited else events.NewMessage
+            if type(builder) is wanted:
+                asyncio.create_task(handler(FakeEvent(message)))
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+        if self.account.client is self:
+            self.account.client = None
+
+    async def send_message(self, entity, text: str):
+        self.api_calls['send_message'] += 1
+        if entity == TARGET_BOT:
+            self.bot.on_text(self.account, text)
+
+    async def get_messages(self, entity, limit: int = 1):
+        self.api_calls['get_messages'] += 1
+        if entity != TARGET_BOT:
+            return []
+        return list(reversed(self.account.messages[-limit:]))
+
+    async def __call__(self, request):
+        self.api_calls[type(request).__name__] += 1
+        if isinstance(request, GetBotCallbackAnswerRequest):
+            self.bot.on_callback(self.account, request.data)
+        elif isinstance(request, JoinChannelRequest):
+            self.bot.on_join(self.account, request.channel)
+        elif isinstance(request, ImportChatInviteRequest):
+            self.bot.on_join(self.account, request.hash)
+        return None
+
+
+class FakeUserClient:
+    """Drop-in for auth_handler.TelegramUserClient; the session string names the account"""
+
+    def __init__(self, bot: FakeTargetBot, session_string: str, api_calls: Counter,
+                 connect_delay: float = 0.0):
+        self.bot = bot
+        self.session_string = session_string
+        self.api_calls = api_calls
+        self.connect_delay = connect_delay
+        self.client = None
+
+    async def connect(self) -> bool:
+        # Stands in for the MTProto handshake and session check
+        await asyncio.sleep(self.connect_delay)
+        self.client = FakeTelegramClient(self.bot, self.bot.account(self.session_string), self.api_calls)
+        return True
+
+    async def disconnect(self):
+        if self.client:
+            await self.client.disconnect()
+            self.client = None
+
+    async def is_connected(self) -> bool:
+        return bool(self.client and self.client.is_connected())
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_replay(accounts: int, duration: float, bot: FakeTargetBot, db_file: str,
+                     global_rate: float = 100.0, join_rate: Optional[float] = None,
+                     connect_delay: float = 0.0, max_concurrent_connects: int = 50,
+                     hibernate_after: Optional[float] = 60.0, summary_share: float = 0.0) -> Dict[str, float]:
+    """Run the given number of simulated accounts for duration seconds"""
+    api_calls: Counter = Counter()
+    db = AsyncDatabaseManager(db_file)
+    method_limits = None
+    if join_rate is not None:
+        # Lift Telegram's real join budget to measure what the pipeline itself can do
+        method_limits = {method: (join_rate, 2) for method in ('JoinChannelRequest', 'ImportChatInviteRequest')}
+    scheduler = RequestScheduler(global_rate, int(global_rate), method_limits)
+    handler = TaskHandler(
+        0, "replay", TARGET_BOT, db,
+        client_factory=lambda api_id, api_hash, session: FakeUserClient(bot, session, api_calls, connect_delay),
+        scheduler=scheduler,
+        hibernate_after=hibernate_after
+    )
+    # The first summary_share of the accounts only want hourly summaries
+    for user_id in range(1, int(accounts * summary_share) + 1):
+        handler.preferences.set(user_id, NotifyMode.HOURLY)
+    notifications: Counter = Counter()
+
+    async def count_notification(user_id: int, message: str, kind: NoticeKind = NoticeKind.INFO,
+                                 summary: Optional[str] = None):
+        notifications[kind.value] += 1
+
+    handler._notify_user = count_notification
+    connected: List[int] = []
+
+    async def count_connected():
+        while True:
+            await asyncio.sleep(1.0)
+            connected.append(sum(1 for runtime in handler.running_tasks.values() if runtime.client.client))
+
+    try:
+        for user_id in range(1, accounts + 1):
+            await db.add_user(user_id)
+
+        # Accounts come up the way they do after a bot restart
+        started = time.monotonic()
+        await handler.resume_collections(
+            [{'user_id': user_id, 'session_string': f"account-{user_id}"} for user_id in range(1, accounts + 1)],
+            max_concurrent_connects=max_concurrent_connects
+        )
+        resumed = time.monotonic() - started
+
+        sampler = asyncio.create_task(count_connected())
+        await asyncio.sleep(max(0.0, duration - resumed))
+        sampler.cancel()
+
+        for user_id in handler.get_running_tasks():
+            await handler.stop_collection(user_id)
+        elapsed = time.monotonic() - started
+        await handler.save_channel_outcomes()
+        await db.aclose()
+        recorded = sum(db.sync.get_user_stats(user_id)['total_tasks'] for user_id in range(1, accounts + 1))
+        channel_outcomes = db.sync.get_channel_outcome_stats()
+    finally:
+        db.close()
+
+    total_calls = sum(api_calls.values())
+    completed = bot.completed
+    report = {
+        'accounts': accounts,
+        'seconds': elapsed,
+        'resume_seconds': resumed,
+        # Time from the start of the resume until an account completed its first task
+        'first_completion_p99': _percentile([at - started for at in bot.first_completion.values()], 99),
+        'tasks_completed': completed,
+        'tasks_recorded': recorded,
+        'tasks_skipped': bot.skipped,
+        'tasks_per_minute': completed / elapsed * 60 if elapsed else 0.0,
+        'latency_p50': _percentile(bot.latencies, 50),
+        'latency_p90': _percentile(bot.latencies, 90),
+        'latency_p99': _percentile(bot.latencies, 99),
+        'api_calls': total_calls,
+        'api_calls_per_task': total_calls / completed if completed else float('inf'),
+        # Accounts holding a client, sampled every second after the resume
+        'connected_avg': sum(connected) / len(connected) if connected else 0.0,
+        'connected_max': max(connected, default=0),
+    }
+    for method, count in sorted(api_calls.items()):
+        report[f'calls.{method}'] = count
+    for key, value in sorted(scheduler.get_stats().items()):
+        report[f'scheduler.{key}'] = value
+    for key, value in sorted(handler.links.get_stats().items()):
+        report[f'links.{key}'] = value
+    for key, value in sorted(channel_outcomes.items()):
+        report[f'channel_outcomes.{key}'] = value
+    for key, value in sorted(notifications.items()):
+        report[f'notifications.{key}'] = value
+    for key, value in sorted(handler.preferences.get_stats().items()):
+        report[f'preferences.{key}'] = value
+    for key, value in sorted(handler.hibernation_stats.items()):
+        report[f'hibernation.{key}'] = value
+    for kind in sorted(handler.timing.profiles):
+        report[f'delay.{kind}'] = handler.timing.base_delay(GLOBAL_SCOPE, kind)
+    return report
+
+
+async def measure_idle_memory(accounts: int, bot: FakeTargetBot) -> Dict[str, float]:
+    """Bytes allocated per started account before it sends its first request"""
+    api_calls: Counter = Counter()
+    handler = TaskHandler(
+        0, "replay", TARGET_BOT, db=None,
+        client_factory=lambda api_id, api_hash, session: FakeUserClient(bot, session, api_calls)
+    )
+    # Keep the target bot's own per-account state out of the measurement
+    sessions = [f"account-{user_id}" for user_id in range(1, accounts + 1)]
+    for session in sessions:
+        bot.account(session)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for user_id, session in enumerate(sessions, 1):
+        await handler.start_collection(user_id, session, initial_delay=3600)
+    await asyncio.sleep(0.1)
+    per_account = (tracemalloc.get_traced_memory()[0] - before) / accounts
+    tracemalloc.stop()
+
+    for user_id in handler.get_running_tasks():
+        await handler.stop_collection(user_id)
+    return {'accounts': accounts, 'bytes_per_idle_account': per_account}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay benchmark for TaskHandler against a fake target bot")
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60.0, help="seconds to run")
+    parser.add_argument('--response-delay', type=float, default=0.2, help="bot reply latency in seconds")
+    parser.add_argument('--join-register-delay', type=float, default=0.0,
+                        help="seconds before a join counts for confirmation")
+    parser.add_argument('--rate-limit-interval', type=float, default=0.0,
+                        help="reply 'too many requests' to requests closer together than this")
+    parser.add_argument('--dead-channel-prob', type=float, default=0.05)
+    parser.add_argument('--edit-completion-prob', type=float, default=0.3)
+    parser.add_argument('--tasks-per-account', type=int, default=1000)
+    parser.add_argument('--channel-pool', type=int, default=0,
+                        help="draw task channels from this many shared channels (0: a new channel per task)")
+    parser.add_argument('--global-rate', type=float, default=100.0,
+                        help="RequestScheduler global requests per second")
+    parser.add_argument('--join-rate', type=float, default=None,
+                        help="per-account joins per second (default: the scheduler's limit)")
+    parser.add_argument('--connect-delay', type=float, default=0.5,
+                        help="seconds each simulated client takes to connect")
+    parser.add_argument('--max-concurrent-connects', type=int, default=50)
+    parser.add_argument('--hibernate-after', type=float, default=60.0,
+                        help="disconnect accounts for waits at least this long; negative disables")
+    parser.add_argument('--summary-share', type=float, default=0.0,
+                        help="fraction of accounts in hourly summary mode")
+    parser.add_argument('--idle-memory', action='store_true',
+                        help="measure memory per idle account (including its fake client) instead")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO if args.verbose else logging.WARNING
+    )
+
+    bot = FakeTargetBot(
+        response_delay=args.response_delay,
+        join_register_delay=args.join_register_delay,
+        rate_limit_interval=args.rate_limit_interval,
+        dead_channel_prob=args.dead_channel_prob,
+        edit_completion_prob=args.edit_completion_prob,
+        tasks_per_account=args.tasks_per_account,
+        channel_pool=args.channel_pool,
+        seed=args.seed
+    )
+    if args.idle_memory:
+        report = asyncio.run(measure_idle_memory(args.accounts, bot))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            report = asyncio.run(run_replay(
+                args.accounts, args.duration, bot, os.path.join(tmp, "replay.db"), args.global_rate,
+                args.join_rate, args.connect_delay, args.max_concurrent_connects,
+                args.hibernate_after if args.hibernate_after >= 0 else None, args.summary_share
+            ))
+
+    for key, value in report.items():
+        print(f"{key:24s} {value:.2f}" if isinstance(value, float) else f"{key:24s} {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+# (tokens per second, burst) for each kind of outgoing call, per account
+DEFAULT_METHOD_LIMITS: Dict[str, Tuple[float, int]] = {
+    'send_message': (1.0, 3),
+    'get_messages': (2.0, 5),
+    'GetBotCallbackAnswerRequest': (1.0, 3),
+    'JoinChannelRequest': (0.2, 2),
+    'ImportChatInviteRequest': (0.2, 2),
+}
+DEFAULT_LIMIT: Tuple[float, int] = (1.0, 3)
+
+
+class TokenBucket:
+    """Reservation-based token bucket: callers reserve a token and sleep the returned delay"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take one token and return how many seconds to wait before using it"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available, without taking it"""
+        tokens = min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+
+class RequestScheduler:
+    """Single gate for every outgoing Telethon call made on behalf of an account.
+
+    Calls are paced by a global token bucket and by one bucket per
+    (account, method). A FloodWaitError pauses only the affected account for
+    exactly the number of seconds Telegram asked for; other accounts keep
+    their full rate. Waits up to ``max_flood_retry_wait`` seconds are retried
+    transparently, longer ones are raised to the caller after pausing the
+    account.
+    """
+
+    def __init__(self, global_rate: float = 100.0, global_burst: int = 100,
+                 method_limits: Optional[Dict[str, Tuple[float, int]]] = None,
+                 max_flood_retry_wait: float = 120.0):
+        self._global = TokenBucket(global_rate, global_burst)
+        self.method_limits = dict(DEFAULT_METHOD_LIMITS)
+        if method_limits:
+            self.method_limits.update(method_limits)
+        self.max_flood_retry_wait = max_flood_retry_wait
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._paused_until: Dict[int, float] = {}
+        self.stats = Counter()
+
+    def set_global_rate(self, rate: float, burst: int):
+        """Change the shared budget in place; tokens already saved up are kept, up to the new burst"""
+        bucket = self._global
+        bucket.tokens = min(burst, bucket.tokens + (time.monotonic() - bucket.updated) * bucket.rate)
+        bucket.updated = time.monotonic()
+        bucket.rate = rate
+        bucket.capacity = burst
+
+    def _bucket(self, user_id: int, method: str) -> TokenBucket:
+        bucket = self._buckets.get((user_id, method))
+        if bucket is None:
+            rate, burst = self.method_limits.get(method, DEFAULT_LIMIT)
+            bucket = self._buckets[(user_id, method)] = TokenBucket(rate, burst)
+        return bucket
+
+    def pause(self, user_id: int, seconds: float):
+        """Hold back every call for this account for the given number of seconds"""
+        until = time.monotonic() + seconds
+        if until > self._paused_until.get(user_id, 0):
+            self._paused_until[user_id] = until
+
+    def paused_for(self, user_id: int) -> float:
+        return max(0.0, self._paused_until.get(user_id, 0) - time.monotonic())
+
+    async def _acquire(self, user_id: int, method: str):
+        pause = self.paused_for(user_id)
+        while pause > 0:
+            self.stats['paused_seconds'] += pause
+            await asyncio.sleep(pause)
+            pause = self.paused_for(user_id)
+
+        delay = max(self._bucket(user_id, method).reserve(), self._global.reserve())
+        if delay > 0:
+            self.stats['throttled_seconds'] += delay
+            await asyncio.sleep(delay)
+
+    async def call(self, user_id: int, method: str, func: Callable[..., Awaitable[Any]], *args, **kwargs):
+        """Run func(*args, **kwargs) once the account's and global budgets allow it"""
+        while True:
+            await self._acquire(user_id, method)
+            self.stats['calls'] += 1
+            try:
+                return await func(*args, **kwargs)
+            except FloodWaitError as e:
+                self.stats['flood_waits'] += 1
+                self.pause(user_id, e.seconds)
+                logger.warning(f"FloodWait of {e.seconds}s on {method} for user {user_id}, pausing account")
+                if e.seconds > self.max_flood_retry_wait:
+                    raise
+
+    async def send_message(self, user_id: int, client, entity, message: str):
+        return await self.call(user_id, 'send_message', client.send_message, entity, message)
+
+    async def get_messages(self, user_id: int, client, entity, limit: int = 1):
+        return await self.call(user_id, 'get_messages', client.get_messages, entity, limit=limit)
+
+    async def invoke(self, user_id: int, client, request):
+        """Send a raw TL request, budgeted under the request's type name"""
+        return await self.call(user_id, type(request).__name__, client, request)
+
+    def forget(self, user_id: int):
+        """Drop an account's buckets and pause state once it stops collecting"""
+        for key in [key for key in self._buckets if key[0] == user_id]:
+            del self._buckets[key]
+        self._paused_until.pop(user_id, None)
+
+    def get_stats(self) -> Dict[str, float]:
+        stats = dict(self.stats)
+        stats['paused_accounts'] = sum(1 for user_id in self._paused_until if self.paused_for(user_id) > 0)
+        return stats
@@ -0,0 +1,670 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from notification_dispatcher import NoticeKind
+from notification_preferences import NotifyMode
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a worker to answer one command
+REQUEST_TIMEOUT = 120.0
+
+
+class ConsistentHashRing:
+    """Maps user ids to worker names so that adding a worker moves ~1/N of the users"""
+
+    def __init__(self, replicas: int = 100):
+        self.replicas = replicas
+        self._keys: List[int] = []
+        self._nodes: Dict[int, str] = {}
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def add_node(self, node: str):
+        for replica in range(self.replicas):
+            key = self._hash(f"{node}#{replica}")
+            if key not in self._nodes:
+                bisect.insort(self._keys, key)
+            self._nodes[key] = node
+
+    def remove_node(self, node: str):
+        for replica in range(self.replicas):
+            key = self._hash(f"{node}#{replica}")
+            if self._nodes.get(key) == node:
+                del self._nodes[key]
+                self._keys.remove(key)
+
+    def get_node(self, user_id: int) -> Optional[str]:
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, self._hash(str(user_id))) % len(self._keys)
+        return self._nodes[self._keys[index]]
+
+    def nodes(self) -> List[str]:
+        return sorted(set(self._nodes.values()))
+
+
+# Worker process --------------------------------------------------------------
+
+def _run_worker(name: str, token: str, options: Dict[str, Any], ready):
+    """Entry point of a worker process: one event loop running one TaskHandler"""
+    logging.basicConfig(
+        format=f'%(asctime)s - {name} - %(name)s - %(levelname)s - %(message)s',
+        level=options.get('log_level', logging.INFO)
+    )
+    try:
+        asyncio.run(_serve_worker(name, token, options, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve_worker(name: str, token: str, options: Dict[str, Any], ready):
+    from account_leases import LeaseManager, SQLiteLeaseBackend
+    from database import AsyncDatabaseManager
+    from link_cache import LinkCache
+    from request_scheduler import RequestScheduler
+    from task_handler import TaskHandler
+
+    db = AsyncDatabaseManager(options['db_file'], **options.get('db_options', {}))
+    leases = None
+    if options.get('lease_ttl'):
+        # Each worker is a node of its own, so a crashed worker's accounts can be taken over
+        leases = LeaseManager(SQLiteLeaseBackend(db), ttl=options['lease_ttl'],
+                              heartbeat_interval=options['lease_heartbeat_interval'])
+        leases.start()
+    handler = TaskHandler(
+        options['api_id'], options['api_hash'], options['target_bot'], db,
+        client_factory=options.get('client_factory'),
+        scheduler=RequestScheduler(options['global_rate'], options['global_burst']),
+        leases=leases,
+        hibernate_after=options.get('hibernate_after', 60.0),
+        links=LinkCache(**options.get('link_options', {}))
+    )
+    await handler.load_adaptive_delays()
+    await handler.load_channel_outcomes()
+    await handler.load_notification_modes()
+    handler.start_adaptive_delay_saver(options.get('delay_save_interval', 60))
+
+    shutdown = asyncio.Event()
+    supervisors: List[Tuple[asyncio.StreamWriter, asyncio.Lock]] = []
+    # Commands being executed; held here so none is garbage-collected mid-flight
+    requests: Set[asyncio.Task] = set()
+
+    async def send(writer: asyncio.StreamWriter, lock: asyncio.Lock, payload: Dict[str, Any]):
+        async with lock:
+            writer.write((json.dumps(payload, ensure_ascii=False) + "\n").encode())
+            await writer.drain()
+
+    async def notify_user(user_id: int, message: str, kind: NoticeKind = NoticeKind.INFO,
+                          summary: Optional[str] = None):
+        # Notifications are sent by the front-end, which owns the bot token
+        payload = {'event': 'notify', 'user_id': user_id, 'message': message,
+                   'kind': kind.value, 'summary': summary}
+        for writer, lock in list(supervisors):
+            try:
+                await send(writer, lock, payload)
+            except Exception as e:
+                logger.error(f"Error forwarding notification for user {user_id}: {e}")
+
+    handler._notify_user = notify_user
+
+    async def report(payload: Dict[str, Any]):
+        for writer, lock in list(supervisors):
+            try:
+                await send(writer, lock, payload)
+            except Exception as e:
+                logger.error(f"Error reporting {payload['event']} to the supervisor: {e}")
+
+    if leases:
+        # Tell the supervisor at once when a lease moves accounts, so its assignments stay right
+        async def taken_over(user_ids: List[int]):
+            users = await handler._take_over_accounts(user_ids)
+            if users:
+                await report({'event': 'taken_over', 'worker': name, 'users': [
+                    {'user_id': user['user_id'], 'session_string': user['session_string']} for user in users
+                ]})
+
+        async def lost(user_id: int):
+            await handler._on_lease_lost(user_id)
+            await report({'event': 'released', 'worker': name, 'user_id': user_id})
+
+        leases.on_expired = taken_over
+        leases.on_lost = lost
+
+    async def execute(request: Dict[str, Any]) -> Dict[str, Any]:
+        command = request.get('command')
+        user_id = request.get('user_id')
+        if command == 'start':
+            ok, message = await handler.start_collection(
+                user_id, request['session_string'], request.get('initial_delay', 2.0)
+            )
+            return {'ok': ok, 'message': message}
+        if command == 'stop':
+            ok, message = await handler.stop_collection(user_id)
+            return {'ok': ok, 'message': message}
+        if command == 'status':
+            return {'ok': True, 'data': await handler.get_user_status(user_id)}
+        if command == 'resume':
+            progress = await handler.resume_collections(
+                request['users'], request.get('max_concurrent_connects', 50), request.get('start_stagger', 0.01)
+            )
+            return {'ok': True, 'data': progress}
+        if command == 'list':
+            return {'ok': True, 'data': handler.get_running_tasks()}
+        if command == 'set_rate':
+            handler.scheduler.set_global_rate(request['rate'], request['burst'])
+            return {'ok': True}
+        if command == 'notify_mode':
+            await handler.set_notification_mode(user_id, NotifyMode(request['mode']))
+            return {'ok': True}
+        if command == 'shutdown':
+            shutdown.set()
+            return {'ok': True}
+        return {'ok': False, 'message': f"Unknown command: {command}"}
+
+    async def handle(request: Dict[str, Any], writer: asyncio.StreamWriter, lock: asyncio.Lock):
+        try:
+            response = await execute(request)
+        except Exception as e:
+            logger.error(f"Error executing {request.get('command')} in worker {name}: {e}")
+            response = {'ok': False, 'message': f"❌ حدث خطأ: {str(e)}"}
+        response['id'] = request.get('id')
+        try:
+            await send(writer, lock, response)
+        except Exception as e:
+            logger.error(f"Error answering supervisor in worker {name}: {e}")
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+        try:
+            if (await reader.readline()).decode().strip() != token:
+                return
+            supervisors.append((writer, lock))
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = asyncio.create_task(handle(json.loads(line), writer, lock))
+                requests.add(request)
+                request.add_done_callback(requests.discard)
+        except asyncio.CancelledError:
+            # The worker is shutting down
+            pass
+        except Exception as e:
+            logger.error(f"Supervisor connection error in worker {name}: {e}")
+        finally:
+            if (writer, lock) in supervisors:
+                supervisors.remove((writer, lock))
+            writer.close()
+
+    server = await asyncio.start_server(serve, '127.0.0.1', 0)
+    ready.send(server.sockets[0].getsockname()[1])
+    ready.close()
+    logger.info(f"Worker {name} ready")
+
+    try:
+        await shutdown.wait()
+    finally:
+        server.close()
+        for user_id in handler.get_running_tasks():
+            await handler.stop_collection(user_id)
+        await handler.stop_adaptive_delay_saver()
+        if leases:
+            await leases.stop()
+        await db.aclose()
+        db.close()
+        logger.info(f"Worker {name} stopped")
+
+
+# Front-end side --------------------------------------------------------------
+
+class WorkerConnection:
+    """One worker process and the supervisor's command channel to it"""
+
+    def __init__(self, name: str, process, on_event: Callable[[Dict[str, Any]], Awaitable[None]],
+                 on_lost: Callable[[str], None]):
+        self.name = name
+        self.process = process
+        self.on_event = on_event
+        self.on_lost = on_lost
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._write_lock = asyncio.Lock()
+        self._reader_task: Optional[asyncio.Task] = None
+        self._event_tasks: Set[asyncio.Task] = set()
+
+    async def open(self, port: int, token: str):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.writer.write((token + "\n").encode())
+        await self.writer.drain()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                payload = json.loads(line)
+                if 'event' in payload:
+                    event = asyncio.create_task(self._dispatch_event(payload))
+                    self._event_tasks.add(event)
+                    event.add_done_callback(self._event_tasks.discard)
+                    continue
+                future = self._pending.pop(payload.get('id'), None)
+                if future and not future.done():
+                    future.set_result(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading from worker {self.name}: {e}")
+
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Worker {self.name} disconnected"))
+        self._pending.clear()
+        self.on_lost(self.name)
+
+    async def _dispatch_event(self, payload: Dict[str, Any]):
+        try:
+            await self.on_event(payload)
+        except Exception as e:
+            logger.error(f"Error handling {payload.get('event')} event from worker {self.name}: {e}")
+
+    async def request(self, command: str, timeout: float = REQUEST_TIMEOUT, **params) -> Dict[str, Any]:
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+
+        payload = dict(params, id=request_id, command=command)
+        try:
+            async with self._write_lock:
+                self.writer.write((json.dumps(payload, ensure_ascii=False) + "\n").encode())
+                await self.writer.drain()
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+        if self.writer:
+            self.writer.close()
+
+
+class ShardSupervisor:
+    """Runs TaskHandlers in worker processes and routes accounts to them.
+
+    Accounts are assigned to workers by consistent hashing on user_id, so
+    every command for an account reaches the same worker. The supervisor
+    exposes the subset of the TaskHandler interface that bot.py uses, so the
+    bot front-end works unchanged in single-process and sharded mode.
+    Workers talk to the supervisor over line-delimited JSON on a loopback
+    socket, authenticated with a per-run token. Notifications are forwarded
+    back and sent through ``_notify_user``, like TaskHandler's hook.
+
+    add_worker() starts another process and moves the accounts whose owner
+    changed on the ring, about 1/N of them, to it.
+
+    A worker that dies is started again under the same name, so it takes
+    back the same part of the ring, and its accounts are resumed on it.
+    After ``max_respawns`` restarts of one worker, or when the restart
+    fails, it stays off the ring and its accounts are resumed on the
+    workers that now own them. With leases, accounts the dead worker still
+    holds a lease for are tried again once that lease has expired. Workers
+    report the accounts they take over or lose through leases as soon as
+    it happens.
+    """
+
+    def __init__(self, api_id: int, api_hash: str, target_bot: str, db_file: str,
+                 worker_count: int = 2, global_rate: float = 100.0, global_burst: int = 100,
+                 db_options: Optional[Dict[str, Any]] = None, delay_save_interval: float = 60,
+                 client_factory=None, replicas: int = 100, log_level: int = logging.INFO,
+                 lease_ttl: Optional[float] = None, lease_heartbeat_interval: float = 10.0,
+                 hibernate_after: Optional[float] = 60.0, link_options: Optional[Dict[str, Any]] = None,
+                 max_respawns: int = 3):
+        self.worker_count = worker_count
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        # The request budget is split evenly; each worker enforces its share,
+        # which _set_rate_share() updates when the number of workers changes
+        self.worker_options = {
+            'api_id': api_id,
+            'api_hash': api_hash,
+            'target_bot': target_bot,
+            'db_file': db_file,
+            'db_options': db_options or {},
+            'global_rate': global_rate / worker_count,
+            'global_burst': max(1, global_burst // worker_count),
+            'delay_save_interval': delay_save_interval,
+            'client_factory': client_factory,
+            'log_level': log_level,
+            'lease_ttl': lease_ttl,
+            'lease_heartbeat_interval': lease_heartbeat_interval,
+            'hibernate_after': hibernate_after,
+            'link_options': link_options or {},
+        }
+        self.ring = ConsistentHashRing(replicas)
+        self.workers: Dict[str, WorkerConnection] = {}
+        # Accounts currently collecting: user_id -> owning worker, and their sessions
+        self.assignments: Dict[int, str] = {}
+        self.sessions: Dict[int, str] = {}
+        self.max_respawns = max_respawns
+        self._respawns: Dict[str, int] = {}
+        self._recoveries: set = set()
+        self._token = secrets.token_hex(16)
+        self._context = multiprocessing.get_context('spawn')
+        self._worker_ids = 0
+        self._rebalance_lock = asyncio.Lock()
+        self._closing = False
+
+    async def start(self):
+        for _ in range(self.worker_count):
+            await self._spawn_worker()
+        logger.info(f"Started {len(self.workers)} collector workers")
+
+    async def _spawn_worker(self, name: Optional[str] = None) -> str:
+        if name is None:
+            name = f"worker-{self._worker_ids}"
+            self._worker_ids += 1
+
+        parent_end, child_end = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_run_worker, args=(name, self._token, self.worker_options, child_end),
+            name=name, daemon=True
+        )
+        process.start()
+        child_end.close()
+
+        loop = asyncio.get_running_loop()
+        try:
+            port = await loop.run_in_executor(None, parent_end.recv)
+        except EOFError:
+            raise RuntimeError(f"Worker {name} exited before it was ready")
+        finally:
+            parent_end.close()
+
+        connection = WorkerConnection(name, process, self._on_worker_event, self._on_worker_lost)
+        await connection.open(port, self._token)
+        self.workers[name] = connection
+        self.ring.add_node(name)
+        return name
+
+    async def _set_rate_share(self, workers: int):
+        """Split the global request budget over this many workers and tell the running ones"""
+        rate = self.global_rate / max(1, workers)
+        burst = max(1, self.global_burst // max(1, workers))
+        self.worker_options['global_rate'] = rate
+        self.worker_options['global_burst'] = burst
+        for name, connection in list(self.workers.items()):
+            try:
+                await connection.request('set_rate', rate=rate, burst=burst)
+            except Exception as e:
+                logger.error(f"Error setting the request rate of {name}: {e}")
+
+    async def _on_worker_event(self, event: Dict[str, Any]):
+        kind = event.get('event')
+        if kind == 'notify':
+            await self._notify_user(event['user_id'], event['message'],
+                                    NoticeKind(event.get('kind', NoticeKind.INFO.value)), event.get('summary'))
+        elif kind == 'taken_over' and event['worker'] in self.workers:
+            for user in event['users']:
+                self.assignments[user['user_id']] = event['worker']
+                self.sessions[user['user_id']] = user['session_string']
+            logger.info(f"{event['worker']} took over {len(event['users'])} accounts from expired leases")
+        elif kind == 'released' and self.assignments.get(event['user_id']) == event['worker']:
+            del self.assignments[event['user_id']]
+            self.sessions.pop(event['user_id'], None)
+
+    def _on_worker_lost(self, name: str):
+        if self._closing or name not in self.workers:
+            return
+        lost = {user_id: self.sessions.pop(user_id) for user_id, owner in list(self.assignments.items())
+                if owner == name}
+        for user_id in lost:
+            del self.assignments[user_id]
+        self.ring.remove_node(name)
+        connection = self.workers.pop(name)
+        logger.error(f"Worker {name} disconnected; rescheduling its {len(lost)} accounts")
+        recovery = asyncio.create_task(self._recover_worker(name, connection, lost))
+        self._recoveries.add(recovery)
+        recovery.add_done_callback(self._recoveries.discard)
+
+    async def _recover_worker(self, name: str, connection: WorkerConnection, lost: Dict[int, str]):
+        """Restart a dead worker if it has restarts left, then resume its accounts wherever they now belong"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, connection.process.join, 5)
+        if connection.process.is_alive():
+            # Lost the connection but not the process: it must not keep driving accounts
+            connection.process.terminate()
+        await connection.close()
+
+        async with self._rebalance_lock:
+            if self._closing:
+                return
+            respawns = self._respawns.get(name, 0)
+            if respawns < self.max_respawns:
+                self._respawns[name] = respawns + 1
+                try:
+                    # Takes back the dead worker's share of the request budget
+                    await self._spawn_worker(name)
+                    logger.info(f"Restarted {name} ({respawns + 1}/{self.max_respawns})")
+                except Exception as e:
+                    logger.error(f"Could not restart {name}, moving its accounts to the other workers: {e}")
+            else:
+                logger.error(f"{name} died {respawns + 1} times, moving its accounts to the other workers")
+            if name not in self.workers:
+                await self._set_rate_share(len(self.workers))
+
+            progress = await self._resume_lost(lost)
+
+        lease_ttl = self.worker_options['lease_ttl']
+        if progress['failed'] and lease_ttl:
+            # The dead worker's leases block the accounts until they expire. By then another
+            # worker's heartbeat may have taken some over, so learn those before retrying.
+            await asyncio.sleep(lease_ttl + self.worker_options['lease_heartbeat_interval'])
+            async with self._rebalance_lock:
+                if self._closing:
+                    return
+                await self._refresh_assignments(lost)
+                progress = await self._resume_lost(lost)
+        if progress['failed']:
+            logger.warning(f"{progress['failed']} accounts of {name} could not be resumed")
+
+    async def _resume_lost(self, lost: Dict[int, str]) -> Dict[str, int]:
+        users = [{'user_id': user_id, 'session_string': session_string}
+                 for user_id, session_string in lost.items() if user_id not in self.assignments]
+        return await self.resume_collections(users)
+
+    async def _refresh_assignments(self, sessions: Dict[int, str]):
+        """Record which worker runs each of these accounts, for accounts taken over behind our back"""
+        for name, connection in list(self.workers.items()):
+            try:
+                running = (await connection.request('list'))['data']
+            except Exception as e:
+                logger.error(f"Error listing accounts of {name}: {e}")
+                continue
+            for user_id in running:
+                if user_id in sessions:
+                    self.assignments[user_id] = name
+                    self.sessions[user_id] = sessions[user_id]
+
+    async def _notify_user(self, user_id: int, message: str, kind: NoticeKind = NoticeKind.INFO,
+                           summary: Optional[str] = None):
+        logger.info(f"Notification for user {user_id}: {message}")
+
+    def owner_of(self, user_id: int) -> Optional[str]:
+        return self.ring.get_node(user_id)
+
+    async def start_collection(self, user_id: int, session_string: str,
+                               initial_delay: float = 2.0) -> Tuple[bool, str]:
+        if user_id in self.assignments:
+            return False, "🔄 التجميع نشط بالفعل لهذا الحساب."
+        owner = self.owner_of(user_id)
+        if owner is None:
+            return False, "❌ لا توجد عمليات تجميع متاحة حالياً."
+        try:
+            response = await self.workers[owner].request(
+                'start', user_id=user_id, session_string=session_string, initial_delay=initial_delay
+            )
+        except Exception as e:
+            logger.error(f"Error forwarding start for user {user_id} to {owner}: {e}")
+            return False, f"❌ حدث خطأ: {str(e)}"
+
+        if response['ok']:
+            self.assignments[user_id] = owner
+            self.sessions[user_id] = session_string
+        return response['ok'], response['message']
+
+    async def stop_collection(self, user_id: int) -> Tuple[bool, str]:
+        owner = self.assignments.get(user_id)
+        if owner is None:
+            return False, "⏹️ لا يوجد تجميع نشط لإيقافه."
+        try:
+            response = await self.workers[owner].request('stop', user_id=user_id)
+        except Exception as e:
+            logger.error(f"Error forwarding stop for user {user_id} to {owner}: {e}")
+            return False, f"❌ حدث خطأ: {str(e)}"
+
+        if response['ok']:
+            self.assignments.pop(user_id, None)
+            self.sessions.pop(user_id, None)
+        return response['ok'], response['message']
+
+    async def set_notification_mode(self, user_id: int, mode: NotifyMode):
+        """Tell every worker, since the account may move to another one later"""
+        for name, connection in list(self.workers.items()):
+            try:
+                await connection.request('notify_mode', user_id=user_id, mode=mode.value)
+            except Exception as e:
+                logger.error(f"Error forwarding notification mode for user {user_id} to {name}: {e}")
+
+    def is_user_collecting(self, user_id: int) -> bool:
+        return user_id in self.assignments
+
+    async def get_user_status(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Collection status and state timings as reported by the owning worker"""
+        owner = self.assignments.get(user_id) or self.owner_of(user_id)
+        if owner is None:
+            return None
+        try:
+            response = await self.workers[owner].request('status', user_id=user_id)
+            return dict(response['data'], worker=owner)
+        except Exception as e:
+            logger.error(f"Error getting status of user {user_id} from {owner}: {e}")
+            return None
+
+    def get_running_tasks(self) -> List[int]:
+        return list(self.assignments.keys())
+
+    async def resume_collections(self, users: List[Dict[str, Any]], max_concurrent_connects: int = 50,
+                                 start_stagger: float = 0.01,
+                                 progress_callback: Optional[Callable[[Dict[str, int]], Awaitable[None]]] = None
+                                 ) -> Dict[str, int]:
+        """Resume accounts in every worker at once, each with its share of the connect budget"""
+        shards: Dict[str, List[Dict[str, Any]]] = {}
+        for user in users:
+            owner = self.owner_of(user['user_id'])
+            if owner is not None:
+                shards.setdefault(owner, []).append(
+                    {'user_id': user['user_id'], 'session_string': user['session_string']}
+                )
+
+        progress = {'total': len(users), 'done': 0, 'started': 0, 'failed': len(users) - sum(map(len, shards.values()))}
+        per_worker_connects = max(1, max_concurrent_connects // max(1, len(shards)))
+
+        async def resume_shard(owner: str, shard: List[Dict[str, Any]]):
+            try:
+                response = await self.workers[owner].request(
+                    'resume', users=shard, max_concurrent_connects=per_worker_connects,
+                    start_stagger=start_stagger * len(shards), timeout=None
+                )
+                result = response['data']
+                running = set((await self.workers[owner].request('list'))['data'])
+            except Exception as e:
+                logger.error(f"Error resuming {len(shard)} accounts on {owner}: {e}")
+                result = {'done': len(shard), 'started': 0, 'failed': len(shard)}
+                running = set()
+
+            for user in shard:
+                if user['user_id'] in running:
+                    self.assignments[user['user_id']] = owner
+                    self.sessions[user['user_id']] = user['session_string']
+            for key in ('done', 'started', 'failed'):
+                progress[key] += result[key]
+            logger.info(f"{owner} resumed {result['started']}/{len(shard)} accounts")
+            if progress_callback:
+                try:
+                    await progress_callback(dict(progress))
+                except Exception as e:
+                    logger.error(f"Error reporting resume progress: {e}")
+
+        await asyncio.gather(*(resume_shard(owner, shard) for owner, shard in shards.items()))
+        return progress
+
+    async def add_worker(self, max_concurrent_moves: int = 20) -> str:
+        """Start one more worker and move the accounts it now owns over to it"""
+        async with self._rebalance_lock:
+            # Lower the running workers' share first so the total never exceeds the budget
+            await self._set_rate_share(len(self.workers) + 1)
+            name = await self._spawn_worker()
+            moves = [(user_id, owner) for user_id, owner in self.assignments.items()
+                     if self.owner_of(user_id) != owner]
+            semaphore = asyncio.Semaphore(max_concurrent_moves)
+            started_at = time.monotonic()
+
+            async def move(user_id: int, old_owner: str):
+                async with semaphore:
+                    session_string = self.sessions[user_id]
+                    ok, message = await self.stop_collection(user_id)
+                    if not ok:
+                        logger.warning(f"Could not stop user {user_id} on {old_owner} for rebalancing: {message}")
+                        return
+                    ok, message = await self.start_collection(user_id, session_string)
+                    if not ok:
+                        logger.warning(f"Could not restart user {user_id} on {self.owner_of(user_id)}: {message}")
+
+            await asyncio.gather(*(move(user_id, owner) for user_id, owner in moves))
+            logger.info(f"Added {name}: moved {len(moves)} accounts in {time.monotonic() - started_at:.1f}s")
+            return name
+
+    async def close(self):
+        """Stop every worker; each stops its collectors and flushes its database writes"""
+        self._closing = True
+        for recovery in list(self._recoveries):
+            recovery.cancel()
+        # A recovery may be in the middle of starting a worker; let it finish so it is shut down below
+        async with self._rebalance_lock:
+            pass
+        for name, connection in list(self.workers.items()):
+            try:
+                await connection.request('shutdown', timeout=30)
+            except Exception as e:
+                logger.error(f"Error shutting down {name}: {e}")
+        loop = asyncio.get_running_loop()
+        for name, connection in list(self.workers.items()):
+            await loop.run_in_executor(None, connection.process.join, 30)
+            if connection.process.is_alive():
+                logger.warning(f"Worker {name} did not exit, terminating it")
+                connection.process.terminate()
+        for connection in list(self.workers.values()):
+            await connection.close()
+        self.workers.clear()
+        self.assignments.clear()
+        self.sessions.clear()
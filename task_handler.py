@@ -1,86 +1,210 @@
 import asyncio
 import logging
-import re
-from typing import Optional, Tuple, List, Dict, Any
+from typing import Optional, Tuple, List, Dict, Any, Awaitable, Callable
 from telethon import TelegramClient, events
-from telethon.tl.types import Message, KeyboardButtonCallback
-from telethon.errors import FloodWaitError, ChannelPrivateError, UserAlreadyParticipantError, UserNotParticipantError, InviteHashExpiredError
+from telethon.tl.types import Message
+from telethon.errors import FloodWaitError, ChannelPrivateError, UserAlreadyParticipantError, InviteHashExpiredError
 import time
-from datetime import datetime
+from collections import Counter
+
+from account_leases import LeaseManager
+from account_runtime import AccountRuntime
+from adaptive_timing import AdaptiveTiming
+from button_index import ButtonRole, index_buttons
+from collector_state import CollectorState
+from link_cache import JoinOutcome, LinkCache, LinkKind
+from message_classifier import MessageClassification, MessageKind, classify_message, is_not_subscribed
+from notification_dispatcher import NoticeKind
+from notification_preferences import NotificationPreferences, NotifyMode
+from request_scheduler import RequestScheduler
 
 logger = logging.getLogger(__name__)
 
+# Delay kinds that idle the account long enough to be reported as WAITING
+_WAITING_DELAYS = ('rate_limit', 'no_tasks')
+
+# New bot messages that mean the bot is done with the task being confirmed
+_ENDS_CONFIRMATION = (MessageKind.TASK, MessageKind.NO_TASKS, MessageKind.RATE_LIMITED)
+
 class TaskHandler:
-    def __init__(self, api_id: int, api_hash: str, target_bot: str):
+    def __init__(self, api_id: int, api_hash: str, target_bot: str, db, inbox_size: int = 100,
+                 client_factory=None, scheduler: Optional[RequestScheduler] = None,
+                 timing: Optional[AdaptiveTiming] = None, leases: Optional[LeaseManager] = None,
+                 hibernate_after: Optional[float] = 60.0, wake_lead: float = 5.0,
+                 links: Optional[LinkCache] = None, preferences: Optional[NotificationPreferences] = None,
+                 confirmation_timeout: float = 45.0):
         self.api_id = api_id
         self.api_hash = api_hash
         self.target_bot = target_bot
-        self.running_tasks = {}
+        self.db = db
+        self.inbox_size = inbox_size
+        if client_factory is None:
+            from auth_handler import TelegramUserClient
+            client_factory = TelegramUserClient
+        # Called as client_factory(api_id, api_hash, session_string)
+        self.client_factory = client_factory
+        self.scheduler = scheduler or RequestScheduler()
+        self.timing = timing or AdaptiveTiming()
+        self._timing_saver = None
+        # Parsed task links and the channel blacklist, shared by every account of this handler
+        self.links = links or LinkCache()
+        # Users' notification modes, checked before a completion message is built
+        self.preferences = preferences or NotificationPreferences()
+        # Without leases this process assumes it is the only one driving its accounts
+        self.leases = leases
+        if leases:
+            leases.on_lost = self._on_lease_lost
+            leases.on_expired = self._take_over_accounts
+        # Waits of at least hibernate_after seconds are spent disconnected; the
+        # client reconnects wake_lead seconds before the wait ends. None disables it.
+        self.hibernate_after = hibernate_after
+        self.wake_lead = wake_lead
+        self.hibernation_stats = Counter()
+        # Longest one task may stay in CONFIRMING, clicks and pauses included
+        self.confirmation_timeout = confirmation_timeout
+        self.running_tasks: Dict[int, AccountRuntime] = {}
 
-    async def start_collection(self, user_id: int, session_string: str) -> Tuple[bool, str]:
+    async def start_collection(self, user_id: int, session_string: str,
+                               initial_delay: float = 2.0) -> Tuple[bool, str]:
+        leased = False
         try:
             if user_id in self.running_tasks:
                 return False, "🔄 التجميع نشط بالفعل لهذا الحساب."
             
-            from auth_handler import TelegramUserClient
-            user_client = TelegramUserClient(self.api_id, self.api_hash, session_string)
+            if self.leases:
+                if not await self.leases.acquire(user_id):
+                    return False, "🔒 التجميع نشط لهذا الحساب على خادم آخر."
+                leased = True
+            
+            user_client = self.client_factory(self.api_id, self.api_hash, session_string)
             
             if not await user_client.connect():
+                if leased:
+                    await self.leases.release(user_id)
                 return False, "❌ فشل في الاتصال بحسابك. يرجى التحقق من صحة البيانات."
             
-            self.running_tasks[user_id] = {
-                'client': user_client,
-                'active': True,
-                'last_task_time': 0,
-                'processing': False,
-                'tasks_completed': 0,
-                'start_time': datetime.now()
-            }
+            runtime = self.running_tasks[user_id] = AccountRuntime(user_id, user_client, self.inbox_size)
             
             await self._setup_message_handler(user_id, user_client.client)
-            asyncio.create_task(self._start_task_monitoring(user_id))
-            asyncio.create_task(self._start_periodic_monitoring(user_id))
+            # One task per account: the initial /start, the inbox and the periodic check
+            runtime.worker = asyncio.create_task(self._process_inbox(user_id, initial_delay))
+            runtime.fsm.transition(CollectorState.IDLE)
             
             logger.info(f"Started real-time collection for user {user_id}")
             return True, "🚀 تم بدء التجميع التلقائي!"
             
         except Exception as e:
             logger.error(f"Error starting collection for user {user_id}: {e}")
-            await self._notify_user(user_id, f"❌ خطأ في بدء التجميع: {str(e)}")
+            if leased and user_id not in self.running_tasks:
+                await self.leases.release(user_id)
+            await self._notify_user(user_id, f"❌ خطأ في بدء التجميع: {str(e)}", NoticeKind.ERROR)
             return False, f"❌ حدث خطأ: {str(e)}"
 
+    async def resume_collections(self, users: List[Dict[str, Any]], max_concurrent_connects: int = 50,
+                                 start_stagger: float = 0.01,
+                                 progress_callback: Optional[Callable[[Dict[str, int]], Awaitable[None]]] = None
+                                 ) -> Dict[str, int]:
+        """Restart collection for every given user (rows from get_active_users).
+
+        At most ``max_concurrent_connects`` clients connect at the same time.
+        Account number i sends its first /start about 2 + i * ``start_stagger``
+        seconds after the resume began (or right after connecting, if that
+        took longer), so the target bot and the scheduler's global budget do
+        not see the whole fleet at once. ``progress_callback`` is awaited with
+        the running counters after every account.
+        """
+        progress = {'total': len(users), 'done': 0, 'started': 0, 'failed': 0}
+        if not users:
+            return progress
+        
+        semaphore = asyncio.Semaphore(max_concurrent_connects)
+        report_every = max(1, len(users) // 10)
+        started_at = time.monotonic()
+        
+        async def resume(index: int, user: Dict[str, Any]):
+            user_id = user['user_id']
+            async with semaphore:
+                # Measured from the resume start, so waiting for a connection slot counts towards it
+                initial_delay = max(0.0, started_at + 2.0 + index * start_stagger - time.monotonic())
+                success, message = await self.start_collection(
+                    user_id, user['session_string'], initial_delay=initial_delay
+                )
+            
+            progress['done'] += 1
+            progress['started' if success else 'failed'] += 1
+            if not success:
+                logger.warning(f"Could not resume collection for user {user_id}: {message}")
+            if progress['done'] % report_every == 0 or progress['done'] == progress['total']:
+                logger.info(f"Resumed {progress['done']}/{progress['total']} collectors "
+                            f"({progress['failed']} failed) in {time.monotonic() - started_at:.1f}s")
+            if progress_callback:
+                try:
+                    await progress_callback(dict(progress))
+                except Exception as e:
+                    logger.error(f"Error reporting resume progress: {e}")
+        
+        await asyncio.gather(*(resume(index, user) for index, user in enumerate(users)))
+        return progress
+
     async def stop_collection(self, user_id: int) -> Tuple[bool, str]:
         try:
             if user_id not in self.running_tasks:
                 return False, "⏹️ لا يوجد تجميع نشط لإيقافه."
             
-            task_data = self.running_tasks[user_id]
-            task_data['active'] = False
+            runtime = self.running_tasks[user_id]
+            runtime.active = False
+            fsm = runtime.fsm
+            fsm.transition(CollectorState.STOPPED)
+            
+            if runtime.worker:
+                runtime.worker.cancel()
             
-            client = task_data.get('client')
-            if client:
-                await client.disconnect()
+            if runtime.client:
+                await runtime.client.disconnect()
             
             del self.running_tasks[user_id]
+            self.scheduler.forget(user_id)
+            if self.leases:
+                await self.leases.release(user_id)
             
-            logger.info(f"Stopped collection for user {user_id}")
+            logger.info(f"Stopped collection for user {user_id} "
+                        f"({fsm.transition_count} transitions, time in state: {fsm.get_timings()})")
             return True, "⏹️ تم إيقاف التجميع التلقائي."
             
         except Exception as e:
             logger.error(f"Error stopping collection for user {user_id}: {e}")
             return False, f"❌ حدث خطأ: {str(e)}"
 
-    async def _process_task_message(self, user_id: int, message: Message, client: TelegramClient):
+    async def _on_lease_lost(self, user_id: int):
+        """Another node took this account over; stop driving it here"""
+        if user_id in self.running_tasks:
+            await self.stop_collection(user_id)
+
+    async def _take_over_accounts(self, user_ids: List[int]) -> List[Dict[str, Any]]:
+        """Resume accounts whose previous node stopped renewing their leases; return the ones now running here"""
+        expired = set(user_ids)
+        active = [user for user in await self.db.get_active_users() if user['user_id'] in expired]
+        # Collection was turned off for these since their node died; without this their
+        # leases would be reported as expired, and the users reread, on every heartbeat
+        inactive = expired - {user['user_id'] for user in active}
+        if inactive:
+            logger.info(f"Discarding {len(inactive)} expired leases of accounts not collecting")
+            await self.leases.discard_expired(list(inactive))
+        users = [user for user in active if user['user_id'] not in self.running_tasks]
+        if users:
+            logger.info(f"Taking over {len(users)} accounts from expired leases")
+            await self.resume_collections(users)
+        return [user for user in users if user['user_id'] in self.running_tasks]
+
+    async def _process_task_message(self, user_id: int, message: Message, client: TelegramClient,
+                                    classification: MessageClassification):
         try:
-            message_text = message.text or ""
-            
-            channel_link = self._extract_channel_link(message_text)
+            channel_link = classification.channel_link
             if not channel_link:
-                await client.send_message(self.target_bot, "/start")
+                await self.scheduler.send_message(user_id, client, self.target_bot, "/start")
                 return
 
-            reward = self._extract_reward(message_text)
-            join_result = await self._join_channel_fast(client, channel_link)
+            join_result = await self._join_channel_fast(user_id, client, channel_link)
             
             if join_result == "pending":
                 await self._handle_pending_channel(user_id, client)
@@ -91,59 +215,49 @@ class TaskHandler:
                 skip_success = await self._click_skip_button_fast(user_id, client)
                 if skip_success:
                     logger.info(f"Successfully skipped failed task for user {user_id}")
-                    await asyncio.sleep(1)
-                    await client.send_message(self.target_bot, "/start")
+                    await self._request_next_task(user_id, client, 'skip_restart')
                 else:
                     # If skip fails, just restart
-                    await asyncio.sleep(2)
-                    await client.send_message(self.target_bot, "/start")
+                    await self._request_next_task(user_id, client, 'restart')
                 return
             
-            await asyncio.sleep(1.5)
-            await self._handle_confirmation_with_retry(user_id, message, client)
+            # Give the target bot time to register the join before the first click
+            await self.timing.sleep(user_id, 'join_register')
+            await self._handle_confirmation_with_retry(user_id, message, client, delay_kind='join_register')
             
         except Exception as e:
             logger.error(f"Error processing task message for user {user_id}: {e}")
-            await self._notify_user(user_id, f"❌ خطأ في معالجة المهمة: {str(e)}")
+            await self._notify_user(user_id, f"❌ خطأ في معالجة المهمة: {str(e)}", NoticeKind.ERROR)
 
     async def _handle_skip_message(self, user_id: int, message: Message, client: TelegramClient):
         try:
             success = await self._click_skip_button_fast(user_id, client)
             if success:
-                await asyncio.sleep(1)
-                await client.send_message(self.target_bot, "/start")
+                await self._request_next_task(user_id, client, 'skip_restart')
         except Exception as e:
             logger.error(f"Error handling skip for user {user_id}: {e}")
 
     async def _click_skip_button_fast(self, user_id: int, client: TelegramClient) -> bool:
         try:
-            messages = await client.get_messages(self.target_bot, limit=5)
-            
-            # First, look for actual skip buttons
-            for msg in messages:
-                if hasattr(msg, 'reply_markup') and msg.reply_markup:
-                    for row in msg.reply_markup.rows:
-                        for button in row.buttons:
-                            if isinstance(button, KeyboardButtonCallback):
-                                button_text = button.text.lower()
-                                skip_keywords = ['⏩', 'skip', 'пропустить', 'пропуск', 'далее', 'next']
-                                if any(keyword in button_text for keyword in skip_keywords):
-                                    from telethon.tl.functions.messages import GetBotCallbackAnswerRequest
-                                    await client(GetBotCallbackAnswerRequest(
-                                        peer=self.target_bot,
-                                        msg_id=msg.id,
-                                        data=button.data
-                                    ))
-                                    logger.info(f"Clicked skip button: {button.text} for user {user_id}")
-                                    return True
+            # First, look for actual skip buttons among the bot's last messages
+            runtime = self.running_tasks.get(user_id)
+            button = runtime.buttons.find(ButtonRole.SKIP, within=5) if runtime else None
+            if button:
+                from telethon.tl.functions.messages import GetBotCallbackAnswerRequest
+                await self.scheduler.invoke(user_id, client, GetBotCallbackAnswerRequest(
+                    peer=self.target_bot,
+                    msg_id=button.msg_id,
+                    data=button.data
+                ))
+                logger.info(f"Clicked skip button: {button.text} for user {user_id}")
+                return True
             
             # If no skip button found, try sending skip commands
             logger.info(f"No skip button found, sending skip commands for user {user_id}")
-            await client.send_message(self.target_bot, "⏩")
-            await asyncio.sleep(0.5)
-            await client.send_message(self.target_bot, "Skip")
-            await asyncio.sleep(0.5)
-            await client.send_message(self.target_bot, "Пропустить")
+            # Spacing between these is left to the scheduler's token buckets
+            await self.scheduler.send_message(user_id, client, self.target_bot, "⏩")
+            await self.scheduler.send_message(user_id, client, self.target_bot, "Skip")
+            await self.scheduler.send_message(user_id, client, self.target_bot, "Пропустить")
             return True
             
         except Exception as e:
@@ -151,442 +265,490 @@ class TaskHandler:
             return False
 
     async def _setup_message_handler(self, user_id: int, client: TelegramClient):
+        @client.on(events.MessageEdited(from_users=[self.target_bot]))
+        async def handle_bot_edit(event):
+            runtime = self.running_tasks.get(user_id)
+            if runtime:
+                runtime.buttons.add(event.message)
+            # Otherwise edits only matter while a confirmation is waiting for the result
+            self._resolve_confirmation_waiter(user_id, event.message, edited=True)
+        
         @client.on(events.NewMessage(from_users=[self.target_bot]))
         async def handle_bot_message(event):
             try:
-                task_data = self.running_tasks.get(user_id)
-                if not task_data or not task_data.get('active'):
+                runtime = self.running_tasks.get(user_id)
+                if not runtime or not runtime.active:
                     return
                 
-                if task_data.get('processing'):
+                # Index the buttons now, so clicking them later needs no get_messages
+                runtime.buttons.add(event.message)
+                if self._resolve_confirmation_waiter(user_id, event.message):
                     return
                 
                 logger.info(f"New message from {self.target_bot} for user {user_id}: {event.message.text[:100]}...")
-                asyncio.create_task(self._handle_new_message(user_id, event.message))
+                # Back-pressure instead of dropping: waits only if the inbox is full
+                await runtime.inbox.put(event.message)
                 
             except Exception as e:
                 logger.error(f"Error in message handler for user {user_id}: {e}")
 
-    async def _start_task_monitoring(self, user_id: int):
+    async def _process_inbox(self, user_id: int, initial_delay: float = 2.0, poll_interval: float = 300):
+        """Handle the account's bot messages one at a time, in arrival order.
+        
+        Also sends the first /start after initial_delay seconds, and another
+        one whenever no message arrived for poll_interval seconds.
+        """
         try:
-            await asyncio.sleep(2)
+            await self._start_task_monitoring(user_id, initial_delay)
+            while True:
+                runtime = self.running_tasks.get(user_id)
+                if not runtime or not runtime.active:
+                    break
+                
+                message = await runtime.inbox.get(timeout=poll_interval)
+                if message is None:
+                    await self._periodic_check(user_id)
+                    continue
+                
+                fsm = runtime.fsm
+                if not fsm.transition(CollectorState.PROCESSING):
+                    break
+                try:
+                    await self._handle_new_message(user_id, message)
+                finally:
+                    fsm.transition(CollectorState.IDLE)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error in inbox worker for user {user_id}: {e}")
+
+    async def _start_task_monitoring(self, user_id: int, initial_delay: float = 2.0):
+        try:
+            await asyncio.sleep(initial_delay)
             
-            task_data = self.running_tasks.get(user_id)
-            if not task_data or not task_data.get('active'):
+            runtime = self.running_tasks.get(user_id)
+            if not runtime or not runtime.active:
                 return
             
-            client = task_data['client'].client
             logger.info(f"Requesting initial task for user {user_id}")
-            await client.send_message(self.target_bot, "/start")
+            await self.scheduler.send_message(user_id, runtime.client.client, self.target_bot, "/start")
             
         except Exception as e:
             logger.error(f"Error starting task monitoring for user {user_id}: {e}")
 
     async def _handle_new_message(self, user_id: int, message: Message):
         try:
-            task_data = self.running_tasks.get(user_id)
-            if not task_data or not task_data.get('active'):
+            runtime = self.running_tasks.get(user_id)
+            if not runtime or not runtime.active:
                 return
             
-            task_data['processing'] = True
-            client = task_data['client'].client
+            client = runtime.client.client
             message_text = message.text or ""
             
             logger.info(f"Processing message for user {user_id}: {message_text[:100]}")
             
-            if "Вы делаете слишком много запросов" in message_text or "too many requests" in message_text.lower():
-                await asyncio.sleep(5)
-                await client.send_message(self.target_bot, "/start")
+            classification = classify_message(message_text)
+            kind = classification.kind
+            self._learn_from_reply(user_id, kind)
+            
+            if kind == MessageKind.RATE_LIMITED:
+                await self._request_next_task(user_id, client, 'rate_limit')
                 return
             
-            # Check for task completion messages with comprehensive detection
-            if ("✅ Задание выполнено!" in message_text or 
-                "Получено" in message_text or 
-                "задание выполнено" in message_text.lower() or
-                "Task completed" in message_text or
-                "Completed" in message_text):
+            if kind == MessageKind.COMPLETED:
                 
-                if not task_data.get('confirming'):
-                    reward = self._extract_reward(message_text)
+                if runtime.fsm.state != CollectorState.CONFIRMING:
+                    reward = classification.reward
                     
                     # Update task counter
-                    task_data['tasks_completed'] = task_data.get('tasks_completed', 0) + 1
+                    runtime.tasks_completed += 1
                     
-                    # Create comprehensive Arabic notification
-                    completion_message = self._create_task_completion_message(reward, task_data['tasks_completed'])
-                    await self._notify_user(user_id, completion_message)
+                    # Create comprehensive Arabic notification, unless the user only wants summaries
+                    if self.preferences.wants(user_id, NoticeKind.COMPLETION):
+                        completion_message = self._create_task_completion_message(reward, runtime.tasks_completed)
+                        await self._notify_user(user_id, completion_message, NoticeKind.COMPLETION,
+                                                self._create_task_completion_summary(reward, runtime.tasks_completed))
                     
                     # Save to database
-                    from database import DatabaseManager
-                    from config import DATABASE_FILE
-                    db = DatabaseManager(DATABASE_FILE)
-                    db.add_task(user_id, "channel_join", "", reward)
+                    await self.db.add_task(user_id, "channel_join", "", reward)
                     
-                    logger.info(f"Task completed for user {user_id}: +{reward}⭐ (Total tasks: {task_data['tasks_completed']})")
+                    logger.info(f"Task completed for user {user_id}: +{reward}⭐ (Total tasks: {runtime.tasks_completed})")
                 
-                await asyncio.sleep(2)
-                await client.send_message(self.target_bot, "/start")
+                await self._request_next_task(user_id, client, 'restart')
                 return
             
-            if self._is_task_message(message_text):
-                await self._process_task_message(user_id, message, client)
+            if kind == MessageKind.TASK:
+                logger.info(f"✅ Valid channel task detected: {classification.channel_link}")
+                await self._process_task_message(user_id, message, client, classification)
                 return
                 
-            if "задания закончились" in message_text.lower() or "no tasks available" in message_text.lower():
-                await asyncio.sleep(120)
-                await client.send_message(self.target_bot, "/start")
+            if kind == MessageKind.NO_TASKS:
+                await self._request_next_task(user_id, client, 'no_tasks')
                 return
             
-            # Check for skip messages FIRST, before confirmation messages
-            if ("💡 Получайте** Звёзды** за **простые задания!** 👇" in message_text or 
-                "💡 Получайте Звёзды за простые задания!" in message_text or 
-                "1.** **Нажмите «Подписаться»**, дождитесь прогру" in message_text or
-                "1. Нажмите «Подписаться», дождитесь прогрузки ссылки и подпишитесь" in message_text or
-                "⏩" in message_text or "Skip" in message_text.lower() or "Пропустить" in message_text.lower() or
-                "Нажмите «Подписаться», дождитесь прогрузки ссылки" in message_text):
+            # Skip messages take priority over confirmation messages
+            if kind == MessageKind.SKIP:
                 logger.info(f"Skip message detected for user {user_id}")
                 await self._handle_skip_message(user_id, message, client)
                 return
                 
-            if "Подтвердить" in message_text or "Confirm" in message_text or any(btn for btn in ["✅", "подтверд"] if btn in message_text.lower()):
+            if kind == MessageKind.CONFIRM:
                 await self._handle_confirmation_with_retry(user_id, message, client)
                 return
             
         except Exception as e:
             logger.error(f"Error handling message for user {user_id}: {e}")
+
+    async def _wait(self, user_id: int, seconds: float):
+        """Sleep in the WAITING state, returning to PROCESSING afterwards.
+
+        Long waits are spent hibernating: the client is disconnected and
+        dropped, and rebuilt from its session shortly before the wait ends.
+        """
+        runtime = self.running_tasks.get(user_id)
+        fsm = runtime.fsm if runtime else None
+        if fsm:
+            fsm.transition(CollectorState.WAITING)
+        try:
+            if runtime and self.hibernate_after is not None and seconds >= self.hibernate_after:
+                deadline = time.monotonic() + seconds
+                await self._hibernate(runtime)
+                await asyncio.sleep(max(0.0, seconds - self.wake_lead))
+                await self._wake(runtime)
+                await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+            else:
+                await asyncio.sleep(seconds)
         finally:
-            if user_id in self.running_tasks:
-                self.running_tasks[user_id]['processing'] = False
+            if fsm:
+                fsm.transition(CollectorState.PROCESSING)
+
+    async def _hibernate(self, runtime: AccountRuntime):
+        """Close the account's connection; nothing is expected from the bot until the next /start"""
+        if runtime.hibernating or not runtime.active:
+            return
+        runtime.hibernating = True
+        # Drops the TelegramClient with its entity cache, update state and receive loop
+        await runtime.client.disconnect()
+        self.hibernation_stats['hibernated'] += 1
 
-    async def _handle_confirmation_with_retry(self, user_id: int, message: Message, client: TelegramClient):
+    async def _wake(self, runtime: AccountRuntime) -> bool:
+        """Reconnect a hibernating account from its session; True once it can send again"""
+        if not runtime.hibernating:
+            return True
+        if not runtime.active:
+            return False
+        if not await runtime.client.connect():
+            # Stay hibernated; the next /start or periodic check tries again
+            self.hibernation_stats['wake_failures'] += 1
+            logger.warning(f"Could not reconnect hibernating user {runtime.user_id}")
+            return False
+        if not runtime.active:
+            # Stopped while connecting
+            await runtime.client.disconnect()
+            return False
+        await self._setup_message_handler(runtime.user_id, runtime.client.client)
+        runtime.hibernating = False
+        self.hibernation_stats['woken'] += 1
+        return True
+
+    async def _request_next_task(self, user_id: int, client: TelegramClient, delay_kind: str):
+        """Send /start after the learned delay of the given kind.
+
+        The kind is remembered until the bot's next message arrives, which
+        tells _learn_from_reply whether the delay was long enough.
+        """
+        delay = self.timing.get(user_id, delay_kind)
+        if delay_kind in _WAITING_DELAYS:
+            await self._wait(user_id, delay)
+        else:
+            await asyncio.sleep(delay)
+        
+        runtime = self.running_tasks.get(user_id)
+        if not runtime or not runtime.active:
+            return
+        if runtime.hibernating and not await self._wake(runtime):
+            return
+        runtime.pending_delay = delay_kind
+        # The account may have hibernated during the wait, so use its current client
+        await self.scheduler.send_message(user_id, runtime.client.client, self.target_bot, "/start")
+
+    def _learn_from_reply(self, user_id: int, kind: MessageKind):
+        """Grade the delay that preceded the last /start using the bot's reply"""
+        runtime = self.running_tasks.get(user_id)
+        delay_kind = runtime.pending_delay if runtime else None
+        if delay_kind is None:
+            return
+        runtime.pending_delay = None
+        
+        if kind == MessageKind.RATE_LIMITED:
+            self.timing.failure(user_id, delay_kind)
+        elif delay_kind == 'no_tasks' and kind == MessageKind.NO_TASKS:
+            # Still nothing to do: poll less often
+            self.timing.failure(user_id, delay_kind)
+        else:
+            self.timing.success(user_id, delay_kind)
+
+    async def _handle_confirmation_with_retry(self, user_id: int, message: Message, client: TelegramClient,
+                                              delay_kind: Optional[str] = None):
+        runtime = self.running_tasks.get(user_id)
+        if not runtime:
+            return
         try:
-            task_data = self.running_tasks.get(user_id, {})
-            task_data['confirming'] = True
+            runtime.fsm.transition(CollectorState.CONFIRMING)
+            loop = asyncio.get_running_loop()
             
             max_retries = 15
-            retry_count = 0
-            task_completed = False
+            response_timeout = 10
+            deadline = loop.time() + self.confirmation_timeout
+            
+            # A waiter stays registered for the whole confirmation, including the
+            # pauses between clicks, so no reply from the bot can slip past
+            waiter = loop.create_future()
+            runtime.confirmation_waiter = waiter
             
-            while retry_count < max_retries and not task_completed:
-                retry_count += 1
+            for _ in range(max_retries):
+                if loop.time() >= deadline:
+                    break
+                if not waiter.done():
+                    await self._click_confirmation_button_retry(user_id, client)
+                
+                try:
+                    reply = await asyncio.wait_for(asyncio.shield(waiter),
+                                                   timeout=max(0.0, min(response_timeout, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    continue
+                
+                if reply is None:
+                    # The bot sent something else; the inbox handles it once this returns
+                    logger.info(f"Target bot moved on while confirming for user {user_id}")
+                    return
+                
+                result = classify_message(reply.text or "")
+                # Grade the pause before this click: was the join registered by then?
+                if delay_kind:
+                    if result.kind == MessageKind.COMPLETED:
+                        self.timing.success(user_id, delay_kind)
+                    else:
+                        self.timing.failure(user_id, delay_kind)
                 
-                button_clicked = await self._click_confirmation_button_retry(user_id, client)
-                await asyncio.sleep(3)
+                if result.kind == MessageKind.COMPLETED:
+                    reward = result.reward
+                    
+                    runtime.tasks_completed += 1
+                    
+                    # Create comprehensive Arabic notification, unless the user only wants summaries
+                    if self.preferences.wants(user_id, NoticeKind.COMPLETION):
+                        completion_message = self._create_task_completion_message(reward, runtime.tasks_completed)
+                        await self._notify_user(user_id, completion_message, NoticeKind.COMPLETION,
+                                                self._create_task_completion_summary(reward, runtime.tasks_completed))
+                    
+                    await self.db.add_task(user_id, "channel_join", "", reward)
+                    
+                    logger.info(f"Task completed for user {user_id}: +{reward}⭐ (Total tasks: {runtime.tasks_completed})")
+                    
+                    await self._request_next_task(user_id, client, 'restart')
+                    return
                 
-                recent_messages = await client.get_messages(self.target_bot, limit=3)
-                for msg in recent_messages:
-                    if msg.text and ("✅ Задание выполнено!" in msg.text or 
-                                   "Получено" in msg.text or 
-                                   "задание выполнено" in msg.text.lower() or
-                                   "Task completed" in msg.text or
-                                   "Completed" in msg.text):
-                        task_completed = True
-                        reward = self._extract_reward(msg.text)
-                        
-                        task_data = self.running_tasks.get(user_id, {})
-                        task_data['tasks_completed'] = task_data.get('tasks_completed', 0) + 1
-                        
-                        # Create comprehensive Arabic notification
-                        completion_message = self._create_task_completion_message(reward, task_data['tasks_completed'])
-                        await self._notify_user(user_id, completion_message)
-                        
-                        from database import DatabaseManager
-                        from config import DATABASE_FILE
-                        db = DatabaseManager(DATABASE_FILE)
-                        db.add_task(user_id, "channel_join", "", reward)
-                        
-                        logger.info(f"Task completed for user {user_id}: +{reward}⭐ (Total tasks: {task_data['tasks_completed']})")
-                        
-                        await asyncio.sleep(2)
-                        await client.send_message(self.target_bot, "/start")
-                        return
-            
-            if not task_completed:
-                await self._notify_user(user_id, f"❌ فشل في الحصول على المكافأة")
-                await asyncio.sleep(2)
-                await client.send_message(self.target_bot, "/start")
+                # The bot answered but has not registered the join yet
+                waiter = loop.create_future()
+                runtime.confirmation_waiter = waiter
+                delay_kind = 'confirm_retry'
+                await self.timing.sleep(user_id, delay_kind)
+            
+            await self._notify_user(user_id, f"❌ فشل في الحصول على المكافأة", NoticeKind.ERROR)
+            await self._request_next_task(user_id, client, 'restart')
             
         except Exception as e:
             logger.error(f"Error in confirmation retry for user {user_id}: {e}")
-            await self._notify_user(user_id, "❌ خطأ في عملية التأكيد")
-            await client.send_message(self.target_bot, "/start")
+            await self._notify_user(user_id, "❌ خطأ في عملية التأكيد", NoticeKind.ERROR)
+            await self.scheduler.send_message(user_id, client, self.target_bot, "/start")
         finally:
-            if user_id in self.running_tasks:
-                self.running_tasks[user_id]['confirming'] = False
+            runtime.fsm.transition(CollectorState.PROCESSING)
+            runtime.confirmation_waiter = None
+
+    def _resolve_confirmation_waiter(self, user_id: int, message: Message, edited: bool = False) -> bool:
+        """Hand the result of a click to a pending confirmation; True if the message was consumed.
+        
+        Only completions and "not subscribed" answers are consumed. Any other
+        message belongs in the inbox; a new task, no-tasks or rate-limit
+        message also ends the confirmation, since the bot has moved on.
+        """
+        runtime = self.running_tasks.get(user_id)
+        waiter = runtime.confirmation_waiter if runtime else None
+        if waiter is None or waiter.done():
+            return False
+        text = message.text or ""
+        kind = classify_message(text).kind
+        if kind == MessageKind.COMPLETED or is_not_subscribed(text):
+            waiter.set_result(message)
+            return True
+        if not edited and kind in _ENDS_CONFIRMATION:
+            waiter.set_result(None)
+        return False
 
     async def _click_confirmation_button_retry(self, user_id: int, client: TelegramClient) -> bool:
         try:
-            messages = await client.get_messages(self.target_bot, limit=3)
-            
-            for msg in messages:
-                if hasattr(msg, 'reply_markup') and msg.reply_markup:
-                    for row in msg.reply_markup.rows:
-                        for button in row.buttons:
-                            if isinstance(button, KeyboardButtonCallback):
-                                button_text = button.text.lower()
-                                confirmation_words = ['подтверд', '✅', 'confirm', 'check', 'подтвердить']
-                                if any(word in button_text for word in confirmation_words):
-                                    from telethon.tl.functions.messages import GetBotCallbackAnswerRequest
-                                    await client(GetBotCallbackAnswerRequest(
-                                        peer=self.target_bot,
-                                        msg_id=msg.id,
-                                        data=button.data
-                                    ))
-                                    logger.info(f"Clicked confirmation button: {button.text}")
-                                    return True
-            
-            await client.send_message(self.target_bot, "Подтвердить")
-            await asyncio.sleep(0.5)
-            await client.send_message(self.target_bot, "✅")
+            runtime = self.running_tasks.get(user_id)
+            button = runtime.buttons.find(ButtonRole.CONFIRM, within=3) if runtime else None
+            if button:
+                from telethon.tl.functions.messages import GetBotCallbackAnswerRequest
+                await self.scheduler.invoke(user_id, client, GetBotCallbackAnswerRequest(
+                    peer=self.target_bot,
+                    msg_id=button.msg_id,
+                    data=button.data
+                ))
+                logger.info(f"Clicked confirmation button: {button.text}")
+                return True
+            
+            await self.scheduler.send_message(user_id, client, self.target_bot, "Подтвердить")
+            await self.scheduler.send_message(user_id, client, self.target_bot, "✅")
             return True
             
         except Exception as e:
             logger.error(f"Error clicking confirmation button for user {user_id}: {e}")
             return False
 
-    async def _start_periodic_monitoring(self, user_id: int):
+    async def _periodic_check(self, user_id: int):
+        """Ask for tasks again after a long silence from the target bot"""
         try:
-            while True:
-                task_data = self.running_tasks.get(user_id)
-                if not task_data or not task_data.get('active'):
-                    break
-                
-                await asyncio.sleep(300)
+            runtime = self.running_tasks.get(user_id)
+            if (runtime and runtime.active and 
+                runtime.fsm.state == CollectorState.IDLE and 
+                runtime.inbox.empty()):
                 
-                if (task_data.get('active') and 
-                    not task_data.get('processing') and 
-                    not task_data.get('confirming')):
-                    
-                    client = task_data['client'].client
-                    logger.info(f"Periodic check for user {user_id} - requesting new tasks")
-                    await client.send_message(self.target_bot, "/start")
+                logger.info(f"Periodic check for user {user_id} - requesting new tasks")
+                if runtime.hibernating and not await self._wake(runtime):
+                    return
+                await self.scheduler.send_message(user_id, runtime.client.client, self.target_bot, "/start")
                 
         except Exception as e:
             logger.error(f"Error in periodic monitoring for user {user_id}: {e}")
 
-    def _is_task_message(self, text: str) -> bool:
-        text_lower = text.lower()
-        
-        referral_indicators = [
-            "приглашенного друга",
-            "реферальная ссылка",
-            "starsovgamesbot?start=",
-            "приглашайте по этой ссылке",
-            "приглашено вами:"
-        ]
-        
-        if any(indicator in text_lower for indicator in referral_indicators):
-            logger.info("Ignoring referral message")
-            return False
-        
-        channel_task_indicators = [
-            "подпишитесь на канал",
-            "🔴 подпишитесь на канал",
-            "🔴 subscribe to",
-            "нажмите «подтвердить»"
-        ]
-        
-        has_channel_task = any(indicator in text_lower for indicator in channel_task_indicators)
-        has_valid_channel_link = bool(self._extract_channel_link(text))
-        has_reward = "вознаграждение:" in text_lower
-        
-        logger.info(f"Task analysis: channel_task={has_channel_task}, valid_link={has_valid_channel_link}, reward={has_reward}")
-        
-        is_task = has_channel_task and has_valid_channel_link and has_reward
-        if is_task:
-            logger.info("✅ Valid channel task detected!")
-        
-        return is_task
-
-    async def _join_channel_fast(self, client, channel_link: str):
+    async def _join_channel_fast(self, user_id: int, client, channel_link: str):
+        target = self.links.target(channel_link)
         try:
             logger.info(f"Processing link: {channel_link}")
             
+            # This account, or enough others, already found out this channel cannot be joined
+            known = self.links.outcome(target, user_id)
+            if known is not None:
+                logger.info(f"Skipping {target.name} for user {user_id}: {known.value}")
+                return "pending" if known == JoinOutcome.NEEDS_APPROVAL else False
+            
             # Handle different types of links
-            if '/addlist/' in channel_link:
+            if target.kind == LinkKind.ADDLIST:
                 # Handle addlist links (these are for multiple channels/groups)
                 logger.info(f"Detected addlist link: {channel_link}")
-                invite_hash = channel_link.split('/addlist/')[-1]
+                invite_hash = target.value
                 from telethon.tl.functions.messages import ImportChatInviteRequest
                 try:
-                    await client(ImportChatInviteRequest(invite_hash))
+                    await self.scheduler.invoke(user_id, client, ImportChatInviteRequest(invite_hash))
                     logger.info(f"Joined via addlist: {invite_hash}")
+                    self.links.joined(target)
                     return True
                 except Exception as e:
                     logger.error(f"Failed to join addlist {invite_hash}: {e}")
                     return False
             
-            if self._is_bot_link(channel_link):
-                channel_username = channel_link.split('/')[-1].split('?')[0]
+            if target.kind == LinkKind.BOT:
+                channel_username = target.value
                 logger.info(f"Detected bot link: {channel_username}")
-                return await self._start_bot(client, channel_username)
+                return await self._start_bot(user_id, client, channel_username)
             
-            # Extract channel username/hash
-            if channel_link.startswith('https://t.me/+') or channel_link.startswith('t.me/+'):
+            if target.kind == LinkKind.INVITE:
                 # Private channel with invite hash
-                invite_hash = channel_link.split('+')[-1]
+                invite_hash = target.value
                 from telethon.tl.functions.messages import ImportChatInviteRequest
-                await client(ImportChatInviteRequest(invite_hash))
+                await self.scheduler.invoke(user_id, client, ImportChatInviteRequest(invite_hash))
                 logger.info(f"Joined private channel/group: {invite_hash}")
             else:
                 # Public channel
-                channel_username = channel_link.split('/')[-1]
-                if channel_username.startswith('@'):
-                    channel_username = channel_username[1:]
-                
+                channel_username = target.value
                 from telethon.tl.functions.channels import JoinChannelRequest
-                await client(JoinChannelRequest(channel_username))
+                await self.scheduler.invoke(user_id, client, JoinChannelRequest(channel_username))
                 logger.info(f"Joined public channel/group: {channel_username}")
             
+            self.links.joined(target)
             return True
             
         except UserAlreadyParticipantError:
             logger.info(f"Already member of channel")
+            self.links.joined(target)
             return True
             
         except ChannelPrivateError:
             logger.warning(f"Channel is private or doesn't exist")
+            # Could be this account alone, e.g. banned from the channel
+            self.links.remember(target, JoinOutcome.PRIVATE, user_id)
             return False
             
         except InviteHashExpiredError:
             logger.warning(f"Invite link expired")
+            self.links.remember(target, JoinOutcome.EXPIRED)
             return False
             
         except Exception as e:
             error_msg = str(e).lower()
             if "successfully requested to join" in error_msg or "join request sent" in error_msg:
                 logger.info(f"Join request sent (needs approval)")
+                self.links.remember(target, JoinOutcome.NEEDS_APPROVAL)
                 return "pending"
-            elif "flood" in error_msg:
+            elif isinstance(e, FloodWaitError) or "flood" in error_msg:
+                # The scheduler has already paused this account for e.seconds
                 logger.warning(f"Flood wait error")
                 return False
             elif "nobody is using this username" in error_msg:
                 logger.warning(f"Invalid username or channel doesn't exist")
+                self.links.remember(target, JoinOutcome.NONEXISTENT)
                 return False
             elif "unacceptable" in error_msg:
                 logger.warning(f"Username format is unacceptable")
+                self.links.remember(target, JoinOutcome.NONEXISTENT)
                 return False
             else:
                 logger.error(f"Failed to join channel: {e}")
                 return False
 
-    def _extract_channel_link(self, text: str) -> Optional[str]:
-        try:
-            patterns = [
-                r'https://t\.me/\+[A-Za-z0-9\-_]+',  # Private channels
-                r't\.me/\+[A-Za-z0-9\-_]+',
-                r'https://t\.me/addlist/[A-Za-z0-9\-_]+',  # Addlist links
-                r't\.me/addlist/[A-Za-z0-9\-_]+',
-                r'https://t\.me/[A-Za-z0-9\-_]+',  # Regular channels
-                r't\.me/[A-Za-z0-9\-_]+',
-                r'@[A-Za-z0-9\-_]+'
-            ]
-            
-            for pattern in patterns:
-                matches = re.findall(pattern, text)
-                if matches:
-                    link = matches[0]
-                    logger.info(f"Found channel link: {link}")
-                    
-                    if not link.startswith('http'):
-                        if link.startswith('@'):
-                            link = 'https://t.me/' + link[1:]
-                        else:
-                            link = 'https://' + link
-                    
-                    excluded_patterns = [
-                        'StarsovGamesBot',
-                        '?start=',
-                        '/start',
-                        'bot?start'
-                    ]
-                    
-                    if not any(pattern in link for pattern in excluded_patterns):
-                        logger.info(f"Valid channel link found: {link}")
-                        return link
-                    else:
-                        logger.info(f"Excluded bot/referral link: {link}")
-            
-            return None
-        except Exception as e:
-            logger.error(f"Error extracting channel link: {e}")
-            return None
-
-    def _extract_reward(self, text: str) -> float:
-        try:
-            # Multiple patterns to catch different reward formats
-            patterns = [
-                r'\+([0-9]+\.?[0-9]*)\s*⭐',  # +0.25⭐
-                r'Получено:\s*\+([0-9]+\.?[0-9]*)⭐',  # Получено: +0.25⭐
-                r'([0-9]+\.?[0-9]*)\s*⭐',  # 0.25⭐
-                r'reward:\s*([0-9]+\.?[0-9]*)',  # reward: 0.25
-                r'([0-9]+\.?[0-9]*)\s*stars?'  # 0.25 star(s)
-            ]
-            
-            for pattern in patterns:
-                matches = re.findall(pattern, text, re.IGNORECASE)
-                if matches:
-                    reward = float(matches[0])
-                    logger.info(f"Extracted reward: {reward} from text: {text[:50]}...")
-                    return reward
-            
-            logger.warning(f"No reward found in text, using default: {text[:50]}...")
-            return 0.25
-        except Exception as e:
-            logger.error(f"Error extracting reward: {e}")
-            return 0.25
-
     def _extract_channel_name(self, channel_link: str) -> str:
         try:
-            if 't.me/' in channel_link:
-                channel_part = channel_link.split('t.me/')[-1]
-                if channel_part.startswith('+'):
-                    return f"Private Channel ({channel_part[:15]}...)"
-                else:
-                    return f"@{channel_part}"
-            return "Unknown Channel"
+            return self.links.target(channel_link).name
         except Exception as e:
             logger.error(f"Error extracting channel name: {e}")
             return "Unknown Channel"
 
     def _is_bot_link(self, link: str) -> bool:
         try:
-            if 't.me/' in link:
-                username = link.split('t.me/')[-1]
-                if '?' in username:
-                    username = username.split('?')[0]
-                return username.lower().endswith('bot')
-            return False
+            return self.links.target(link).kind == LinkKind.BOT
         except Exception as e:
             logger.error(f"Error checking if bot link: {e}")
             return False
 
-    async def _start_bot(self, client, bot_username: str) -> bool:
+    async def _start_bot(self, user_id: int, client, bot_username: str) -> bool:
         try:
             logger.info(f"Starting bot: {bot_username}")
             
-            await client.send_message(bot_username, "/start")
+            await self.scheduler.send_message(user_id, client, bot_username, "/start")
             await asyncio.sleep(2)
             
-            messages = await client.get_messages(bot_username, limit=3)
+            # Other bots' messages do not reach the target bot's handler, so fetch them
+            messages = await self.scheduler.get_messages(user_id, client, bot_username, limit=3)
             
             for msg in messages:
-                if hasattr(msg, 'reply_markup') and msg.reply_markup:
-                    for row in msg.reply_markup.rows:
-                        for button in row.buttons:
-                            if isinstance(button, KeyboardButtonCallback):
-                                try:
-                                    from telethon.tl.functions.messages import GetBotCallbackAnswerRequest
-                                    await client(GetBotCallbackAnswerRequest(
-                                        peer=bot_username,
-                                        msg_id=msg.id,
-                                        data=button.data
-                                    ))
-                                    logger.info(f"Clicked bot button: {button.text}")
-                                    return True
-                                except Exception as e:
-                                    logger.warning(f"Failed to click bot button: {e}")
-                                    continue
+                roles = index_buttons(msg)
+                button = roles.get(ButtonRole.GENERIC) if roles else None
+                if button:
+                    try:
+                        from telethon.tl.functions.messages import GetBotCallbackAnswerRequest
+                        await self.scheduler.invoke(user_id, client, GetBotCallbackAnswerRequest(
+                            peer=bot_username,
+                            msg_id=button.msg_id,
+                            data=button.data
+                        ))
+                        logger.info(f"Clicked bot button: {button.text}")
+                        return True
+                    except Exception as e:
+                        logger.warning(f"Failed to click bot button: {e}")
+                        continue
             
             logger.info(f"Bot started successfully: {bot_username}")
             return True
@@ -600,12 +762,7 @@ class TaskHandler:
             await asyncio.sleep(2)
             
             success = await self._click_skip_button_fast(user_id, client)
-            if success:
-                await asyncio.sleep(2)
-                await client.send_message(self.target_bot, "/start")
-            else:
-                await asyncio.sleep(2)
-                await client.send_message(self.target_bot, "/start")
+            await self._request_next_task(user_id, client, 'skip_restart' if success else 'restart')
                 
         except Exception as e:
             logger.error(f"Error handling pending channel for user {user_id}: {e}")
@@ -631,14 +788,98 @@ class TaskHandler:
             logger.error(f"Error creating completion message: {e}")
             return f"✅ تم إنهاء مهمة! +{reward}⭐"
 
-    async def _notify_user(self, user_id: int, message: str):
+    def _create_task_completion_summary(self, reward: float, total_tasks: int) -> str:
+        """One-line form of the completion message, used when notifications are grouped"""
+        return f"✅ +{reward}⭐ (إجمالي المهام: {total_tasks})"
+
+    async def _notify_user(self, user_id: int, message: str, kind: NoticeKind = NoticeKind.INFO,
+                           summary: Optional[str] = None):
+        """Replaced by the front-end; summary is a one-line form of message for digests"""
         try:
             logger.info(f"Notification for user {user_id}: {message}")
         except Exception as e:
             logger.error(f"Error sending notification to user {user_id}: {e}")
 
+    async def load_notification_modes(self):
+        """Read every user's notification mode into memory"""
+        try:
+            self.preferences.load(await self.db.get_notification_modes())
+        except Exception as e:
+            logger.error(f"Error loading notification modes: {e}")
+
+    async def set_notification_mode(self, user_id: int, mode: NotifyMode):
+        """Apply a mode the front-end has already stored"""
+        self.preferences.set(user_id, mode)
+
+    async def load_adaptive_delays(self):
+        """Restore delays learned in previous runs"""
+        try:
+            self.timing.load(await self.db.get_adaptive_delays())
+        except Exception as e:
+            logger.error(f"Error loading adaptive delays: {e}")
+
+    async def save_adaptive_delays(self) -> bool:
+        """Persist delays that changed since the last save"""
+        delays = self.timing.take_dirty()
+        if not delays:
+            return True
+        if await self.db.save_adaptive_delays(delays):
+            return True
+        self.timing.mark_unsaved(delays)
+        return False
+
+    async def load_channel_outcomes(self):
+        """Restore the channels found unjoinable in previous runs"""
+        try:
+            since = time.time() - self.links.max_outcome_ttl
+            self.links.load(await self.db.get_channel_outcomes(since))
+        except Exception as e:
+            logger.error(f"Error loading channel outcomes: {e}")
+
+    async def save_channel_outcomes(self) -> bool:
+        """Persist channel records that changed since the last save, dropping stale ones"""
+        outcomes = self.links.take_dirty()
+        if not outcomes:
+            return True
+        if await self.db.save_channel_outcomes(outcomes, time.time() - self.links.max_outcome_ttl):
+            return True
+        self.links.mark_unsaved(outcomes)
+        return False
+
+    def start_adaptive_delay_saver(self, interval: float):
+        """Save learned delays and channel outcomes every ``interval`` seconds in the background"""
+        async def save_periodically():
+            while True:
+                await asyncio.sleep(interval)
+                await self.save_adaptive_delays()
+                await self.save_channel_outcomes()
+        
+        if self._timing_saver is None or self._timing_saver.done():
+            self._timing_saver = asyncio.create_task(save_periodically())
+
+    async def stop_adaptive_delay_saver(self):
+        """Stop the background saver and write pending changes"""
+        if self._timing_saver is not None:
+            self._timing_saver.cancel()
+            try:
+                await self._timing_saver
+            except asyncio.CancelledError:
+                pass
+            self._timing_saver = None
+        await self.save_adaptive_delays()
+        await self.save_channel_outcomes()
+
     def get_running_tasks(self) -> List[int]:
         return list(self.running_tasks.keys())
 
+    def get_state_timings(self, user_id: int) -> Optional[Dict[str, float]]:
+        runtime = self.running_tasks.get(user_id)
+        return runtime.fsm.get_timings() if runtime else None
+
     def is_user_collecting(self, user_id: int) -> bool:
-        return user_id in self.running_tasks and self.running_tasks[user_id].get('active', False)
\ No newline at end of file
+        runtime = self.running_tasks.get(user_id)
+        return bool(runtime and runtime.active)
+
+    async def get_user_status(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Collection status and state timings; ShardSupervisor answers the same from the owning worker"""
+        return {'collecting': self.is_user_collecting(user_id), 'timings': self.get_state_timings(user_id)}
\ No newline at end of file
@@ -0,0 +1,172 @@
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+import account_leases
+from account_leases import InMemoryLeaseBackend, LeaseManager, SQLiteLeaseBackend
+from database import AsyncDatabaseManager
+from replay_harness import FakeTargetBot, FakeUserClient
+from task_handler import TaskHandler
+
+TTL = 30.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Wall clock of every LeaseManager, advanced by hand"""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(account_leases, 'time', SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def _node(backend, node_id: str):
+    manager = LeaseManager(backend, node_id=node_id, ttl=TTL, heartbeat_interval=10.0)
+    events = {'lost': [], 'expired': []}
+
+    async def on_lost(user_id):
+        events['lost'].append(user_id)
+
+    async def on_expired(user_ids):
+        events['expired'].append(sorted(user_ids))
+
+    manager.on_lost = on_lost
+    manager.on_expired = on_expired
+    return manager, events
+
+
+def test_expired_lease_is_taken_over(clock):
+    async def run():
+        backend = InMemoryLeaseBackend()
+        a, a_events = _node(backend, 'a')
+        b, b_events = _node(backend, 'b')
+        assert await a.acquire(1)
+
+        # a stops heartbeating; b sees nothing until the lease has run out
+        clock.value += TTL
+        await b.heartbeat()
+        assert b_events['expired'] == []
+        clock.value += 1
+        await b.heartbeat()
+        assert b_events['expired'] == [[1]]
+
+        assert await b.acquire(1)
+        assert backend.leases[1][0] == 'b'
+        # a comes back and learns it no longer drives the account
+        await a.heartbeat()
+        assert a_events['lost'] == [1]
+        assert a.held == set()
+
+    asyncio.run(run())
+
+
+def test_live_lease_is_never_stolen(clock):
+    async def run():
+        backend = InMemoryLeaseBackend()
+        a, a_events = _node(backend, 'a')
+        b, b_events = _node(backend, 'b')
+        assert await a.acquire(1)
+
+        for _ in range(10):
+            clock.value += TTL - 1
+            await a.heartbeat()
+            await b.heartbeat()
+            assert not await b.acquire(1)
+
+        assert b_events['expired'] == []
+        assert a_events['lost'] == []
+        assert backend.leases[1][0] == 'a'
+        assert b.held == set()
+
+    asyncio.run(run())
+
+
+def test_takeover_discards_leases_of_accounts_not_collecting(tmp_path, clock):
+    async def run():
+        db = AsyncDatabaseManager(str(tmp_path / "bot.db"))
+        for user_id in (1, 2):
+            await db.add_user(user_id)
+            await db.update_user_session(user_id, f"account-{user_id}")
+        await db.set_auto_collect(1, True)
+        await db.set_auto_collect(2, False)
+
+        dead, _ = _node(SQLiteLeaseBackend(db), 'dead')
+        assert await dead.acquire(1)
+        assert await dead.acquire(2)
+
+        leases = LeaseManager(SQLiteLeaseBackend(db), node_id='b', ttl=TTL)
+        bot = FakeTargetBot(response_delay=0.05)
+        handler = TaskHandler(0, 'hash', '@StarsovGamesBot', db, leases=leases,
+                              client_factory=lambda api_id, api_hash, session: FakeUserClient(bot, session, Counter()))
+        reads = Counter()
+        get_active_users = db.get_active_users
+
+        async def counting_get_active_users():
+            reads['active_users'] += 1
+            return await get_active_users()
+
+        db.get_active_users = counting_get_active_users
+
+        clock.value += TTL + 1
+        await leases.heartbeat()
+        assert handler.get_running_tasks() == [1]
+        assert reads['active_users'] == 1
+        assert await db.get_expired_leases(clock.value) == []
+
+        # Nothing left to take over, so later heartbeats do not read the users again
+        clock.value += 10
+        await leases.heartbeat()
+        assert reads['active_users'] == 1
+
+        await handler.stop_collection(1)
+        await db.aclose()
+        db.close()
+
+    asyncio.run(run())
+
+
+class UnreachableBackend(InMemoryLeaseBackend):
+    """Shared leases that one partitioned node can no longer renew"""
+
+    def __init__(self, partitioned: str):
+        super().__init__()
+        self.partitioned = partitioned
+
+    async def renew(self, node_id, expires_at, now):
+        if node_id == self.partitioned:
+            return None
+        return await super().renew(node_id, expires_at, now)
+
+
+def test_partitioned_node_gives_up_before_its_leases_can_be_taken(clock):
+    async def run():
+        backend = UnreachableBackend('a')
+        a, a_events = _node(backend, 'a')
+        b, _ = _node(backend, 'b')
+        started = clock.value
+        assert await a.acquire(1)
+
+        gave_up_at = None
+        # a heartbeats every 10 s, out of step with its lease, and b tries every second
+        for second in range(1, 60):
+            clock.value = started + second
+            if second % 10 == 9:
+                await a.heartbeat()
+                if a_events['lost'] and gave_up_at is None:
+                    gave_up_at = clock.value
+            if await b.acquire(1):
+                assert gave_up_at is not None and gave_up_at < clock.value
+                break
+        else:
+            pytest.fail("the lease never became free")
+
+        assert a_events['lost'] == [1]
+        assert a.held == set()
+
+    asyncio.run(run())
+
+
+def test_heartbeat_interval_must_leave_room_within_the_ttl():
+    with pytest.raises(ValueError):
+        LeaseManager(InMemoryLeaseBackend(), ttl=30.0, heartbeat_interval=15.0)
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import threading
+
+from database import AsyncDatabaseManager, TTLCache
+
+
+def _task_count(db_file: str) -> int:
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_aclose_writes_buffered_tasks(tmp_path):
+    db_file = str(tmp_path / "bot.db")
+
+    async def run():
+        db = AsyncDatabaseManager(db_file, task_flush_interval=60.0)
+        await db.add_user(1)
+        await db.add_task(1, 'channel_join', 'https://t.me/a', 0.25)
+        await db.add_task(1, 'channel_join', 'https://t.me/b', 0.25)
+        await db.aclose()
+        db.close()
+
+    asyncio.run(run())
+    assert _task_count(db_file) == 2
+
+
+def test_aclose_keeps_batch_whose_write_is_queued(tmp_path):
+    db_file = str(tmp_path / "bot.db")
+
+    async def run():
+        db = AsyncDatabaseManager(db_file, task_flush_interval=60.0, task_flush_size=1)
+        await db.add_user(1)
+        # Hold the writer thread so the flush loop's batch write waits in its queue
+        release = threading.Event()
+        blocker = db._writer.submit(release.wait)
+        await db.add_task(1, 'channel_join', 'https://t.me/a', 0.25)
+        while db._pending_tasks:
+            await asyncio.sleep(0.01)
+
+        closing = asyncio.create_task(db.aclose())
+        await asyncio.sleep(0.05)
+        release.set()
+        await closing
+        blocker.result()
+        db.close()
+
+    asyncio.run(run())
+    assert _task_count(db_file) == 1
+
+
+def test_cancelled_flush_caller_does_not_drop_batch(tmp_path):
+    db_file = str(tmp_path / "bot.db")
+
+    async def run():
+        db = AsyncDatabaseManager(db_file, task_flush_interval=60.0)
+        await db.add_user(1)
+        release = threading.Event()
+        db._writer.submit(release.wait)
+        await db.add_task(1, 'channel_join', 'https://t.me/a', 0.25)
+
+        caller = asyncio.create_task(db.flush_tasks())
+        await asyncio.sleep(0.05)
+        caller.cancel()
+        release.set()
+        await db.aclose()
+        db.close()
+
+    asyncio.run(run())
+    assert _task_count(db_file) == 1
+
+
+def test_cache_invalidation_is_per_key():
+    cache = TTLCache(maxsize=10, ttl=60.0)
+    token = cache.token()
+    cache.invalidate(2)
+    cache.put(1, 'one', token)
+    cache.put(2, 'stale', token)
+    assert cache.get(1) == 'one'
+    assert cache.get(2) is TTLCache._MISSING
+
+    cache.put(2, 'two', cache.token())
+    assert cache.get(2) == 'two'
+
+
+def test_cache_rejects_put_for_untracked_invalidated_key():
+    cache = TTLCache(maxsize=2, ttl=60.0)
+    token = cache.token()
+    # Key 1's invalidation is pushed out of the per-key table by newer ones
+    cache.invalidate(1)
+    cache.invalidate(2)
+    cache.invalidate(3)
+    cache.put(1, 'stale', token)
+    assert cache.get(1) is TTLCache._MISSING
+
+
+def test_failed_flush_keeps_records_for_the_next_one(tmp_path):
+    db_file = str(tmp_path / "bot.db")
+
+    async def run():
+        db = AsyncDatabaseManager(db_file, task_flush_interval=60.0, busy_timeout=0.05)
+        await db.add_user(1)
+        await db.add_task(1, 'channel_join', 'https://t.me/a', 0.25)
+        await db.add_task(1, 'channel_join', 'https://t.me/b', 0.5)
+
+        # Another connection holds the write lock, so this flush fails
+        blocker = sqlite3.connect(db_file, isolation_level=None)
+        blocker.execute("BEGIN EXCLUSIVE")
+        assert not await db.flush_tasks()
+        assert len(db._pending_tasks) == 2
+        await db.add_task(1, 'channel_join', 'https://t.me/c', 0.25)
+        blocker.execute("ROLLBACK")
+        blocker.close()
+
+        assert await db.flush_tasks()
+        assert db._pending_tasks == []
+        stats = await db.get_user_stats(1)
+        await db.aclose()
+        db.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert _task_count(db_file) == 3
+    assert stats['total_tasks'] == 3
+    # Kept records are written in the order they were completed
+    conn = sqlite3.connect(db_file)
+    links = [row[0] for row in conn.execute("SELECT channel_link FROM tasks ORDER BY id")]
+    conn.close()
+    assert links == ['https://t.me/a', 'https://t.me/b', 'https://t.me/c']
+
+
+def test_crash_loses_only_records_buffered_since_the_last_flush(tmp_path):
+    db_file = str(tmp_path / "bot.db")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = textwrap.dedent(f"""
+        import asyncio, os, sys
+        sys.path.insert(0, {root!r})
+        from database import AsyncDatabaseManager
+
+        async def run():
+            db = AsyncDatabaseManager({db_file!r}, task_flush_interval=60.0)
+            await db.add_user(1)
+            for link in ('a', 'b'):
+                await db.add_task(1, 'channel_join', link, 0.25)
+            assert await db.flush_tasks()
+            for link in ('c', 'd', 'e'):
+                await db.add_task(1, 'channel_join', link, 0.25)
+            # Die without aclose() or close(), like SIGKILL
+            os._exit(0)
+
+        asyncio.run(run())
+    """)
+    subprocess.run([sys.executable, '-c', script], check=True, timeout=60)
+
+    async def reopen():
+        db = AsyncDatabaseManager(db_file)
+        stats = await db.get_user_stats(1)
+        user = await db.get_user(1)
+        await db.aclose()
+        db.close()
+        return stats, user
+
+    stats, user = asyncio.run(reopen())
+    assert _task_count(db_file) == 2
+    assert stats['total_tasks'] == 2
+    assert user['total_stars'] == 0.5
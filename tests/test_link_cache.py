@@ -0,0 +1,45 @@
+from link_cache import JoinOutcome, LinkCache
+
+CHANNEL = "https://t.me/somechannel"
+
+
+def test_private_channel_is_skipped_only_by_the_reporting_account():
+    links = LinkCache(min_reporting_accounts=3)
+    target = links.target(CHANNEL)
+    links.remember(target, JoinOutcome.PRIVATE, user_id=1)
+
+    assert links.outcome(target, 1) == JoinOutcome.PRIVATE
+    assert links.outcome(target, 2) is None
+    assert links.take_dirty() == []
+
+
+def test_private_channel_is_skipped_by_everyone_after_enough_accounts():
+    links = LinkCache(min_reporting_accounts=3)
+    target = links.target(CHANNEL)
+    links.remember(target, JoinOutcome.PRIVATE, user_id=1)
+    # The same account again does not count twice
+    links.remember(target, JoinOutcome.PRIVATE, user_id=1)
+    links.remember(target, JoinOutcome.PRIVATE, user_id=2)
+    assert links.outcome(target, 4) is None
+
+    links.remember(target, JoinOutcome.PRIVATE, user_id=3)
+    assert links.outcome(target, 4) == JoinOutcome.PRIVATE
+    assert [row[:3] for row in links.take_dirty()] == [('@somechannel', 'private', 1)]
+
+
+def test_join_by_another_account_resets_reports():
+    links = LinkCache(min_reporting_accounts=2)
+    target = links.target(CHANNEL)
+    links.remember(target, JoinOutcome.PRIVATE, user_id=1)
+    links.joined(target)
+    links.remember(target, JoinOutcome.PRIVATE, user_id=2)
+
+    assert links.outcome(target, 3) is None
+
+
+def test_outcomes_that_hold_for_everyone_apply_at_once():
+    links = LinkCache(min_reporting_accounts=3)
+    target = links.target("https://t.me/+AbCdEf123")
+    links.remember(target, JoinOutcome.EXPIRED, user_id=1)
+
+    assert links.outcome(target, 2) == JoinOutcome.EXPIRED
@@ -0,0 +1,109 @@
+import sqlite3
+
+import pytest
+
+import migrations
+from database import DatabaseManager
+from migrations import SCHEMA_VERSION, run_migrations
+
+TASKS = 500
+USERS = 7
+
+
+def _seed_old_database(db_file: str) -> sqlite3.Connection:
+    """A database as the bot created it before versioned migrations: user_version 0"""
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    migrations._create_base_tables(conn)
+    for user_id in range(1, USERS + 1):
+        conn.execute("INSERT INTO users (user_id) VALUES (?)", (user_id,))
+        conn.execute("INSERT INTO user_settings (user_id, notifications) VALUES (?, ?)",
+                     (user_id, user_id % 2))
+    conn.executemany("""
+        INSERT INTO tasks (user_id, task_type, channel_link, reward, completed_at)
+        VALUES (?, 'channel_join', '', ?, ?)
+    """, [(i % USERS + 1, 0.25 * (i % 3 + 1), f"2024-03-{i % 9 + 1:02d} {i % 24:02d}:00:00")
+          for i in range(TASKS)])
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+    return conn
+
+
+def _rollup(conn: sqlite3.Connection):
+    return sorted(conn.execute("""
+        SELECT user_id, day, tasks_completed, ROUND(stars, 6) FROM daily_user_stats
+    """).fetchall())
+
+
+def _grouped_tasks(conn: sqlite3.Connection):
+    return sorted(conn.execute("""
+        SELECT user_id, DATE(completed_at), COUNT(*), ROUND(SUM(reward), 6)
+        FROM tasks GROUP BY user_id, DATE(completed_at)
+    """).fetchall())
+
+
+def test_upgrade_old_database(tmp_path):
+    db_file = str(tmp_path / "bot.db")
+    _seed_old_database(db_file).close()
+
+    db = DatabaseManager(db_file)
+    conn = db._get_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert _rollup(conn) == _grouped_tasks(conn)
+    assert conn.execute("SELECT COUNT(*) FROM migration_progress").fetchone()[0] == 0
+    # Users who had notifications off keep hearing about errors only
+    modes = dict(conn.execute("SELECT user_id, notification_mode FROM user_settings"))
+    assert modes == {user_id: 'every' if user_id % 2 else 'errors' for user_id in range(1, USERS + 1)}
+    db.close()
+
+
+def test_resume_backfill_from_progress_row(tmp_path):
+    db_file = str(tmp_path / "bot.db")
+    conn = _seed_old_database(db_file)
+    # State left behind by a run stopped after committing the chunk up to task id 200
+    for version, step, _ in migrations.MIGRATIONS[:3]:
+        step(conn)
+    conn.execute("PRAGMA user_version = 2")
+    conn.execute("CREATE TABLE migration_progress (version INTEGER PRIMARY KEY, last_id INTEGER, max_id INTEGER)")
+    conn.execute("INSERT INTO migration_progress (version, last_id, max_id) VALUES (3, 200, ?)", (TASKS,))
+    conn.execute("""
+        INSERT INTO daily_user_stats (user_id, day, tasks_completed, stars)
+        SELECT user_id, DATE(completed_at), COUNT(*), SUM(reward)
+        FROM tasks WHERE id <= 200 GROUP BY user_id, DATE(completed_at)
+    """)
+
+    assert run_migrations(conn, chunk_size=64) == SCHEMA_VERSION
+    assert _rollup(conn) == _grouped_tasks(conn)
+    assert conn.execute("SELECT COUNT(*) FROM migration_progress").fetchone()[0] == 0
+    conn.close()
+
+
+def test_interrupted_backfill_resumes_without_double_counting(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "bot.db")
+    conn = _seed_old_database(db_file)
+
+    class Interrupted(Exception):
+        pass
+
+    chunks = []
+
+    def stop_after_three_chunks(seconds):
+        chunks.append(seconds)
+        if len(chunks) == 3:
+            raise Interrupted()
+
+    # The backfill yields with time.sleep(0) after committing each chunk
+    monkeypatch.setattr(migrations.time, 'sleep', stop_after_three_chunks)
+    with pytest.raises(Interrupted):
+        run_migrations(conn, chunk_size=64)
+    monkeypatch.undo()
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 2
+    assert conn.execute("SELECT last_id, max_id FROM migration_progress").fetchone() == (192, TASKS)
+    assert sum(row[2] for row in _rollup(conn)) == 192
+
+    # The next start continues from task id 192
+    conn.close()
+    db = DatabaseManager(db_file)
+    conn = db._get_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert _rollup(conn) == _grouped_tasks(conn)
+    db.close()
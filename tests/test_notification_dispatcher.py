@@ -0,0 +1,31 @@
+import asyncio
+
+from notification_dispatcher import NotificationDispatcher
+
+
+def test_notice_keyboard_is_built_when_the_notice_is_sent():
+    sent = []
+    state = {'collecting': True}
+
+    async def sender(chat_id, text, reply_markup, parse_mode):
+        sent.append((chat_id, text, reply_markup))
+
+    async def keyboard():
+        return 'stop' if state['collecting'] else 'start'
+
+    async def run():
+        dispatcher = NotificationDispatcher(sender, coalesce_window=0.2)
+        dispatcher.start()
+        dispatcher.notify(1, "first", summary="1", reply_markup=keyboard)
+        dispatcher.notify(1, "second", summary="2", reply_markup=keyboard)
+        # The user stops collecting while the notices wait to be coalesced
+        state['collecting'] = False
+        await asyncio.sleep(0.5)
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    assert len(sent) == 1
+    chat_id, text, reply_markup = sent[0]
+    assert chat_id == 1 and "1" in text and "2" in text
+    assert reply_markup == 'start'
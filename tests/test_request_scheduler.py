@@ -0,0 +1,13 @@
+from request_scheduler import RequestScheduler
+
+
+def test_set_global_rate_keeps_tokens_within_the_new_burst():
+    scheduler = RequestScheduler(global_rate=10.0, global_burst=10)
+    scheduler.set_global_rate(2.0, 4)
+
+    assert scheduler._global.rate == 2.0
+    assert scheduler._global.capacity == 4
+    # Four saved tokens are spent at once, the fifth call waits for the new rate
+    delays = [scheduler._global.reserve() for _ in range(5)]
+    assert delays[:4] == [0.0] * 4
+    assert 0.4 < delays[4] <= 0.5
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from database import DatabaseManager
+from replay_harness import FakeTargetBot, FakeUserClient
+from shard_supervisor import ShardSupervisor
+
+USERS = 20
+
+_bot = None
+
+
+def fake_client(api_id, api_hash, session_string):
+    # Runs in the worker processes; one fake target bot per worker
+    global _bot
+    if _bot is None:
+        _bot = FakeTargetBot(response_delay=0.05)
+    return FakeUserClient(_bot, session_string, Counter())
+
+
+async def _wait_for(condition, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.1)
+
+
+async def _start_supervisor(db_file: str, **options) -> ShardSupervisor:
+    db = DatabaseManager(db_file)
+    for user_id in range(1, USERS + 1):
+        db.add_user(user_id)
+        db.update_user_session(user_id, f"account-{user_id}")
+        db.set_auto_collect(user_id, True)
+    db.close()
+    supervisor = ShardSupervisor(0, 'hash', '@StarsovGamesBot', db_file, worker_count=2,
+                                 client_factory=fake_client, log_level=logging.WARNING,
+                                 global_rate=1000, global_burst=1000, **options)
+    await supervisor.start()
+    users = [{'user_id': user_id, 'session_string': f"account-{user_id}"} for user_id in range(1, USERS + 1)]
+    progress = await supervisor.resume_collections(users)
+    assert progress['started'] == USERS
+    return supervisor
+
+
+def test_dead_worker_is_respawned_and_its_accounts_resumed(tmp_path):
+    async def run():
+        supervisor = await _start_supervisor(str(tmp_path / "bot.db"))
+        try:
+            dead = supervisor.workers['worker-0']
+            owned = [user_id for user_id, owner in supervisor.assignments.items() if owner == 'worker-0']
+            assert owned
+            dead.process.kill()
+
+            await _wait_for(lambda: 'worker-0' in supervisor.workers
+                            and supervisor.workers['worker-0'] is not dead
+                            and len(supervisor.assignments) == USERS)
+            assert all(supervisor.assignments[user_id] == 'worker-0' for user_id in owned)
+            status = await supervisor.get_user_status(owned[0])
+            assert status['collecting'] and status['worker'] == 'worker-0'
+        finally:
+            await supervisor.close()
+
+    asyncio.run(run())
+
+
+def test_accounts_move_to_other_workers_without_respawns_left(tmp_path):
+    async def run():
+        supervisor = await _start_supervisor(str(tmp_path / "bot.db"), max_respawns=0)
+        try:
+            owned = [user_id for user_id, owner in supervisor.assignments.items() if owner == 'worker-0']
+            supervisor.workers['worker-0'].process.kill()
+
+            await _wait_for(lambda: 'worker-0' not in supervisor.workers and len(supervisor.assignments) == USERS)
+            assert all(supervisor.assignments[user_id] == 'worker-1' for user_id in owned)
+            assert supervisor.ring.nodes() == ['worker-1']
+            # The survivor gets the whole request budget
+            assert supervisor.worker_options['global_rate'] == 1000
+        finally:
+            await supervisor.close()
+
+    asyncio.run(run())
+
+
+def test_adding_a_worker_splits_the_rate_over_all_workers(tmp_path):
+    async def run():
+        supervisor = await _start_supervisor(str(tmp_path / "bot.db"))
+        try:
+            assert supervisor.worker_options['global_rate'] == 500
+            await supervisor.add_worker()
+            assert len(supervisor.workers) == 3
+            assert supervisor.worker_options['global_rate'] == 1000 / 3
+            assert supervisor.worker_options['global_burst'] == 333
+            assert len(supervisor.assignments) == USERS
+        finally:
+            await supervisor.close()
+
+    asyncio.run(run())
+
+
+def test_lease_takeover_is_reported_to_the_supervisor(tmp_path):
+    async def run():
+        supervisor = await _start_supervisor(str(tmp_path / "bot.db"), lease_ttl=1.0,
+                                             lease_heartbeat_interval=0.2)
+        try:
+            async def no_recovery(name, connection, lost):
+                pass
+
+            # Only worker-1's lease takeover can bring worker-0's accounts back
+            supervisor._recover_worker = no_recovery
+            owned = [user_id for user_id, owner in supervisor.assignments.items() if owner == 'worker-0']
+            supervisor.workers['worker-0'].process.kill()
+
+            await _wait_for(lambda: all(supervisor.assignments.get(user_id) == 'worker-1' for user_id in owned))
+            assert all(supervisor.is_user_collecting(user_id) for user_id in owned)
+            assert all(supervisor.sessions[user_id] == f"account-{user_id}" for user_id in owned)
+        finally:
+            await supervisor.close()
+
+    asyncio.run(run())
@@ -0,0 +1,89 @@
+import asyncio
+from collections import Counter
+
+from account_runtime import AccountRuntime
+from database import AsyncDatabaseManager
+from replay_harness import FakeTargetBot, FakeUserClient
+from task_handler import TaskHandler
+
+
+def _handler(tmp_path, **options) -> TaskHandler:
+    db = AsyncDatabaseManager(str(tmp_path / "bot.db"))
+    return TaskHandler(0, 'hash', '@StarsovGamesBot', db, client_factory=lambda *args: None, **options)
+
+
+def test_silent_bot_keeps_confirmation_within_its_budget(tmp_path):
+    async def run():
+        handler = _handler(tmp_path, confirmation_timeout=0.5)
+        handler.running_tasks[1] = AccountRuntime(1, None, 10)
+        calls = Counter()
+
+        async def click(user_id, client):
+            calls['click'] += 1
+            return True
+
+        async def request_next_task(user_id, client, delay_kind):
+            calls[f'next.{delay_kind}'] += 1
+
+        async def notify(user_id, message, *args):
+            calls['notify'] += 1
+
+        handler._click_confirmation_button_retry = click
+        handler._request_next_task = request_next_task
+        handler._notify_user = notify
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await handler._handle_confirmation_with_retry(1, None, None)
+        elapsed = loop.time() - started
+        await handler.db.aclose()
+        handler.db.close()
+        return elapsed, calls
+
+    elapsed, calls = asyncio.run(run())
+    assert elapsed < 1.0
+    assert calls['click'] >= 1
+    assert calls['next.restart'] == 1
+    assert calls['notify'] == 1
+
+
+class TaskReplacedBot(FakeTargetBot):
+    """Answers the first confirmation by withdrawing the task and sending a new one"""
+
+    replaced = False
+
+    def _confirm(self, account):
+        if not self.replaced:
+            self.replaced = True
+            account.current = None
+            self._send_task(account)
+            return
+        super()._confirm(account)
+
+
+def test_new_task_during_confirmation_is_not_dropped(tmp_path):
+    async def run():
+        bot = TaskReplacedBot(response_delay=0.02, dead_channel_prob=0.0, edit_completion_prob=0.0)
+        handler = _handler(tmp_path)
+        handler.client_factory = lambda api_id, api_hash, session: FakeUserClient(bot, session, Counter())
+
+        async def notify(user_id, message, *args):
+            pass
+
+        handler._notify_user = notify
+        ok, _ = await handler.start_collection(1, "account-1", initial_delay=0)
+        assert ok
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 15
+        while not bot.completed and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        await handler.stop_collection(1)
+        await handler.db.aclose()
+        handler.db.close()
+        return bot
+
+    bot = asyncio.run(run())
+    assert bot.replaced
+    # The replacement task went through the inbox and was completed well before
+    # the confirmation of the withdrawn one would have timed out
+    assert bot.completed >= 1
@@ -0,0 +1,307 @@
+"""Update-to-reply latency of the control bot, polling vs webhook.
+
+Runs StarCollectorBot's real handlers and notification dispatcher against a
+local stand-in for the Bot API. Simulated users send /start at a fixed rate;
+the fake API hands each update to the bot by getUpdates (polling) or by
+POSTing it to webhook_server.py (webhook), and the latency is the time from
+the user's message reaching the fake API until the bot's sendMessage for it
+arrives. ``--api-latency`` adds a one-way network delay to every request,
+response and webhook delivery. Needs aiohttp.
+
+    python update_latency_bench.py --mode both --users 200 --rate 5 --duration 20
+
+With --burst every user sends one message at the same moment instead.
+--slow-share makes that share of the users press "start collecting" with a
+client whose connect takes --connect-delay seconds, and --concurrency 1
+processes updates one by one as the bot did before PerUserUpdateProcessor.
+
+    python update_latency_bench.py --mode polling --users 500 --burst --slow-share 0.05 --concurrency 1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+import bot as bot_module
+from webhook_server import SECRET_TOKEN_HEADER
+
+logger = logging.getLogger(__name__)
+
+TOKEN = "123456:replay"
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': "Star Collector", 'username': "star_collector_bot"}
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class FakeBotApi:
+    """Just enough of the Bot API for the control bot: getMe, getUpdates, webhooks and sendMessage"""
+
+    def __init__(self, api_latency: float = 0.0):
+        self.api_latency = api_latency
+        self.updates: Deque[Dict] = deque()
+        self.update_ids = 0
+        self.new_update = asyncio.Event()
+        self.webhook_url: Optional[str] = None
+        self.secret_token: Optional[str] = None
+        # chat_id -> times its /start reached the API, oldest first
+        self.sent_at: Dict[int, Deque[float]] = {}
+        self.latencies: List[float] = []
+        self.latencies_by_user: Dict[int, List[float]] = {}
+        self.calls = Counter()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._session = aiohttp.ClientSession()
+
+    async def stop(self):
+        await self._session.close()
+        await self._runner.cleanup()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def _params(self, request: web.Request) -> Dict:
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await self._params(request)
+        self.calls[method] += 1
+        await asyncio.sleep(self.api_latency)
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'getUpdates':
+            result = await self._get_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))
+        elif method == 'setWebhook':
+            self.webhook_url = params['url']
+            self.secret_token = params.get('secret_token')
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook_url = None
+            result = True
+        elif method == 'sendMessage':
+            result = self._send_message(int(params['chat_id']), params.get('text', ''))
+        else:
+            result = True
+
+        await asyncio.sleep(self.api_latency)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[Dict]:
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self.new_update.clear()
+            try:
+                await asyncio.wait_for(self.new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self.updates)[:100]
+
+    def _send_message(self, chat_id: int, text: str) -> Dict:
+        pending = self.sent_at.get(chat_id)
+        if pending:
+            latency = time.monotonic() - pending.popleft()
+            self.latencies.append(latency)
+            self.latencies_by_user.setdefault(chat_id, []).append(latency)
+        return {'message_id': 1, 'date': int(time.time()), 'text': text,
+                'chat': {'id': chat_id, 'type': 'private'}}
+
+    def user_sends(self, user_id: int, text: str = "/start"):
+        """A user's message reaches Telegram"""
+        self.update_ids += 1
+        update = {'update_id': self.update_ids, 'message': {
+            'message_id': self.update_ids, 'date': int(time.time()), 'text': text,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"},
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else []
+        }}
+        self.sent_at.setdefault(user_id, deque()).append(time.monotonic())
+        if self.webhook_url:
+            asyncio.create_task(self._push(update))
+        else:
+            self.updates.append(update)
+            self.new_update.set()
+
+    async def _push(self, update: Dict):
+        await asyncio.sleep(self.api_latency)
+        headers = {SECRET_TOKEN_HEADER: self.secret_token} if self.secret_token else {}
+        try:
+            async with self._session.post(self.webhook_url, json=update, headers=headers) as response:
+                if response.status != 200:
+                    self.calls['webhook_error'] += 1
+        except Exception as e:
+            self.calls['webhook_error'] += 1
+            logger.error(f"Webhook delivery failed: {e}")
+
+
+class SlowConnectClient:
+    """Stands in for TelegramUserClient: connect() takes as long as a real handshake, then fails"""
+
+    def __init__(self, connect_delay: float):
+        self.connect_delay = connect_delay
+        self.client = None
+
+    async def connect(self) -> bool:
+        await asyncio.sleep(self.connect_delay)
+        return False
+
+    async def disconnect(self):
+        pass
+
+
+async def run_bench(mode: str, users: int, rate: float, duration: float, api_latency: float,
+                    webhook_port: int, db_file: str, burst: bool = False, slow_share: float = 0.0,
+                    connect_delay: float = 2.0, concurrency: Optional[int] = None) -> Dict[str, float]:
+    api = FakeBotApi(api_latency)
+    await api.start()
+
+    bot_module.DATABASE_FILE = db_file
+    bot_module.WEBHOOK_URL = f"http://127.0.0.1:{webhook_port}"
+    bot_module.WEBHOOK_LISTEN = '127.0.0.1'
+    bot_module.WEBHOOK_PORT = webhook_port
+    if concurrency is not None:
+        bot_module.UPDATE_CONCURRENCY = concurrency
+    star_bot = bot_module.StarCollectorBot()
+    application = star_bot.build_application(TOKEN, api.base_url)
+    # Users spread evenly through the id range press "start collecting" with a slow connect
+    slow_users = set(range(1, users + 1, round(1 / slow_share))) if slow_share > 0 else set()
+    for user_id in slow_users:
+        await star_bot.db.add_user(user_id)
+        await star_bot.db.update_user_session(user_id, f"account-{user_id}")
+    star_bot.task_handler.client_factory = lambda api_id, api_hash, session: SlowConnectClient(connect_delay)
+
+    stop = asyncio.Event()
+    if mode == 'webhook':
+        runner = asyncio.create_task(star_bot.run_webhook(application, stop))
+        while api.webhook_url is None:
+            await asyncio.sleep(0.01)
+    else:
+        async def poll():
+            # What run_polling does, minus its own event loop and signal handling
+            async with application:
+                await star_bot.post_init(application)
+                await application.updater.start_polling(
+                    poll_interval=0.0, timeout=10, allowed_updates=bot_module.ALLOWED_UPDATES
+                )
+                await application.start()
+                await stop.wait()
+                await application.updater.stop()
+                await application.stop()
+            await star_bot.shutdown(application)
+        runner = asyncio.create_task(poll())
+        while not application.running:
+            await asyncio.sleep(0.01)
+
+    def send(user_id: int):
+        api.user_sends(user_id, bot_module.START_COLLECTING if user_id in slow_users else "/start")
+
+    started = time.monotonic()
+    sent = 0
+    if burst:
+        for user_id in range(1, users + 1):
+            send(user_id)
+        sent = users
+    while not burst and time.monotonic() - started < duration:
+        send(sent % users + 1)
+        sent += 1
+        await asyncio.sleep(max(0.0, started + sent / rate - time.monotonic()))
+    # Let the replies in flight arrive
+    deadline = time.monotonic() + max(10.0, connect_delay * len(slow_users) + 10)
+    while len(api.latencies) < sent and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    stop.set()
+    await runner
+    await api.stop()
+    star_bot.db.close()
+
+    fast = [latency for user_id, latencies in api.latencies_by_user.items() if user_id not in slow_users
+            for latency in latencies]
+
+    report = {
+        'mode': mode,
+        'updates_sent': sent,
+        'replies': len(api.latencies),
+        'latency_p50': _percentile(api.latencies, 50),
+        'latency_p90': _percentile(api.latencies, 90),
+        'latency_p99': _percentile(api.latencies, 99),
+        'latency_max': max(api.latencies, default=0.0),
+        # Replies to users who did not press "start collecting"
+        'fast_latency_p50': _percentile(fast, 50),
+        'fast_latency_p99': _percentile(fast, 99),
+    }
+    for method, count in sorted(api.calls.items()):
+        report[f'calls.{method}'] = count
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update-to-reply latency of the control bot, polling vs webhook")
+    parser.add_argument('--mode', choices=('polling', 'webhook', 'both'), default='both')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=20.0, help="updates per second")
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds to send updates")
+    parser.add_argument('--api-latency', type=float, default=0.05,
+                        help="one-way network delay to the Bot API in seconds")
+    parser.add_argument('--webhook-port', type=int, default=18443)
+    parser.add_argument('--burst', action='store_true', help="every user sends one message at once")
+    parser.add_argument('--slow-share', type=float, default=0.0,
+                        help="share of users pressing start collecting with a slow client connect")
+    parser.add_argument('--connect-delay', type=float, default=2.0, help="seconds a slow connect takes")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="UPDATE_CONCURRENCY to run with; 1 processes updates one by one")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    # bot.py configured logging on import
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    modes = ('polling', 'webhook') if args.mode == 'both' else (args.mode,)
+    for mode in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            report = asyncio.run(run_bench(
+                mode, args.users, args.rate, args.duration, args.api_latency,
+                args.webhook_port, os.path.join(tmp, "bench.db"), args.burst, args.slow_share,
+                args.connect_delay, args.concurrency
+            ))
+        for key, value in report.items():
+            print(f"{key:24s} {value:.3f}" if isinstance(value, float) else f"{key:24s} {value}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs different users' updates concurrently and each user's in arrival order.
+
+    With the default sequential processing, one slow handler (a Telethon
+    connect in start_collection) held up every other user's button press.
+    Here each user has a lock that their updates take in the order the
+    Application received them, so a user's /start, phone number and code
+    are still handled one after another. Updates only start running after
+    taking their user's lock, so a user with a backlog waits on their own
+    lock without occupying one of the ``max_concurrent_updates`` running
+    slots. ``max_pending_updates`` bounds the updates admitted at once,
+    running or waiting. Locks exist only while their user has updates
+    in flight.
+    """
+
+    def __init__(self, max_concurrent_updates: int = 256, max_pending_updates: int = 4096):
+        # The base class's semaphore is taken before do_process_update, so it bounds admission
+        super().__init__(max_pending_updates)
+        self.max_running_updates = max_concurrent_updates
+        self._running: Optional[asyncio.Semaphore] = None
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # user_id -> updates admitted and not finished, including the running one
+        self._pending: Dict[int, int] = {}
+        self.stats = Counter()
+
+    @staticmethod
+    def _user_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        user_id = self._user_key(update)
+        if user_id is None:
+            async with self._running:
+                await coroutine
+            return
+
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        pending = self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        if pending > 1:
+            self.stats['queued_behind_same_user'] += 1
+        try:
+            async with lock:
+                async with self._running:
+                    await coroutine
+        finally:
+            self._pending[user_id] -= 1
+            if not self._pending[user_id]:
+                del self._pending[user_id]
+                del self._locks[user_id]
+
+    async def initialize(self):
+        self._running = asyncio.Semaphore(self.max_running_updates)
+
+    async def shutdown(self):
+        if self._pending:
+            logger.info(f"Update processor shut down with updates of {len(self._pending)} users in flight")
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats['users_in_flight'] = len(self._pending)
+        stats['updates_in_flight'] = sum(self._pending.values())
+        return stats
@@ -0,0 +1,68 @@
+import hmac
+import logging
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """Local HTTP listener that feeds Telegram's webhook POSTs into the Application.
+
+    Updates are pushed by Telegram as they happen instead of being fetched
+    by getUpdates, and each request is answered as soon as its update is
+    queued, so a slow handler never holds up Telegram's delivery. The
+    Application must be initialized and started by the caller. Requests
+    without the configured secret token are rejected.
+    """
+
+    def __init__(self, application: Application, listen: str = '127.0.0.1', port: int = 8443,
+                 path: str = '/telegram', secret_token: Optional[str] = None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self._runner: Optional[web.AppRunner] = None
+        self.stats = Counter()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None and not hmac.compare_digest(
+                request.headers.get(SECRET_TOKEN_HEADER, ''), self.secret_token):
+            self.stats['rejected'] += 1
+            return web.Response(status=403)
+
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            self.stats['invalid'] += 1
+            logger.error(f"Invalid webhook update: {e}")
+            return web.Response(status=400)
+
+        await self.application.update_queue.put(update)
+        self.stats['received'] += 1
+        return web.Response()
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook listener on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats)